@@ -1,11 +1,19 @@
-from PyQt5.QtCore import QObject
+from PyQt5.QtCore import QObject, pyqtSignal
 import os
 import json
 import re
+import threading
+import time
 from datetime import datetime
+from filter_engine import (BlockingStats, DecisionCache, FilterEngine, LiteralMatcher, RegexSet, base_domain,
+                           extract_host, normalize_url, parse_hosts_line)
+from cosmetic_filter import CosmeticFilterIndex
+from filter_snapshot import load_snapshot, save_snapshot, source_digest
+from filter_updater import FilterListUpdater
 
 
 class AdBlocker(QObject):
+    rules_updated = pyqtSignal(int, int)  # rules added, rules removed
     _instance = None
 
     @classmethod
@@ -18,15 +26,29 @@ class AdBlocker(QObject):
         if AdBlocker._instance is not None:
             raise RuntimeError("Use AdBlocker.instance() to access the singleton")
         super().__init__()
+        AdBlocker._instance = self
         self.ad_rules = {
             'domains': set(),
             'regex_rules': [],
-            'custom_rules': []
+            'custom_rules': [],
+            'sources': []
         }
-        self.blocked_count = 0
+        self.filter_engine = FilterEngine()
+        self.decision_cache = DecisionCache()
+        # Bumped on every rule change; stale cached decisions are dropped
+        self.generation = 0
+        self._generation_lock = threading.Lock()
+        self.stats = BlockingStats()
         self.last_updated = datetime.now()
+        self._refresh_thread = None
+        self.allowlist = set()
+        self.literal_matcher = LiteralMatcher()
+        self.cosmetic_filters = CosmeticFilterIndex()
         self._load_rules()
         self._load_default_rules()
+        self._compile_rules()
+        self._load_allowlist()
+        self.regex_set = RegexSet(rule.pattern for rule in self.ad_rules['regex_rules'])
 
     def _load_rules(self):
         """Load ad-blocking rules from file"""
@@ -38,6 +60,7 @@ class AdBlocker(QObject):
                     self.ad_rules['domains'] = set(data.get('domains', []))
                     self.ad_rules['regex_rules'] = [re.compile(rule) for rule in data.get('regex_rules', [])]
                     self.ad_rules['custom_rules'] = data.get('custom_rules', [])
+                    self.ad_rules['sources'] = data.get('sources', [])
                     self.last_updated = datetime.fromisoformat(data.get('last_updated', datetime.now().isoformat()))
         except Exception as e:
             print(f"Error loading adblock rules: {e}")
@@ -61,49 +84,221 @@ class AdBlocker(QObject):
             ]
             self.ad_rules['regex_rules'] = [re.compile(rule) for rule in default_regex]
 
-    def should_block(self, url):
-        """Check if a URL should be blocked"""
-        if not url:
-            return False
+    def _filter_list_paths(self):
+        """Return the filter list and hosts files in the filters directory"""
+        filters_dir = "data/filters"
+        if not os.path.isdir(filters_dir):
+            return []
+        return [os.path.join(filters_dir, name) for name in sorted(os.listdir(filters_dir))
+                if name.endswith(('.txt', '.hosts'))]
+
+    def _load_filter_lists(self, engine, cosmetic_filters):
+        """Load Adblock Plus lists (*.txt) and hosts files (*.hosts) from the filters directory"""
+        for path in self._filter_list_paths():
+            try:
+                with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                    if path.endswith('.txt'):
+                        engine.add_filters(line for line in f if not cosmetic_filters.add_filter(line))
+                    else:
+                        engine.add_domains(domain for line in f for domain in parse_hosts_line(line))
+            except OSError as e:
+                print(f"Error loading filter list {path}: {e}")
+
+    def _build_matchers(self, use_snapshot=True):
+        """Return (filter engine, literal matcher, cosmetic filters), from the snapshot if the sources are unchanged"""
+        snapshot_path = "data/adblock_snapshot.bin"
+        # Only the rule-bearing fields of adblock_rules.json: saving last_updated must not invalidate it
+        rules = json.dumps({
+            'domains': sorted(self.ad_rules['domains']),
+            'regex_rules': [rule.pattern for rule in self.ad_rules['regex_rules']],
+            'custom_rules': self.ad_rules['custom_rules'],
+        }, sort_keys=True).encode()
+        digest = source_digest(self._filter_list_paths(), rules)
+        if use_snapshot:
+            try:
+                loaded = load_snapshot(snapshot_path, digest)
+            except Exception as e:
+                print(f"Error loading adblock snapshot: {e}")
+                loaded = None
+            if loaded is not None:
+                return loaded
+
+        engine = FilterEngine()
+        cosmetic_filters = CosmeticFilterIndex()
+        engine.add_domains(self.ad_rules['domains'])
+        self._load_filter_lists(engine, cosmetic_filters)
+        literal_matcher = LiteralMatcher(self.ad_rules['custom_rules'])
+        try:
+            save_snapshot(snapshot_path, engine, literal_matcher, cosmetic_filters, digest)
+        except Exception as e:
+            print(f"Error saving adblock snapshot: {e}")
+        return engine, literal_matcher, cosmetic_filters
+
+    def _compile_rules(self):
+        """Compile the rule set, or load it from its snapshot"""
+        self.filter_engine, self.literal_matcher, self.cosmetic_filters = self._build_matchers()
+
+    def reload_filter_lists(self):
+        """Recompile the rules after the files in data/filters changed and swap them in"""
+        engine, literal_matcher, cosmetic_filters = self._build_matchers()
+        self.filter_engine = engine
+        self.literal_matcher = literal_matcher
+        self.cosmetic_filters = cosmetic_filters
+        self._rules_changed()
+
+    def _load_allowlist(self):
+        """Load the sites ad blocking is disabled on
 
+        Kept apart from adblock_rules.json so toggling a site does not
+        invalidate the compiled rule snapshot.
+        """
+        allowlist_path = "data/adblock_allowlist.json"
         try:
-            url_lower = url.lower()
-            domain = url_lower.split('/')[2] if len(url_lower.split('/')) > 2 else url_lower
+            if os.path.exists(allowlist_path):
+                with open(allowlist_path, 'r') as f:
+                    self.allowlist = set(json.load(f))
+        except Exception as e:
+            print(f"Error loading adblock allowlist: {e}")
 
-            if domain in self.ad_rules['domains']:
-                self.blocked_count += 1
-                return True
+    def _save_allowlist(self):
+        """Save the sites ad blocking is disabled on"""
+        allowlist_path = "data/adblock_allowlist.json"
+        try:
+            with open(allowlist_path, 'w') as f:
+                json.dump(sorted(self.allowlist), f, indent=4)
+        except Exception as e:
+            print(f"Error saving adblock allowlist: {e}")
 
-            for regex in self.ad_rules['regex_rules']:
-                if regex.match(url_lower):
-                    self.blocked_count += 1
-                    return True
+    def is_site_allowlisted(self, host):
+        """Check whether blocking is disabled for the site a host belongs to"""
+        return bool(host) and base_domain(host.lower()) in self.allowlist
 
-            for rule in self.ad_rules['custom_rules']:
-                if rule in url_lower:
-                    self.blocked_count += 1
-                    return True
+    def set_site_allowlisted(self, host, allowlisted):
+        """Disable (or re-enable) blocking on the site a host belongs to"""
+        if not host:
+            return
+        site = base_domain(host.lower())
+        if allowlisted:
+            self.allowlist.add(site)
+        else:
+            self.allowlist.discard(site)
+        self._save_allowlist()
 
+    def should_block(self, url, resource_type=None, first_party_url=None, first_party_host=None):
+        """Check if a URL should be blocked
+
+        resource_type is an ABP type name ('script', 'image', 'document',
+        ...) and first_party_url (or its already extracted
+        first_party_host) identifies the page making the request. Requests
+        from allowlisted sites and top-level document loads are let through
+        before any rule is evaluated.
+        """
+        if not url or resource_type == 'document':
             return False
+
+        try:
+            start = time.perf_counter_ns()
+            if first_party_host is None and first_party_url:
+                first_party_host = extract_host(first_party_url)
+            if first_party_host and self.is_site_allowlisted(first_party_host):
+                return False
+            key = (normalize_url(url), first_party_host, resource_type)
+            generation = self.generation
+            decision = self.decision_cache.get(key, generation)
+            if decision is None:
+                decision = self._evaluate(key[0], resource_type, first_party_host)
+                self.decision_cache.put(key, decision, generation)
+            blocked, rule_text = decision
+            site = base_domain(first_party_host) if first_party_host else None
+            self.stats.record(rule_text, blocked, site, time.perf_counter_ns() - start)
+            return blocked
         except Exception as e:
             print(f"Error checking URL {url}: {e}")
             return False
 
+    def get_cosmetic_stylesheet(self, host):
+        """Return the element-hiding CSS for pages on host ('' on allowlisted sites)"""
+        if not host or self.is_site_allowlisted(host):
+            return ""
+        return self.cosmetic_filters.stylesheet_for(host)
+
+    def _evaluate(self, url_lower, resource_type, first_party_host):
+        """Run the rule set against a normalized URL; return (blocked, deciding rule text)"""
+        # Read once: a background refresh may swap the matchers at any time
+        engine = self.filter_engine
+        legacy_rule = self.regex_set.match(url_lower) or self.literal_matcher.search(url_lower)
+        if legacy_rule is not None:
+            exception = engine.find_exception(url_lower, resource_type, first_party_host)
+            if exception is not None:
+                return False, exception.text
+            return True, legacy_rule
+
+        rule = engine.match(url_lower, resource_type, first_party_host)
+        if rule is None:
+            return False, None
+        return not rule.is_exception, rule.text
+
+    def _rules_changed(self):
+        """Invalidate cached decisions after the rule set changed"""
+        with self._generation_lock:
+            self.generation += 1
+
     def add_custom_rule(self, rule):
         """Add a custom ad-blocking rule"""
         self.ad_rules['custom_rules'].append(rule)
+        # Copy-on-write: the interceptor thread may be searching the current matcher
+        self.literal_matcher = LiteralMatcher(self.ad_rules['custom_rules'])
+        self._rules_changed()
         self._save_rules()
 
     def remove_custom_rule(self, rule):
         """Remove a custom ad-blocking rule"""
         if rule in self.ad_rules['custom_rules']:
             self.ad_rules['custom_rules'].remove(rule)
+            self.literal_matcher = LiteralMatcher(self.ad_rules['custom_rules'])
+            self._rules_changed()
             self._save_rules()
 
-    def get_blocked_count(self):
-        """Return the number of blocked requests"""
+    @property
+    def blocked_count(self):
+        return self.stats.totals.get('blocked')
+
+    def get_blocked_count(self, site=None):
+        """Return the number of blocked requests, overall or on pages of one site (registrable domain)"""
+        if site is not None:
+            return self.stats.site_blocks.get(site)
         return self.blocked_count
 
+    def reorder_rules(self):
+        """Move the most frequently hit filter rules to the front of their buckets"""
+        self.filter_engine.reorder_by_hits(self.stats.rule_hits.snapshot())
+
+    def get_stats(self):
+        """Return blocking statistics and decision cache counters"""
+        stats = self.stats.to_dict()
+        stats['cache'] = self.decision_cache.stats()
+        stats['rule_count'] = self.filter_engine.rule_count
+        stats['generated'] = datetime.now().isoformat()
+        return stats
+
+    def export_stats(self, path):
+        """Write blocking statistics as JSON for tuning filter lists"""
+        try:
+            with open(path, 'w') as f:
+                json.dump(self.get_stats(), f, indent=4)
+            return True
+        except Exception as e:
+            print(f"Error exporting adblock stats: {e}")
+            return False
+
+    def get_cache_stats(self):
+        """Return decision cache hit/miss counters"""
+        return self.decision_cache.stats()
+
+    def clear_decision_cache(self):
+        """Forget cached decisions so the next lookups evaluate the rules again"""
+        self.decision_cache.clear()
+
     def _save_rules(self):
         """Save ad-blocking rules to file"""
         rules_path = "data/adblock_rules.json"
@@ -112,6 +307,7 @@ class AdBlocker(QObject):
                 'domains': list(self.ad_rules['domains']),
                 'regex_rules': [rule.pattern for rule in self.ad_rules['regex_rules']],
                 'custom_rules': self.ad_rules['custom_rules'],
+                'sources': self.ad_rules['sources'],
                 'last_updated': self.last_updated.isoformat()
             }
             with open(rules_path, 'w') as f:
@@ -120,6 +316,33 @@ class AdBlocker(QObject):
             print(f"Error saving adblock rules: {e}")
 
     def update_rules(self):
-        """Update ad-blocking rules"""
-        self.last_updated = datetime.now()
-        self._save_rules()
+        """Refresh filter lists from their sources on a background thread
+
+        Returns False if a refresh is already running. rules_updated is
+        emitted once the new rules are live.
+        """
+        if self._refresh_thread is not None and self._refresh_thread.is_alive():
+            return False
+        self._refresh_thread = threading.Thread(target=self._refresh_rules, name="AdBlockRefresh", daemon=True)
+        self._refresh_thread.start()
+        return True
+
+    def _refresh_rules(self):
+        """Fetch changed lists, compile them off the GUI thread and swap the matcher in"""
+        try:
+            updates = FilterListUpdater(self.ad_rules['sources']).refresh()
+            added = sum(update.added for update in updates)
+            removed = sum(update.removed for update in updates)
+            if any(update.changed for update in updates):
+                engine, literal_matcher, cosmetic_filters = self._build_matchers(use_snapshot=False)
+                # Rebinding the attributes is atomic; in-flight should_block
+                # calls finish against the matcher they already hold
+                self.filter_engine = engine
+                self.literal_matcher = literal_matcher
+                self.cosmetic_filters = cosmetic_filters
+                self._rules_changed()
+            self.last_updated = datetime.now()
+            self._save_rules()
+            self.rules_updated.emit(added, removed)
+        except Exception as e:
+            print(f"Error updating adblock rules: {e}")
@@ -0,0 +1,213 @@
+import heapq
+import itertools
+import math
+import re
+import sys
+import threading
+import time
+from bisect import bisect_left, insort
+
+# Frecency: visits (a bookmark counts as BOOKMARK_WEIGHT visits) halved every HALF_LIFE_DAYS.
+# A bookmark's weight is dated no earlier than when the page was indexed as bookmarked, so a
+# never-visited bookmark still outranks pages visited only once or twice recently
+HALF_LIFE_DAYS = 14
+BOOKMARK_WEIGHT = 5
+MAX_TOKEN_LENGTH = 32
+# Words matching more pages than this are answered by walking pages in frecency order
+CANDIDATE_LIMIT = 5000
+# Pages the frecency walk may visit before giving up with what it has
+SCAN_LIMIT = 20000
+
+WORD_RE = re.compile(r"[^\W_]+")
+SCHEME_RE = re.compile(r"^[a-z][a-z0-9+.-]*://")
+IGNORED_TOKENS = frozenset(('www', 'http', 'https', 'html', 'htm', 'php'))
+
+
+def frecency_rank(visit_count, last_visit, bookmarked=False):
+    """Sort key for (visits + bookmark weight) * 2^(-age / half-life)
+
+    The decay factor is common to every page at a given moment, so ranking
+    by log2(weight) + last_visit / half-life gives the same order at any
+    time and the key never has to be recomputed as pages age.
+    """
+    weight = visit_count + (BOOKMARK_WEIGHT if bookmarked else 0)
+    return math.log2(max(weight, 1)) + last_visit / (HALF_LIFE_DAYS * 86400)
+
+
+def page_tokens(url, title):
+    """Lowercase host labels, path segments and title words of a page"""
+    text = SCHEME_RE.sub('', url.lower()) + ' ' + (title or '').lower()
+    tokens = set()
+    for word in WORD_RE.findall(text):
+        if len(word) <= MAX_TOKEN_LENGTH and word not in IGNORED_TOKENS:
+            tokens.add(sys.intern(word))
+    return tuple(tokens)
+
+
+class AutocompleteEntry:
+    __slots__ = ('url', 'title', 'visit_count', 'last_visit', 'bookmarked', 'bookmarked_at', 'tokens', 'rank')
+
+    def __init__(self, url):
+        self.url = url
+        self.title = None
+        self.visit_count = 0
+        self.last_visit = 0.0
+        self.bookmarked = False
+        self.bookmarked_at = 0.0
+        self.tokens = ()
+        self.rank = 0.0
+
+    def matches(self, words):
+        """True if every word is a prefix of one of the page's tokens"""
+        tokens = self.tokens
+        return all(any(token.startswith(word) for token in tokens) for word in words)
+
+
+class AutocompleteIndex:
+    """In-memory prefix index of history and bookmarks ranked by frecency
+
+    Tokens are kept in a sorted list with a posting set of pages per token,
+    so the pages for a typed prefix are a bisect plus a range scan. Pages
+    are also kept in frecency order for prefixes too common to collect.
+    Safe to update from the GUI thread while another thread queries.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}      # url -> AutocompleteEntry
+        self._postings = {}     # token -> set of entries
+        self._tokens = []       # sorted tokens of _postings
+        self._ranked = []       # sorted (-rank, url)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _index_tokens(self, entry, tokens, keep_sorted=True):
+        for token in entry.tokens:
+            if token in tokens:
+                continue
+            pages = self._postings[token]
+            pages.discard(entry)
+            if not pages:
+                del self._postings[token]
+                if keep_sorted:
+                    del self._tokens[bisect_left(self._tokens, token)]
+        for token in tokens:
+            pages = self._postings.get(token)
+            if pages is None:
+                pages = self._postings[token] = set()
+                if keep_sorted:
+                    insort(self._tokens, token)
+            pages.add(entry)
+        entry.tokens = tokens
+
+    def _update(self, url, title, visits, last_visit, bookmarked, keep_sorted=True):
+        """Apply a change to one page, creating or dropping its entry as needed"""
+        entry = self._entries.get(url)
+        if entry is None:
+            entry = self._entries[url] = AutocompleteEntry(url)
+        elif keep_sorted:
+            del self._ranked[bisect_left(self._ranked, (-entry.rank, url))]
+        entry.visit_count += visits
+        entry.last_visit = max(entry.last_visit, last_visit)
+        if bookmarked is not None:
+            if bookmarked and not entry.bookmarked:
+                entry.bookmarked_at = time.time()
+            entry.bookmarked = bookmarked
+        if title and title != entry.title or not entry.tokens:
+            entry.title = title or entry.title
+            self._index_tokens(entry, page_tokens(url, entry.title), keep_sorted)
+
+        if entry.visit_count <= 0 and not entry.bookmarked:
+            self._index_tokens(entry, (), keep_sorted)
+            del self._entries[url]
+            return
+        last_visit = max(entry.last_visit, entry.bookmarked_at) if entry.bookmarked else entry.last_visit
+        entry.rank = frecency_rank(entry.visit_count, last_visit, entry.bookmarked)
+        if keep_sorted:
+            insort(self._ranked, (-entry.rank, url))
+
+    def load(self, history_rows=(), bookmarks=()):
+        """Bulk add (url, title, visit_count, last_visit) history rows and (url, title) bookmarks"""
+        with self._lock:
+            for url, title, visit_count, last_visit in history_rows:
+                self._update(url, title, visit_count, last_visit, None, keep_sorted=False)
+            for url, title in bookmarks:
+                self._update(url, title, 0, 0.0, True, keep_sorted=False)
+            self._tokens = sorted(self._postings)
+            self._ranked = sorted((-entry.rank, url) for url, entry in self._entries.items())
+
+    def record_visit(self, url, title, visit_time):
+        """Count a visit (visit_time in epoch seconds)"""
+        with self._lock:
+            self._update(url, title, 1, visit_time, None)
+
+    def set_bookmarked(self, url, title, bookmarked):
+        with self._lock:
+            if bookmarked or url in self._entries:
+                self._update(url, title, 0, 0.0, bookmarked)
+
+    def set_title(self, url, title):
+        with self._lock:
+            if url in self._entries:
+                self._update(url, title, 0, 0.0, None)
+
+    def remove_history(self, url):
+        """Forget the visits to url, keeping it if it is bookmarked"""
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is not None:
+                self._update(url, None, -entry.visit_count, 0.0, None)
+
+    def clear_history(self):
+        """Forget all visits, keeping bookmarked pages"""
+        with self._lock:
+            bookmarks = [(entry.url, entry.title) for entry in self._entries.values() if entry.bookmarked]
+        fresh = AutocompleteIndex()
+        fresh.load(bookmarks=bookmarks)
+        with self._lock:
+            self._entries, self._postings = fresh._entries, fresh._postings
+            self._tokens, self._ranked = fresh._tokens, fresh._ranked
+
+    def _candidates(self, word):
+        """Pages with a token starting with word, or None if there are too many"""
+        tokens = self._tokens
+        postings = self._postings
+        pages = set()
+        for i in range(bisect_left(tokens, word), len(tokens)):
+            token = tokens[i]
+            if not token.startswith(word):
+                break
+            pages |= postings[token]
+            if len(pages) > CANDIDATE_LIMIT:
+                return None
+        return pages
+
+    def query(self, text, limit=8):
+        """Top pages matching every word of text, as (url, title, bookmarked)"""
+        words = list(dict.fromkeys(WORD_RE.findall(SCHEME_RE.sub('', text.lower()))))
+        words = [word for word in words if word not in IGNORED_TOKENS] or words
+        if not words:
+            return []
+        with self._lock:
+            best = None
+            # Longest words first: they are usually the most selective
+            for word in sorted(words, key=len, reverse=True):
+                pages = self._candidates(word)
+                if pages is not None and (best is None or len(pages) < len(best)):
+                    best = pages
+                    if len(best) <= limit:
+                        break
+            if best is not None:
+                matches = heapq.nlargest(limit, (entry for entry in best if entry.matches(words)),
+                                         key=lambda entry: entry.rank)
+            else:
+                matches = []
+                entries = self._entries
+                for _, url in itertools.islice(self._ranked, SCAN_LIMIT):
+                    entry = entries[url]
+                    if entry.matches(words):
+                        matches.append(entry)
+                        if len(matches) == limit:
+                            break
+            return [(entry.url, entry.title, entry.bookmarked) for entry in matches]
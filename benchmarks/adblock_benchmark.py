@@ -0,0 +1,272 @@
+"""Ad-blocker throughput benchmark.
+
+Replays a corpus of requests (URL, resource type, first-party URL) against
+filter lists of several sizes and reports decisions/sec, p50/p99 latency,
+memory footprint and decision cache hit rate. Runs headless and offline:
+the corpus and lists are synthetic unless --corpus / --filter-list are
+given. Each list is loaded into a real AdBlocker in a temporary profile
+directory and requests go through AdBlocker.should_block, so the legacy
+regex and literal rules, the allowlist check, the decision cache and the
+statistics are all measured. AdBlocker is a QObject, so PyQt5 must be
+installed, but no QApplication is needed.
+
+    python benchmarks/adblock_benchmark.py --output adblock_bench.json
+    python benchmarks/adblock_benchmark.py --baseline adblock_bench.json
+
+A corpus file is JSON lines: {"url": ..., "type": "script", "first_party": ...}.
+Exits with status 1 when a threshold or baseline comparison fails.
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ad_blocker import AdBlocker  # noqa: E402
+from filter_engine import extract_host  # noqa: E402
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+RESOURCE_TYPES = ('script', 'image', 'stylesheet', 'xmlhttprequest', 'subdocument', 'font', 'media', 'ping')
+# Defaults checked when no baseline is given
+DEFAULT_MIN_DECISIONS_PER_SEC = 100000
+DEFAULT_MIN_UNCACHED_DECISIONS_PER_SEC = 40000
+DEFAULT_MAX_P99_US = 200.0
+
+
+def _word(rng, low=4, high=10):
+    return ''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(low, high)))
+
+
+def synthetic_filter_list(size, seed=1):
+    """EasyList-shaped list: mostly ||domain^, plus path, option, exception and cosmetic rules"""
+    rng = random.Random(seed)
+    lines = ["[Adblock Plus 2.0]", "! Synthetic benchmark list"]
+    for i in range(size):
+        kind = rng.random()
+        domain = f"{_word(rng)}{i}.{rng.choice(('com', 'net', 'io'))}"
+        if kind < 0.45:
+            lines.append(f"||{domain}^")
+        elif kind < 0.60:
+            lines.append(f"||{domain}^$third-party")
+        elif kind < 0.75:
+            lines.append(f"/{_word(rng)}/{_word(rng)}-ad.")
+        elif kind < 0.82:
+            lines.append(f"||{domain}/{_word(rng)}^$script,image")
+        elif kind < 0.87:
+            lines.append(f"&{_word(rng, 3, 6)}_ad=")
+        elif kind < 0.90:
+            lines.append(f"@@||{domain}/{_word(rng)}^")
+        elif kind < 0.95:
+            lines.append(f"##.{_word(rng)}-ad")
+        else:
+            lines.append(f"{domain}##.{_word(rng)}")
+    return lines
+
+
+def synthetic_corpus(rule_lines, count, seed=2):
+    """Requests with Zipf-like repetition; roughly one in eight hits a rule"""
+    rng = random.Random(seed)
+    blocked_hosts = [line[2:-1] for line in rule_lines if line.startswith('||') and line.endswith('^')]
+    sites = [f"{_word(rng)}.com" for _ in range(200)]
+    cdns = [f"cdn.{_word(rng)}.net" for _ in range(500)]
+    unique = []
+    for _ in range(max(1, count // 4)):
+        site = rng.choice(sites)
+        if blocked_hosts and rng.random() < 0.12:
+            host = f"{rng.choice(('', 'stats.', 'ads.'))}{rng.choice(blocked_hosts)}"
+        else:
+            host = rng.choice(cdns + [f"static.{site}"])
+        url = f"https://{host}/{_word(rng)}/{_word(rng)}.{rng.choice(('js', 'png', 'css', 'json'))}"
+        if rng.random() < 0.3:
+            url += f"?v={rng.randint(0, 999)}"
+        unique.append({'url': url, 'type': rng.choice(RESOURCE_TYPES), 'first_party': f"https://{site}/"})
+    weights = [1.0 / (rank + 1) for rank in range(len(unique))]
+    return rng.choices(unique, weights=weights, k=count)
+
+
+def load_corpus(path):
+    with open(path, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def build_blocker(lines):
+    """The AdBlocker with lines as its only filter list; the working directory is the profile"""
+    filters_dir = os.path.join("data", "filters")
+    shutil.rmtree(filters_dir, ignore_errors=True)
+    os.makedirs(filters_dir)
+    with open(os.path.join(filters_dir, "benchmark.txt"), 'w', encoding='utf-8') as f:
+        f.write("\n".join(lines) + "\n")
+    blocker = AdBlocker.instance()
+    blocker.reload_filter_lists()
+    return blocker
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_case(lines, corpus, label):
+    """Benchmark one filter list against the corpus"""
+    gc.collect()
+    tracemalloc.start()
+    build_start = time.perf_counter()
+    blocker = build_blocker(lines)
+    build_seconds = time.perf_counter() - build_start
+    memory_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    requests = [(r['url'], r.get('type') or 'other', extract_host(r.get('first_party') or '') or None)
+                for r in corpus]
+
+    # Uncached throughput: each distinct request once, against an empty decision cache
+    should_block = blocker.should_block
+    unique = list(dict.fromkeys(requests))
+    blocker.clear_decision_cache()
+    start = time.perf_counter()
+    for url, resource_type, first_party_host in unique:
+        should_block(url, resource_type, first_party_host=first_party_host)
+    uncached_seconds = time.perf_counter() - start
+
+    # Interceptor path as replayed: repeats are served from the decision cache
+    blocker.clear_decision_cache()
+    cache_before = blocker.get_cache_stats()
+    latencies = []
+    blocked = 0
+    clock = time.perf_counter_ns
+    start = time.perf_counter()
+    for url, resource_type, first_party_host in requests:
+        t0 = clock()
+        if should_block(url, resource_type, first_party_host=first_party_host):
+            blocked += 1
+        latencies.append(clock() - t0)
+    cached_seconds = time.perf_counter() - start
+    latencies.sort()
+    cache_after = blocker.get_cache_stats()
+    hits = cache_after['hits'] - cache_before['hits']
+    lookups = hits + cache_after['misses'] - cache_before['misses']
+
+    hosts = {extract_host(r.get('first_party') or '') for r in corpus}
+    start = time.perf_counter()
+    for host in hosts:
+        blocker.get_cosmetic_stylesheet(host)
+    stylesheet_ms = (time.perf_counter() - start) * 1000 / max(1, len(hosts))
+
+    count = len(requests)
+    return {
+        'label': label,
+        'rules': blocker.filter_engine.rule_count + blocker.cosmetic_filters.rule_count,
+        'requests': count,
+        'blocked_fraction': blocked / count if count else 0.0,
+        'build_seconds': round(build_seconds, 4),
+        'memory_mb': round(memory_bytes / 1e6, 2),
+        'uncached_decisions_per_sec': round(len(unique) / uncached_seconds) if uncached_seconds else 0,
+        'decisions_per_sec': round(count / cached_seconds) if cached_seconds else 0,
+        'p50_us': round(percentile(latencies, 0.50) / 1000, 2),
+        'p99_us': round(percentile(latencies, 0.99) / 1000, 2),
+        'cache_hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+        'stylesheet_ms_per_host': round(stylesheet_ms, 3),
+    }
+
+
+def check(results, baseline=None, max_regression=0.2, max_p99_regression=0.5,
+          min_decisions_per_sec=DEFAULT_MIN_DECISIONS_PER_SEC, max_p99_us=DEFAULT_MAX_P99_US,
+          min_uncached_decisions_per_sec=DEFAULT_MIN_UNCACHED_DECISIONS_PER_SEC):
+    """Return a list of failure messages"""
+    failures = []
+    previous = {case['label']: case for case in (baseline or {}).get('results', [])}
+    for case in results:
+        label = case['label']
+        if case['decisions_per_sec'] < min_decisions_per_sec:
+            failures.append(f"{label}: {case['decisions_per_sec']} decisions/sec < {min_decisions_per_sec}")
+        if case['uncached_decisions_per_sec'] < min_uncached_decisions_per_sec:
+            failures.append(f"{label}: {case['uncached_decisions_per_sec']} uncached decisions/sec "
+                            f"< {min_uncached_decisions_per_sec}")
+        if case['p99_us'] > max_p99_us:
+            failures.append(f"{label}: p99 {case['p99_us']} us > {max_p99_us} us")
+        old = previous.get(label)
+        if old:
+            floor = old['uncached_decisions_per_sec'] * (1 - max_regression)
+            if case['uncached_decisions_per_sec'] < floor:
+                failures.append(f"{label}: uncached throughput {case['uncached_decisions_per_sec']}/s "
+                                f"regressed from {old['uncached_decisions_per_sec']}/s")
+            ceiling = old['p99_us'] * (1 + max_p99_regression)
+            if case['p99_us'] > ceiling:
+                failures.append(f"{label}: p99 {case['p99_us']} us regressed from {old['p99_us']} us")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the ad-block matcher")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES),
+                        help="synthetic filter list sizes to test")
+    parser.add_argument('--filter-list', action='append', default=[],
+                        help="real filter list file to test (repeatable)")
+    parser.add_argument('--corpus', help="JSON lines request corpus to replay")
+    parser.add_argument('--requests', type=int, default=100000, help="synthetic corpus size")
+    parser.add_argument('--output', help="write results as JSON to this path")
+    parser.add_argument('--baseline', help="previous results JSON to compare against")
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help="allowed fractional drop in throughput against the baseline")
+    parser.add_argument('--max-p99-regression', type=float, default=0.5,
+                        help="allowed fractional rise in p99 latency against the baseline")
+    parser.add_argument('--min-decisions-per-sec', type=int, default=DEFAULT_MIN_DECISIONS_PER_SEC)
+    parser.add_argument('--max-p99-us', type=float, default=DEFAULT_MAX_P99_US)
+    parser.add_argument('--min-uncached-decisions-per-sec', type=int,
+                        default=DEFAULT_MIN_UNCACHED_DECISIONS_PER_SEC)
+    args = parser.parse_args(argv)
+
+    cases = [(f"synthetic-{size}", synthetic_filter_list(size)) for size in args.sizes]
+    for path in args.filter_list:
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            cases.append((os.path.basename(path), f.read().splitlines()))
+    given_corpus = load_corpus(args.corpus) if args.corpus else None
+
+    results = []
+    # AdBlocker reads and writes its rules under data/; keep that in a throwaway profile
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="apex-adblock-bench-")
+    os.chdir(workdir)
+    try:
+        for label, lines in cases:
+            corpus = given_corpus or synthetic_corpus(lines, args.requests)
+            case = run_case(lines, corpus, label)
+            results.append(case)
+            print(f"{label:>20}: {case['decisions_per_sec']:>9}/s cached, "
+                  f"{case['uncached_decisions_per_sec']:>9}/s uncached, p50 {case['p50_us']} us, "
+                  f"p99 {case['p99_us']} us, {case['memory_mb']} MB, hit rate {case['cache_hit_rate']:.1%}")
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'python': sys.version.split()[0],
+        'generated': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+    failures = check(results, baseline, args.max_regression, args.max_p99_regression,
+                     args.min_decisions_per_sec, args.max_p99_us, args.min_uncached_decisions_per_sec)
+    for failure in failures:
+        print(f"FAIL {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
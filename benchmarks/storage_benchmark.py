@@ -0,0 +1,452 @@
+"""Storage-layer benchmark for the history, bookmark and download managers.
+
+Builds a synthetic profile (by default 1M history visits, 100k tagged
+bookmarks and 50k download records) in a scratch directory and measures
+each manager's public API: insert throughput, search/lookup latency,
+load and save time, and resident memory. Runs headless and offline; the
+managers use their usual data/ paths relative to the scratch directory.
+
+    python benchmarks/storage_benchmark.py --output storage_bench.json
+    python benchmarks/storage_benchmark.py --baseline storage_bench.json
+
+The download case needs PyQt5 and is reported as skipped without it.
+Exits with status 1 when a threshold or baseline comparison fails.
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import psutil
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from history_manager import HistoryManager  # noqa: E402
+from bookmark_manager import BookmarkManager  # noqa: E402
+
+DEFAULT_VISITS = 1000000
+DEFAULT_BOOKMARKS = 100000
+DEFAULT_DOWNLOADS = 50000
+# Operations timed individually for latency percentiles
+DEFAULT_QUERIES = 200
+# Mutations timed on top of the full bookmark and download profiles
+DEFAULT_MUTATIONS = 20
+# Size of the local file fetched by each timed download
+DOWNLOAD_BYTES = 1 << 20
+DOWNLOAD_TIMEOUT_MS = 30000
+# Metrics compared against a baseline, and which way is better
+HIGHER_IS_BETTER = ('inserts_per_sec', 'imports_per_sec', 'fuzzy_recall')
+LOWER_IS_BETTER = ('load_seconds', 'reload_seconds', 'save_seconds', 'search_p99_ms', 'fuzzy_search_p99_ms',
+                   'lookup_p99_ms', 'top_sites_p99_ms', 'mutation_p99_ms', 'bulk_edit_ms')
+# Absolute limits checked when no baseline is given
+DEFAULT_LIMITS = {
+    'history': {'search_p99_ms': 50.0, 'lookup_p99_ms': 20.0, 'top_sites_p99_ms': 200.0},
+    'bookmarks': {'load_seconds': 10.0, 'fuzzy_search_p99_ms': 5.0},
+    'downloads': {'load_seconds': 10.0},
+}
+# Lower bounds checked the same way
+DEFAULT_MINIMUMS = {
+    'bookmarks': {'fuzzy_recall': 0.95},
+}
+WORDS = ('news', 'docs', 'python', 'weather', 'video', 'music', 'shop', 'mail', 'maps', 'travel',
+         'recipe', 'sport', 'finance', 'code', 'review', 'forum', 'blog', 'search', 'photo', 'game')
+
+
+def rss_mb():
+    """Current resident set size in MB"""
+    return psutil.Process().memory_info().rss / 1e6
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def timed(calls):
+    """Run each zero-argument call, returning the sorted latencies in milliseconds"""
+    latencies = []
+    for call in calls:
+        start = time.perf_counter()
+        call()
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return latencies
+
+
+def synthetic_pages(rng, count):
+    """(url, title) pages spread over count // 20 sites"""
+    sites = [f"{rng.choice(WORDS)}{i}.{rng.choice(('com', 'org', 'net'))}" for i in range(max(1, count // 20))]
+    pages = []
+    for i in range(count):
+        words = rng.sample(WORDS, 3)
+        pages.append((f"https://{rng.choice(sites)}/{words[0]}/{i}", f"{words[1].title()} {words[2]} {i}"))
+    return pages
+
+
+def write_visit_export(path, pages, count, rng):
+    """A JSON lines history export of count visits over the last year, Zipf-distributed over pages"""
+    weights = [1.0 / (rank + 1) for rank in range(len(pages))]
+    now_us = int(time.time() * 1e6)
+    year_us = 365 * 86400 * 1000000
+    with open(path, 'w', encoding='utf-8') as f:
+        while count > 0:
+            batch = min(10000, count)
+            count -= batch
+            for url, title in rng.choices(pages, weights=weights, k=batch):
+                f.write(json.dumps({'url': url, 'title': title, 'visit_time': now_us - rng.randrange(year_us),
+                                    'transition': 0}) + "\n")
+
+
+def run_history(visits, queries, rng):
+    pages = synthetic_pages(rng, max(1, visits // 10))
+    gc.collect()
+    rss_before = rss_mb()
+    manager = HistoryManager()
+    # Keep the background retention run from pruning the profile mid-measurement
+    manager.set_retention(max_age_days=None, max_visits=None)
+
+    # Live browsing path: add_entry through the writer queue
+    live = min(visits, 100000)
+    start = time.perf_counter()
+    for url, title in rng.choices(pages, k=live):
+        manager.add_entry(url, title)
+    manager.flush(timeout=None)
+    insert_seconds = time.perf_counter() - start
+
+    # The rest of the profile goes through the bulk import path
+    write_visit_export("history_profile.jsonl", pages, visits - live, rng)
+    start = time.perf_counter()
+    manager.import_history("history_profile.jsonl", source_format='jsonl', wait=True)
+    import_seconds = time.perf_counter() - start
+    os.remove("history_profile.jsonl")
+
+    terms = [title.split()[0] for _, title in rng.sample(pages, min(queries, len(pages)))]
+    search = timed([lambda term=term: manager.search_history(term, 50) for term in terms])
+    prefix = timed([lambda term=term: manager.search_history(term[:3], 50) for term in terms])
+
+    # Paging deep into history, then the rollup-backed all-time report
+    pages_read = []
+    after = None
+    for _ in range(queries):
+        start = time.perf_counter()
+        _, after = manager.get_visits_page('time', True, after, 200)
+        pages_read.append((time.perf_counter() - start) * 1000)
+        if after is None:
+            break
+    pages_read.sort()
+    reports = timed([lambda: manager.top_sites(limit=20)] * 20)
+    rss_loaded = rss_mb()
+
+    start = time.perf_counter()
+    exported = manager.export_history("history_export.jsonl")
+    export_seconds = time.perf_counter() - start
+    os.remove("history_export.jsonl")
+    manager.close()
+
+    start = time.perf_counter()
+    manager = HistoryManager()
+    walked = sum(1 for _ in manager.iter_urls())
+    load_seconds = time.perf_counter() - start
+    manager.close()
+
+    return {
+        'label': 'history',
+        'records': visits,
+        'pages': walked,
+        'inserts_per_sec': round(live / insert_seconds) if insert_seconds else 0,
+        'imports_per_sec': round((visits - live) / import_seconds) if import_seconds else 0,
+        'search_p50_ms': round(percentile(search, 0.50), 3),
+        'search_p99_ms': round(percentile(search, 0.99), 3),
+        'prefix_search_p99_ms': round(percentile(prefix, 0.99), 3),
+        'lookup_p50_ms': round(percentile(pages_read, 0.50), 3),
+        'lookup_p99_ms': round(percentile(pages_read, 0.99), 3),
+        'top_sites_p99_ms': round(percentile(reports, 0.99), 3),
+        'load_seconds': round(load_seconds, 3),
+        'save_seconds': round(export_seconds, 3),
+        'exported': exported,
+        'db_mb': round(os.path.getsize("data/history.db") / 1e6, 2),
+        'rss_mb': round(rss_loaded - rss_before, 2),
+    }
+
+
+def with_typo(rng, word):
+    """word with two adjacent letters swapped"""
+    i = rng.randrange(len(word) - 1)
+    return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+
+
+def write_bookmark_profile(count, rng):
+    tags = [f"{word}-{i}" for i in range(max(1, count // 500)) for word in WORDS[:5]]
+    start = datetime.now() - timedelta(days=3650)
+    bookmarks = []
+    for url, title in synthetic_pages(rng, count):
+        bookmarks.append({
+            'url': url,
+            'title': title,
+            'date_added': (start + timedelta(seconds=rng.randrange(3650 * 86400))).isoformat(),
+            'tags': rng.sample(tags, rng.randint(0, 3)),
+        })
+    with open("data/bookmarks.json", 'w') as f:
+        json.dump({'bookmarks': bookmarks, 'tags': tags}, f, indent=4)
+    return [bookmark['url'] for bookmark in bookmarks], tags
+
+
+def write_bookmark_html(pages, folders, rng, path):
+    """Netscape bookmark HTML of pages spread over nested folders, as browsers export it"""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("<!DOCTYPE NETSCAPE-Bookmark-file-1>\n<TITLE>Bookmarks</TITLE>\n<H1>Bookmarks</H1>\n<DL><p>\n")
+        for i in range(0, len(pages), 100):
+            folder, subfolder = rng.choice(folders), rng.choice(folders)
+            f.write(f"<DT><H3>{folder}</H3>\n<DL><p>\n<DT><H3>{subfolder}</H3>\n<DL><p>\n")
+            for url, title in pages[i:i + 100]:
+                f.write(f'<DT><A HREF="{url}" ADD_DATE="{rng.randrange(1, 1 << 31)}">{title}</A>\n')
+            f.write("</DL><p>\n</DL><p>\n")
+        f.write("</DL><p>\n")
+
+
+def run_bookmarks(count, queries, mutations, rng):
+    urls, tags = write_bookmark_profile(count, rng)
+    gc.collect()
+    rss_before = rss_mb()
+    start = time.perf_counter()
+    manager = BookmarkManager()
+    load_seconds = time.perf_counter() - start
+    rss_loaded = rss_mb()
+
+    # Edits go to the journal; a full save only happens when it is compacted into a snapshot
+    start = time.perf_counter()
+    manager.compact()
+    save_seconds = time.perf_counter() - start
+
+    by_tag = timed([lambda tag=tag: manager.get_bookmarks_by_tag(tag) for tag in rng.choices(tags, k=queries)])
+    # Typed prefixes, misspellings, two-word and tag-filtered searches in equal parts
+    searches = []
+    for i in range(queries):
+        word = rng.choice(WORDS)
+        searches.append((word[:3], with_typo(rng, word), f"{rng.choice(WORDS)} {with_typo(rng, word)}",
+                         f"tag:{rng.choice(tags)} {word}")[i % 4])
+    fuzzy = timed([lambda text=text: manager.search_bookmarks(text, 10) for text in searches])
+    # Every one-transposition misspelling of every word should still find pages with that word
+    misspellings = [(word, word[:i] + word[i + 1] + word[i] + word[i + 2:])
+                    for word in WORDS for i in range(len(word) - 1)]
+    found = sum(any(word in f"{bookmark['url']} {bookmark['title']}".lower()
+                    for bookmark in manager.search_bookmarks(typo, 10))
+                for word, typo in misspellings)
+    # Every mutation is journaled with its own fsync, so the insert rate includes one
+    new_pages = synthetic_pages(random.Random(rng.random()), mutations)
+    inserts = timed([lambda url=url, title=title: manager.add_bookmark(f"{url}/new", title, [rng.choice(tags)])
+                     for url, title in new_pages])
+    changes = timed([lambda url=url: manager.add_tag(url, "benchmark") for url in rng.sample(urls, mutations)] +
+                    [lambda url=url: manager.remove_bookmark(url) for url in rng.sample(urls, mutations)])
+
+    start = time.perf_counter()
+    with manager.batch():
+        for url in urls[:10000]:
+            manager.add_tag(url, "bulk")
+    bulk_edit_ms = (time.perf_counter() - start) * 1000
+
+    # A fifth as many bookmarks again, plus some already saved, from another browser's export
+    imported = synthetic_pages(random.Random(rng.random()), max(1, count // 5))
+    imported = [(f"{url}/imported", title) for url, title in imported]
+    write_bookmark_html(imported + [(url, "") for url in rng.sample(urls, min(len(urls), 1000))],
+                        tags, rng, "bookmarks.html")
+    start = time.perf_counter()
+    manager.import_bookmarks("bookmarks.html")
+    import_seconds = time.perf_counter() - start
+
+    # Loading again replays the journal written since the snapshot
+    start = time.perf_counter()
+    BookmarkManager()
+    reload_seconds = time.perf_counter() - start
+
+    return {
+        'label': 'bookmarks',
+        'records': count,
+        'inserts_per_sec': round(len(inserts) * 1000 / sum(inserts)) if inserts else 0,
+        'search_p50_ms': round(percentile(by_tag, 0.50), 3),
+        'search_p99_ms': round(percentile(by_tag, 0.99), 3),
+        'fuzzy_search_p50_ms': round(percentile(fuzzy, 0.50), 3),
+        'fuzzy_search_p99_ms': round(percentile(fuzzy, 0.99), 3),
+        'fuzzy_recall': round(found / len(misspellings), 4),
+        'mutation_p99_ms': round(percentile(changes, 0.99), 3),
+        'bulk_edit_ms': round(bulk_edit_ms, 3),
+        'imports_per_sec': round((len(imported) + min(len(urls), 1000)) / import_seconds),
+        'load_seconds': round(load_seconds, 3),
+        'reload_seconds': round(reload_seconds, 3),
+        'save_seconds': round(save_seconds, 3),
+        'file_mb': round(os.path.getsize("data/bookmarks.json") / 1e6, 2),
+        'rss_mb': round(rss_loaded - rss_before, 2),
+    }
+
+
+def run_downloads(count, mutations, rng):
+    try:
+        from PyQt5.QtCore import QCoreApplication, QEventLoop, QTimer, QUrl
+        from download_manager import DownloadManager
+    except ImportError as e:
+        return {'label': 'downloads', 'skipped': str(e)}
+
+    # Kept referenced so the network replies have an event loop to run on
+    app = QCoreApplication.instance() or QCoreApplication([])  # noqa: F841
+    start_date = datetime.now() - timedelta(days=1000)
+    records = []
+    for url, _ in synthetic_pages(rng, count):
+        name = url.rsplit('/', 2)[-2] + ".bin"
+        records.append({
+            'url': f"{url}/{name}",
+            'path': os.path.join("downloads", name),
+            'date': (start_date + timedelta(seconds=rng.randrange(1000 * 86400))).isoformat(),
+            'size': rng.randrange(1 << 30),
+        })
+    with open("data/downloads.json", 'w') as f:
+        json.dump(records, f, indent=4)
+
+    gc.collect()
+    rss_before = rss_mb()
+    start = time.perf_counter()
+    manager = DownloadManager()
+    load_seconds = time.perf_counter() - start
+    rss_loaded = rss_mb()
+
+    # Each insert is a real download of a local file: start_download streams it
+    # to disk, and finishing it appends the record and saves the history
+    os.makedirs("downloads", exist_ok=True)
+    with open("download_source.bin", 'wb') as f:
+        f.write(os.urandom(DOWNLOAD_BYTES))
+    source = QUrl.fromLocalFile(os.path.abspath("download_source.bin")).toString()
+    loop = QEventLoop()
+    finished = []
+    manager.download_finished.connect(lambda path, success: (finished.append(success), loop.quit()))
+
+    def download():
+        finished.clear()
+        manager.start_download(source)
+        if not finished:
+            QTimer.singleShot(DOWNLOAD_TIMEOUT_MS, loop.quit)
+            loop.exec_()
+        if not finished or not finished[0]:
+            raise RuntimeError("benchmark download did not complete")
+    inserts = timed([download] * mutations)
+    lookups = timed([manager.get_download_history] * mutations)
+
+    return {
+        'label': 'downloads',
+        'records': count,
+        'inserts_per_sec': round(len(inserts) * 1000 / sum(inserts)) if inserts else 0,
+        'lookup_p99_ms': round(percentile(lookups, 0.99), 3),
+        'load_seconds': round(load_seconds, 3),
+        'file_mb': round(os.path.getsize("data/downloads.json") / 1e6, 2),
+        'rss_mb': round(rss_loaded - rss_before, 2),
+    }
+
+
+def check(results, baseline=None, max_regression=0.2, max_latency_regression=0.5, limits=None, minimums=None):
+    """Return a list of failure messages"""
+    failures = []
+    limits = DEFAULT_LIMITS if limits is None else limits
+    minimums = DEFAULT_MINIMUMS if minimums is None else minimums
+    previous = {case['label']: case for case in (baseline or {}).get('results', [])}
+    for case in results:
+        label = case['label']
+        if 'skipped' in case:
+            continue
+        for metric, limit in limits.get(label, {}).items():
+            if metric in case and case[metric] > limit:
+                failures.append(f"{label}: {metric} {case[metric]} > {limit}")
+        for metric, limit in minimums.get(label, {}).items():
+            if metric in case and case[metric] < limit:
+                failures.append(f"{label}: {metric} {case[metric]} < {limit}")
+        old = previous.get(label)
+        if not old or 'skipped' in old:
+            continue
+        for metric in HIGHER_IS_BETTER:
+            if metric in case and metric in old and case[metric] < old[metric] * (1 - max_regression):
+                failures.append(f"{label}: {metric} {case[metric]} regressed from {old[metric]}")
+        for metric in LOWER_IS_BETTER:
+            if metric in case and metric in old and case[metric] > old[metric] * (1 + max_latency_regression):
+                failures.append(f"{label}: {metric} {case[metric]} regressed from {old[metric]}")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the history, bookmark and download managers")
+    parser.add_argument('--visits', type=int, default=DEFAULT_VISITS, help="history visits in the profile")
+    parser.add_argument('--bookmarks', type=int, default=DEFAULT_BOOKMARKS, help="bookmarks in the profile")
+    parser.add_argument('--downloads', type=int, default=DEFAULT_DOWNLOADS, help="download records in the profile")
+    parser.add_argument('--queries', type=int, default=DEFAULT_QUERIES, help="searches timed per manager")
+    parser.add_argument('--mutations', type=int, default=DEFAULT_MUTATIONS,
+                        help="inserts and edits timed on the bookmark and download profiles")
+    parser.add_argument('--only', choices=('history', 'bookmarks', 'downloads'), action='append',
+                        help="run only this case (repeatable)")
+    parser.add_argument('--workdir', help="directory for the profile (default: a temporary one, removed after)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="write results as JSON to this path")
+    parser.add_argument('--baseline', help="previous results JSON to compare against")
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help="allowed fractional drop in throughput against the baseline")
+    parser.add_argument('--max-latency-regression', type=float, default=0.5,
+                        help="allowed fractional rise in latency and load/save time against the baseline")
+    args = parser.parse_args(argv)
+
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="apex-storage-bench-")
+    os.makedirs(os.path.join(workdir, "data"), exist_ok=True)
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    rng = random.Random(args.seed)
+    cases = args.only or ['history', 'bookmarks', 'downloads']
+    results = []
+    try:
+        if 'history' in cases:
+            results.append(run_history(args.visits, args.queries, rng))
+        if 'bookmarks' in cases:
+            results.append(run_bookmarks(args.bookmarks, args.queries, args.mutations, rng))
+        if 'downloads' in cases:
+            results.append(run_downloads(args.downloads, args.mutations, rng))
+    finally:
+        os.chdir(cwd)
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    for case in results:
+        if 'skipped' in case:
+            print(f"{case['label']:>10}: skipped ({case['skipped']})")
+            continue
+        print(f"{case['label']:>10}: {case['records']} records, {case['inserts_per_sec']}/s inserts, "
+              f"search p99 {case.get('search_p99_ms', '-')} ms, lookup p99 {case.get('lookup_p99_ms', '-')} ms, "
+              f"load {case['load_seconds']} s, save {case.get('save_seconds', '-')} s, {case['rss_mb']} MB RSS")
+        if 'fuzzy_recall' in case:
+            print(f"{'':>10}  fuzzy search p99 {case['fuzzy_search_p99_ms']} ms, "
+                  f"recall {case['fuzzy_recall']:.1%} of one-transposition misspellings")
+
+    report = {
+        'python': sys.version.split()[0],
+        'generated': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'profile': {'visits': args.visits, 'bookmarks': args.bookmarks, 'downloads': args.downloads},
+        'results': results,
+    }
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=4)
+
+    failures = check(results, baseline, args.max_regression, args.max_latency_regression)
+    for failure in failures:
+        print(f"FAIL {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,91 +1,566 @@
 import os
+import itertools
 import json
+import sys
+import threading
+from contextlib import contextmanager
 from datetime import datetime
+from html.parser import HTMLParser
+from urllib.parse import urlsplit, urlunsplit
+from bookmark_search import BookmarkSearchIndex, parse_query
+from history_manager import CHROME_EPOCH_OFFSET_US, RECORDED_SCHEMES
+
+BOOKMARKS_PATH = "data/bookmarks.json"
+# Edits since the last snapshot, one JSON object per line
+JOURNAL_PATH = "data/bookmarks.journal"
+# Journal size past which a background thread folds it into a new snapshot
+COMPACT_BYTES = 1 << 20
+
+# Import: bookmarks journaled per fsync, and characters of HTML parsed at a time
+IMPORT_BATCH = 1000
+READ_CHUNK = 1 << 16
+DEFAULT_PORTS = {'http': 80, 'https': 443, 'ftp': 21}
+# Top-level folders every browser has; their bookmarks are imported untagged
+ROOT_FOLDERS = frozenset(('bookmarks bar', 'bookmarks toolbar', 'bookmarks menu',
+                          'other bookmarks', 'mobile bookmarks'))
+
+
+def normalize_url(url):
+    """Form of a URL under which spellings of the same page compare equal
+
+    Scheme and host are lower-cased, default ports, user info and empty
+    fragments dropped and an empty path written as /.
+    """
+    try:
+        parts = urlsplit(url.strip())
+        port = parts.port
+    except ValueError:
+        return url
+    scheme = parts.scheme.lower()
+    host = parts.hostname or ''
+    if ':' in host:
+        host = f"[{host}]"
+    if port is not None and port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{port}"
+    path = parts.path or ('/' if host else '')
+    return urlunsplit((scheme, host, path, parts.query, parts.fragment))
+
+
+def _timestamp(seconds):
+    """ISO date of an epoch time in seconds, or None if it is missing or invalid"""
+    try:
+        seconds = float(seconds)
+        return datetime.fromtimestamp(seconds).isoformat() if seconds > 0 else None
+    except (TypeError, ValueError, OverflowError, OSError):
+        return None
+
+
+class _NetscapeParser(HTMLParser):
+    """Collects bookmarks from Netscape bookmark HTML as it is fed
+
+    Folders are <H3> headings, each followed by a <DL> list of its
+    contents; bookmarks are <A HREF> links tagged with the names of the
+    folders around them.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.bookmarks = []     # parsed but not yet handed out
+        self._folders = []      # one name per open <DL>, None for unnamed and root folders
+        self._folder = None     # last <H3>, opened by the next <DL>
+        self._link = None       # attributes of the open <A>
+        self._text = None       # text of the open <A> or <H3>
+        self._root = False      # the open <H3> is a browser's root folder
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            self._link = dict(attrs)
+            self._text = []
+        elif tag == 'h3':
+            attrs = dict(attrs)
+            self._link = None
+            self._text = []
+            self._root = 'personal_toolbar_folder' in attrs or 'unfiled_bookmarks_folder' in attrs
+        elif tag == 'dl':
+            self._folders.append(self._folder)
+            self._folder = None
+
+    def handle_endtag(self, tag):
+        if tag == 'a' and self._link is not None:
+            link, title = self._link, "".join(self._text).strip()
+            self._link = self._text = None
+            if link.get('href'):
+                tags = [folder for folder in self._folders if folder]
+                tags += [tag.strip() for tag in (link.get('tags') or '').split(',') if tag.strip()]
+                self.bookmarks.append({'url': link['href'], 'title': title or None,
+                                       'date_added': _timestamp(link.get('add_date')),
+                                       'tags': list(dict.fromkeys(tags))})
+        elif tag == 'h3' and self._text is not None:
+            name = "".join(self._text).strip()
+            self._text = None
+            top_level = not any(self._folders)
+            root = self._root or top_level and name.lower() in ROOT_FOLDERS
+            self._folder = None if root else name or None
+        elif tag == 'dl' and self._folders:
+            self._folders.pop()
+
+    def handle_data(self, data):
+        if self._text is not None:
+            self._text.append(data)
+
+
+def _read_netscape(path):
+    """Yield bookmarks from a Netscape bookmark HTML export, parsing it READ_CHUNK at a time"""
+    parser = _NetscapeParser()
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        for chunk in iter(lambda: f.read(READ_CHUNK), ''):
+            parser.feed(chunk)
+            yield from parser.bookmarks
+            parser.bookmarks = []
+    parser.close()
+    yield from parser.bookmarks
+
+
+def _read_chrome(path):
+    """Yield bookmarks from a Chrome/Chromium profile Bookmarks file
+
+    The file is one JSON document (loaded whole, as the standard library
+    has no streaming JSON parser); bookmarks are handed out as the folder
+    tree is walked.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        roots = json.load(f).get('roots', {})
+    # (node, names of the folders above it); the roots themselves are not tags
+    stack = [(root, None) for root in reversed(list(roots.values())) if isinstance(root, dict)]
+    while stack:
+        node, folders = stack.pop()
+        if node.get('type') == 'url':
+            try:
+                added = (int(node.get('date_added', 0)) - CHROME_EPOCH_OFFSET_US) / 1e6
+            except (TypeError, ValueError):
+                added = None
+            yield {'url': node.get('url'), 'title': node.get('name') or None,
+                   'date_added': _timestamp(added), 'tags': list(folders or ())}
+            continue
+        inner = () if folders is None else folders + ((node['name'],) if node.get('name') else ())
+        for child in reversed(node.get('children', [])):
+            stack.append((child, inner))
+
+
+BOOKMARK_READERS = {'netscape': _read_netscape, 'chrome': _read_chrome}
+
+
+def _importable(entry):
+    """True for bookmarks of pages the browser records (no bookmarklets or place: queries)"""
+    try:
+        return bool(entry['url']) and urlsplit(entry['url']).scheme.lower() in RECORDED_SCHEMES
+    except ValueError:
+        return False
+
+
+def bookmark_source_format(path):
+    """'netscape' or 'chrome' for a file to import"""
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        start = f.read(READ_CHUNK).lstrip('\ufeff \t\r\n')
+    if start.startswith('{'):
+        return 'chrome'
+    if start.startswith('<'):
+        return 'netscape'
+    raise ValueError("not a bookmark HTML or Chrome Bookmarks file")
+
+
+class Bookmark:
+    __slots__ = ('url', 'title', 'date_added', 'tags')
+
+    def __init__(self, url, title, date_added, tags=()):
+        self.url = url
+        self.title = title
+        self.date_added = date_added
+        # Tags repeat across many bookmarks; share one string per tag
+        self.tags = [sys.intern(tag) for tag in tags]
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['url'], data.get('title'), data.get('date_added') or datetime.now().isoformat(),
+                   data.get('tags') or ())
+
+    def to_dict(self):
+        return {'url': self.url, 'title': self.title, 'date_added': self.date_added, 'tags': list(self.tags)}
+
 
 class BookmarkManager:
+    """Bookmarks stored in data/bookmarks.json
+
+    Held as a URL -> Bookmark map (one bookmark per URL, in the order they
+    were added) with a tag -> URLs inverted index, so lookups and edits
+    touch only the bookmark and its tags. The public methods still take
+    and return plain dicts.
+
+    Edits are appended to data/bookmarks.journal and fsynced once per
+    call (or once per batch()), rather than rewriting the whole file.
+    Each journal entry has a sequence number; loading reads the snapshot
+    and replays the entries newer than it. Once the journal passes
+    COMPACT_BYTES a background thread writes a fresh snapshot and drops
+    the entries it covers.
+
+    search_bookmarks() runs over a BookmarkSearchIndex kept in step with
+    every edit.
+    """
+
     def __init__(self):
-        self.bookmarks = []
+        self._bookmarks = {}    # url -> Bookmark
+        self._tag_index = {}    # tag -> set of urls
+        self._search = None     # built once the bookmarks are loaded
         self.tags = set()
+        # Objects with optional bookmark_added(url, title), bookmark_removed(url)
+        # and bookmarks_imported(count) methods
+        self.observers = []
+        self._lock = threading.RLock()
+        self._seq = 0               # sequence number of the last edit
+        self._unsaved = []          # journal lines not yet written
+        self._batch_depth = 0
+        self._journal = None
+        self._compacting = False
+        self._compact_lock = threading.Lock()
         self._load_bookmarks()
 
     def _load_bookmarks(self):
-        """Load bookmarks from file"""
+        """Load the snapshot and replay the journal written since it"""
+        self._bookmarks = {}
+        self._tag_index = {}
+        self.tags = set()
+        self._seq = 0
         try:
-            if os.path.exists("data/bookmarks.json"):
-                with open("data/bookmarks.json", 'r') as f:
+            if os.path.exists(BOOKMARKS_PATH):
+                with open(BOOKMARKS_PATH, 'r') as f:
                     data = json.load(f)
                     if isinstance(data, dict):
-                        self.bookmarks = data.get('bookmarks', [])
+                        bookmarks = data.get('bookmarks', [])
                         self.tags = set(data.get('tags', []))
+                        self._seq = data.get('journal_seq', 0)
                     elif isinstance(data, list):
-                        self.bookmarks = data
-                        self.tags = set()
+                        bookmarks = data
                     else:
                         raise ValueError("Invalid bookmarks.json format")
-            else:
-                self.bookmarks = []
-                self.tags = set()
+                for entry in bookmarks:
+                    self._insert(Bookmark.from_dict(entry))
         except Exception as e:
             print(f"Error loading bookmarks: {e}")
-            self.bookmarks = []
+            self._bookmarks = {}
+            self._tag_index = {}
             self.tags = set()
+        self._replay_journal()
+        self._search = BookmarkSearchIndex()
+        self._search.load((bookmark.url, bookmark.title, bookmark.tags) for bookmark in self._bookmarks.values())
+        if self._journal_size() > COMPACT_BYTES:
+            self._start_compaction()
 
-    def _save_bookmarks(self):
-        """Save bookmarks to file"""
+    def _replay_journal(self):
         try:
-            data = {
-                'bookmarks': self.bookmarks,
-                'tags': list(self.tags)
-            }
-            with open("data/bookmarks.json", 'w') as f:
-                json.dump(data, f, indent=4)
+            if not os.path.exists(JOURNAL_PATH):
+                return
+            with open(JOURNAL_PATH, 'rb+') as f:
+                offset = 0
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        # Torn by a crash mid-write; cut it off so the next edit starts a fresh line
+                        f.truncate(offset)
+                        break
+                    offset += len(line)
+                    try:
+                        op = json.loads(line)
+                    except ValueError:
+                        continue
+                    if op.get('seq', 0) > self._seq:
+                        self._apply(op)
+                        self._seq = op['seq']
         except Exception as e:
-            print(f"Error saving bookmarks: {e}")
+            print(f"Error replaying bookmark journal: {e}")
+
+    def _notify(self, event, *args):
+        for observer in self.observers:
+            handler = getattr(observer, event, None)
+            if handler:
+                handler(*args)
+
+    def _journal_size(self):
+        return os.path.getsize(JOURNAL_PATH) if os.path.exists(JOURNAL_PATH) else 0
+
+    def _log(self, op):
+        """Apply an edit and queue it for the journal"""
+        with self._lock:
+            changed = self._apply(op)
+            if changed:
+                self._seq += 1
+                op['seq'] = self._seq
+                self._unsaved.append(json.dumps(op, ensure_ascii=False) + "\n")
+        return changed
+
+    def _save_bookmarks(self):
+        """Append the queued edits to the journal and fsync it"""
+        with self._lock:
+            if self._batch_depth or not self._unsaved:
+                return
+            try:
+                if self._journal is None:
+                    self._journal = open(JOURNAL_PATH, 'a', encoding='utf-8')
+                self._journal.write("".join(self._unsaved))
+                self._journal.flush()
+                os.fsync(self._journal.fileno())
+                self._unsaved = []
+            except Exception as e:
+                print(f"Error saving bookmarks: {e}")
+                return
+        if self._journal_size() > COMPACT_BYTES:
+            self._start_compaction()
+
+    @contextmanager
+    def batch(self):
+        """Group edits so they are journaled with a single fsync"""
+        with self._lock:
+            self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._batch_depth -= 1
+            self._save_bookmarks()
+
+    def _start_compaction(self):
+        with self._lock:
+            if self._compacting:
+                return
+            self._compacting = True
+        threading.Thread(target=self.compact, name="bookmark-compaction", daemon=True).start()
+
+    def compact(self):
+        """Write a snapshot of every bookmark and drop the journal entries it covers"""
+        with self._compact_lock:
+            with self._lock:
+                self._compacting = True
+                self._save_bookmarks()
+                data = {
+                    'bookmarks': [bookmark.to_dict() for bookmark in self._bookmarks.values()],
+                    'tags': list(self.tags),
+                    'journal_seq': self._seq,
+                }
+                covered = self._journal_size()
+            try:
+                # Edits made meanwhile keep going to the journal; their newer
+                # sequence numbers replay on top of this snapshot
+                with open(BOOKMARKS_PATH + ".tmp", 'w') as f:
+                    json.dump(data, f, indent=4)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(BOOKMARKS_PATH + ".tmp", BOOKMARKS_PATH)
+                with self._lock:
+                    if self._journal is not None:
+                        self._journal.close()
+                        self._journal = None
+                    if os.path.exists(JOURNAL_PATH):
+                        with open(JOURNAL_PATH, 'rb') as f:
+                            f.seek(covered)
+                            tail = f.read()
+                        with open(JOURNAL_PATH + ".tmp", 'wb') as f:
+                            f.write(tail)
+                            f.flush()
+                            os.fsync(f.fileno())
+                        os.replace(JOURNAL_PATH + ".tmp", JOURNAL_PATH)
+            except Exception as e:
+                print(f"Error compacting bookmarks: {e}")
+            finally:
+                self._compacting = False
+
+    def _apply(self, op):
+        """Carry out one journal entry; return False if it changed nothing"""
+        kind = op['op']
+        if kind == 'add':
+            self._insert(Bookmark.from_dict(op))
+            return True
+        if kind == 'remove':
+            return self._delete(op['url'])
+        bookmark = self._bookmarks.get(op['url'])
+        tag = op['tag']
+        if kind == 'tag':
+            if bookmark is None or tag in bookmark.tags:
+                return False
+            bookmark.tags.append(sys.intern(tag))
+            self._index_tag(bookmark.url, tag)
+            self._index_search(bookmark)
+            return True
+        if kind == 'untag':
+            changed = bookmark is not None and tag in bookmark.tags
+            if changed:
+                bookmark.tags.remove(tag)
+                self._unindex_tag(bookmark.url, tag)
+                self._index_search(bookmark)
+            if tag not in self._tag_index and tag in self.tags:
+                self.tags.discard(tag)
+                changed = True
+            return changed
+        raise ValueError(f"Unknown bookmark journal entry: {kind}")
+
+    def _index_search(self, bookmark):
+        if self._search is not None:
+            self._search.update(bookmark.url, bookmark.title, bookmark.tags)
+
+    def _index_tag(self, url, tag):
+        self._tag_index.setdefault(tag, set()).add(url)
+        self.tags.add(tag)
+
+    def _unindex_tag(self, url, tag):
+        urls = self._tag_index.get(tag)
+        if urls is not None:
+            urls.discard(url)
+            if not urls:
+                del self._tag_index[tag]
+
+    def _insert(self, bookmark):
+        """Add a bookmark, merging it into an existing one for the same URL"""
+        existing = self._bookmarks.get(bookmark.url)
+        if existing is None:
+            existing = self._bookmarks[bookmark.url] = Bookmark(bookmark.url, bookmark.title, bookmark.date_added)
+        elif bookmark.title:
+            existing.title = bookmark.title
+        for tag in bookmark.tags:
+            if tag not in existing.tags:
+                existing.tags.append(tag)
+                self._index_tag(existing.url, tag)
+        self._index_search(existing)
+        return existing
+
+    def _delete(self, url):
+        """Remove a bookmark and its tag postings; return False if there was none"""
+        bookmark = self._bookmarks.pop(url, None)
+        if bookmark is None:
+            return False
+        for tag in bookmark.tags:
+            self._unindex_tag(url, tag)
+        if self._search is not None:
+            self._search.remove(url)
+        return True
 
     def add_bookmark(self, url, title, tags=None):
-        """Add a new bookmark"""
-        bookmark = {
-            'url': url,
-            'title': title,
-            'date_added': datetime.now().isoformat(),
-            'tags': tags if tags else []
-        }
-        self.bookmarks.append(bookmark)
-        if tags:
-            self.tags.update(tags)
+        """Add a new bookmark, or update the title and tags of the existing one for url"""
+        self._log({'op': 'add', 'url': url, 'title': title, 'date_added': datetime.now().isoformat(),
+                   'tags': list(tags or ())})
         self._save_bookmarks()
+        self._notify('bookmark_added', url, title)
+
+    def add_bookmarks(self, bookmarks, progress=None):
+        """Add many bookmarks, journaled with one fsync per IMPORT_BATCH
+
+        bookmarks is an iterable of dicts with a url and optional title,
+        date_added and tags, consumed as it is read. Bookmarks whose URLs
+        normalize_url() maps together, including ones already saved, are
+        merged into the first: its title is kept and the tags combined.
+        progress(processed, added) is called after each batch; observers get
+        a single bookmarks_imported(count) rather than one call per bookmark.
+        Returns the number of bookmarks added.
+        """
+        with self._lock:
+            known = {normalize_url(url): url for url in self._bookmarks}
+        bookmarks = iter(bookmarks)
+        processed = added = 0
+        while True:
+            chunk = list(itertools.islice(bookmarks, IMPORT_BATCH))
+            if not chunk:
+                break
+            now = datetime.now().isoformat()
+            with self.batch():
+                for entry in chunk:
+                    url = entry.get('url')
+                    if not url:
+                        continue
+                    key = normalize_url(url)
+                    tags = list(entry.get('tags') or ())
+                    existing = self._bookmarks.get(known.get(key))
+                    if existing is None:
+                        known[key] = url
+                        added += 1
+                        self._log({'op': 'add', 'url': url, 'title': entry.get('title'),
+                                   'date_added': entry.get('date_added') or now, 'tags': tags})
+                        continue
+                    tags = [tag for tag in tags if tag not in existing.tags]
+                    title = entry.get('title') if not existing.title else None
+                    if tags or title:
+                        self._log({'op': 'add', 'url': existing.url, 'title': title,
+                                   'date_added': existing.date_added, 'tags': tags})
+            processed += len(chunk)
+            if progress:
+                progress(processed, added)
+        if added:
+            self._notify('bookmarks_imported', added)
+        return added
+
+    def import_bookmarks(self, path, source_format=None, progress=None):
+        """Add the bookmarks of a Netscape HTML export or a Chrome Bookmarks file
+
+        Links other than http(s) and file ones (bookmarklets, place: queries)
+        are skipped. Returns the number added, or None if the file could not
+        be read; bookmarks from batches read before an error are kept.
+        """
+        try:
+            reader = BOOKMARK_READERS[source_format or bookmark_source_format(path)]
+            return self.add_bookmarks(filter(_importable, reader(path)), progress)
+        except Exception as e:
+            print(f"Error importing bookmarks: {e}")
+            return None
 
     def remove_bookmark(self, url):
         """Remove a bookmark by URL"""
-        self.bookmarks = [bookmark for bookmark in self.bookmarks if bookmark['url'] != url]
-        self._save_bookmarks()
+        if self._log({'op': 'remove', 'url': url}):
+            self._save_bookmarks()
+            self._notify('bookmark_removed', url)
+
+    def get_bookmark(self, url):
+        """Return the bookmark for url, or None"""
+        bookmark = self._bookmarks.get(url)
+        return bookmark.to_dict() if bookmark else None
+
+    def is_bookmarked(self, url):
+        return url in self._bookmarks
 
     def get_bookmarks(self):
         """Return all bookmarks"""
-        return self.bookmarks
+        return [bookmark.to_dict() for bookmark in self._bookmarks.values()]
 
     def get_bookmarks_by_tag(self, tag):
-        """Return bookmarks with the specified tag"""
-        return [bookmark for bookmark in self.bookmarks if tag in bookmark.get('tags', [])]
+        """Return bookmarks with the specified tag, oldest first"""
+        bookmarks = [self._bookmarks[url] for url in self._tag_index.get(tag, ())]
+        bookmarks.sort(key=lambda bookmark: bookmark.date_added)
+        return [bookmark.to_dict() for bookmark in bookmarks]
+
+    def _tagged(self, tag):
+        """URLs with a tag, matched case-insensitively if there is no exact match"""
+        urls = self._tag_index.get(tag)
+        if urls is not None:
+            return urls
+        tag = tag.lower()
+        return set().union(*(urls for name, urls in self._tag_index.items() if name.lower() == tag))
+
+    def search_bookmarks(self, query, limit=20):
+        """Return the bookmarks best matching query, tolerating typos
+
+        Words match title, URL and tag words by prefix or, failing that, by
+        trigram similarity. tag:name (tag:"two words" for spaces) keeps only
+        bookmarks with that tag, so "tag:work docs" searches work bookmarks.
+        """
+        tags, words = parse_query(query)
+        within = None
+        for tag in tags:
+            urls = self._tagged(tag)
+            within = urls if within is None else within & urls
+        if within is None and not words:
+            return []
+        return [self._bookmarks[url].to_dict() for url in self._search.search(words, limit, within)]
 
     def add_tag(self, url, tag):
         """Add a tag to a bookmark"""
-        for bookmark in self.bookmarks:
-            if bookmark['url'] == url:
-                if 'tags' not in bookmark:
-                    bookmark['tags'] = []
-                if tag not in bookmark['tags']:
-                    bookmark['tags'].append(tag)
-                    self.tags.add(tag)
-        self._save_bookmarks()
+        if self._log({'op': 'tag', 'url': url, 'tag': tag}):
+            self._save_bookmarks()
 
     def remove_tag(self, url, tag):
-        """Remove a tag from a bookmark"""
-        for bookmark in self.bookmarks:
-            if bookmark['url'] == url and 'tags' in bookmark:
-                if tag in bookmark['tags']:
-                    bookmark['tags'].remove(tag)
-                    if not bookmark['tags']:
-                        del bookmark['tags']
-        self.tags.discard(tag)
-        self._save_bookmarks()
\ No newline at end of file
+        """Remove a tag from a bookmark, forgetting the tag once no bookmark uses it"""
+        if self._log({'op': 'untag', 'url': url, 'tag': tag}):
+            self._save_bookmarks()
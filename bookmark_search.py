@@ -0,0 +1,243 @@
+import heapq
+import itertools
+import re
+import threading
+from bisect import bisect_left, insort
+from collections import Counter
+from autocomplete import IGNORED_TOKENS, SCHEME_RE, WORD_RE, page_tokens
+
+# Similarity of a query word to a token: exact and prefix matches beat trigram matches
+EXACT_SCORE = 1.0
+PREFIX_SCORE = 0.9
+FUZZY_WEIGHT = 0.8
+# Shorter words are matched by prefix only; a typo in them leaves too few trigrams to go on
+MIN_FUZZY_LENGTH = 4
+# Below this length a transposition can leave a word no trigram in common with the
+# intended token, so its transposed and shortened spellings are looked up directly
+SHORT_WORD_LENGTH = 6
+# Words this long may have two typos, shorter ones one
+TWO_TYPO_LENGTH = 8
+# One typo changes at most this many of a word's padded trigrams (a transposition, mid-word)
+TRIGRAMS_PER_TYPO = 4
+# Tokens sharing the most trigrams with a word that are checked for typos
+FUZZY_CANDIDATES = 32
+# A result tier holding at least this share of all bookmarks is read by walking
+# bookmarks newest first rather than by sorting the tier
+DENSE_TIER = 0.02
+
+TAG_FILTER_RE = re.compile(r'tag:(?:"([^"]*)"|(\S+))', re.IGNORECASE)
+
+
+def trigrams(token):
+    """Distinct trigrams of a token padded with a space on each side"""
+    padded = f" {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a, b, limit):
+    """Optimal string alignment distance (a transposition counts as one edit), or limit + 1 if above limit"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+def parse_query(query):
+    """Split a search into (tags, words); tag:name and tag:"two words" select by tag"""
+    tags = [quoted or bare for quoted, bare in TAG_FILTER_RE.findall(query)]
+    text = SCHEME_RE.sub('', TAG_FILTER_RE.sub(' ', query).lower())
+    words = list(dict.fromkeys(WORD_RE.findall(text)))
+    return tags, [word for word in words if word not in IGNORED_TOKENS] or words
+
+
+class BookmarkSearchIndex:
+    """Typo-tolerant search over bookmark titles, URLs and tags
+
+    Each bookmark is reduced to tokens (title words, host labels, path
+    segments, tag words) with a posting set of bookmarks per token. A
+    query word is matched against the vocabulary rather than against
+    bookmarks: exact and prefix matches come from a sorted token list,
+    typos from a trigram -> tokens index, so the cost depends on how many
+    distinct words are known, not on how many bookmarks use them.
+    Trigram candidates are confirmed by edit distance.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens_of = {}    # url -> tokens
+        self._order = {}        # url -> insertion number, newer bookmarks rank higher on ties
+        self._next_order = 0
+        self._postings = {}     # token -> set of urls
+        self._vocabulary = []   # sorted tokens of _postings
+        self._grams = {}        # trigram -> set of tokens
+
+    def __len__(self):
+        return len(self._tokens_of)
+
+    def _add_token(self, token, url, keep_sorted):
+        urls = self._postings.get(token)
+        if urls is None:
+            urls = self._postings[token] = set()
+            if keep_sorted:
+                insort(self._vocabulary, token)
+            for gram in trigrams(token):
+                self._grams.setdefault(gram, set()).add(token)
+        urls.add(url)
+
+    def _remove_token(self, token, url):
+        urls = self._postings[token]
+        urls.discard(url)
+        if urls:
+            return
+        del self._postings[token]
+        del self._vocabulary[bisect_left(self._vocabulary, token)]
+        for gram in trigrams(token):
+            tokens = self._grams[gram]
+            tokens.discard(token)
+            if not tokens:
+                del self._grams[gram]
+
+    def _set(self, url, title, tags, keep_sorted=True):
+        tokens = page_tokens(url, " ".join((title or '', *tags)))
+        old = self._tokens_of.get(url, ())
+        for token in old:
+            if token not in tokens:
+                self._remove_token(token, url)
+        for token in tokens:
+            if token not in old:
+                self._add_token(token, url, keep_sorted)
+        self._tokens_of[url] = tokens
+        if url not in self._order:
+            self._order[url] = self._next_order
+            self._next_order += 1
+
+    def load(self, bookmarks):
+        """Bulk add (url, title, tags) bookmarks"""
+        with self._lock:
+            for url, title, tags in bookmarks:
+                self._set(url, title, tags, keep_sorted=False)
+            self._vocabulary = sorted(self._postings)
+
+    def update(self, url, title, tags):
+        """Index a new bookmark or re-index a changed one"""
+        with self._lock:
+            self._set(url, title, tags)
+
+    def remove(self, url):
+        with self._lock:
+            for token in self._tokens_of.pop(url, ()):
+                self._remove_token(token, url)
+            self._order.pop(url, None)
+
+    def _matching_tokens(self, word, enough):
+        """{token: score} of the known tokens that match word exactly, by prefix or by trigrams
+
+        Typos are only looked for when fewer than enough bookmarks match as typed.
+        """
+        matches = {}
+        vocabulary = self._vocabulary
+        for i in range(bisect_left(vocabulary, word), len(vocabulary)):
+            token = vocabulary[i]
+            if not token.startswith(word):
+                break
+            matches[token] = EXACT_SCORE if token == word else PREFIX_SCORE
+        if len(word) < MIN_FUZZY_LENGTH or sum(len(self._postings[token]) for token in matches) >= enough:
+            return matches
+        typos = 2 if len(word) >= TWO_TYPO_LENGTH else 1
+        grams = trigrams(word)
+        # Tokens within the typo limit must still share this many trigrams with the word
+        needed = max(1, len(grams) - TRIGRAMS_PER_TYPO * typos)
+        shared = Counter()
+        for gram in grams:
+            tokens = self._grams.get(gram)
+            if tokens:
+                shared.update(tokens)
+        candidates = [token for token, count in shared.most_common(FUZZY_CANDIDATES + len(matches))
+                      if count >= needed]
+        if len(word) < SHORT_WORD_LENGTH:
+            candidates += self._edit_candidates(word)
+        for token in dict.fromkeys(candidates):
+            if token in matches:
+                continue
+            distance = edit_distance(word, token, typos)
+            if distance > typos and len(token) > len(word):
+                # The word may be a mistyped prefix of the token
+                distance = edit_distance(word, token[:len(word)], typos)
+            if distance <= typos:
+                matches[token] = FUZZY_WEIGHT * (1 - distance / len(word))
+        return matches
+
+    def _edit_candidates(self, word):
+        """Known tokens spelled as word with two adjacent letters swapped (or starting so), or with a letter dropped"""
+        vocabulary = self._vocabulary
+        found = []
+        for i in range(len(word) - 1):
+            if word[i] == word[i + 1]:
+                continue
+            variant = word[:i] + word[i + 1] + word[i] + word[i + 2:]
+            start = bisect_left(vocabulary, variant)
+            for j in range(start, min(start + FUZZY_CANDIDATES, len(vocabulary))):
+                if not vocabulary[j].startswith(variant):
+                    break
+                found.append(vocabulary[j])
+        for i in range(len(word)):
+            variant = word[:i] + word[i + 1:]
+            if variant in self._postings:
+                found.append(variant)
+        return found
+
+    def _union(self, tokens):
+        """Urls having any of the tokens; a single posting set is returned as is, not copied"""
+        if len(tokens) == 1:
+            return self._postings[next(iter(tokens))]
+        return set().union(*(self._postings[token] for token in tokens))
+
+    def _newest(self, urls, limit):
+        """The limit most recently added of a set of urls"""
+        order = self._order
+        if len(urls) >= DENSE_TIER * len(order):
+            return list(itertools.islice((url for url in reversed(order) if url in urls), limit))
+        return heapq.nlargest(limit, urls, key=order.__getitem__)
+
+    def search(self, words, limit=20, within=None):
+        """Top urls matching every word, best first; within restricts them to a set of urls
+
+        Each bookmark scores the sum over words of its best-matching token;
+        ties go to the most recently added bookmark. Candidates are found
+        with set unions and intersections; only when the best-scoring tier
+        holds fewer than limit bookmarks are the others scored one by one.
+        """
+        order = self._order
+        with self._lock:
+            if not words:
+                return self._newest(order.keys() if within is None else within & order.keys(), limit)
+            matches = []
+            top = within
+            for word in words:
+                tokens = self._matching_tokens(word, limit)
+                if not tokens:
+                    return []
+                best = max(tokens.values())
+                best_urls = self._union([token for token, score in tokens.items() if score == best])
+                top = best_urls if top is None else top & best_urls
+                matches.append(tokens)
+            if len(top) >= limit:
+                return self._newest(top, limit)
+            pool = within
+            for tokens in matches:
+                pool = self._union(tokens) if pool is None else pool & self._union(tokens)
+            tokens_of = self._tokens_of
+            scores = {url: sum(max(tokens.get(token, 0) for token in tokens_of[url]) for tokens in matches)
+                      for url in pool}
+            return heapq.nlargest(limit, scores, key=lambda url: (scores[url], order[url]))
@@ -1,15 +1,22 @@
 from PyQt5.QtWidgets import (QMainWindow, QTabWidget, QShortcut, QAction, QMenu,
                              QVBoxLayout, QWidget, QApplication, QPushButton,
                              QTabBar, QStatusBar, QLabel, QFrame, QHBoxLayout, QFileDialog, QSizePolicy)
-from PyQt5.QtCore import QUrl, Qt, pyqtSignal, QSettings, QPropertyAnimation, QEasingCurve, QPoint, QSize, QTimer
-from PyQt5.QtWebEngineWidgets import QWebEngineView, QWebEngineProfile, QWebEnginePage, QWebEngineSettings
-from PyQt5.QtWebEngineCore import QWebEngineUrlRequestInterceptor
+from PyQt5.QtCore import (QUrl, Qt, pyqtSignal, QSettings, QPropertyAnimation, QEasingCurve, QPoint, QSize, QTimer,
+                          QObject)
+from PyQt5.QtWebEngineWidgets import (QWebEngineView, QWebEngineProfile, QWebEnginePage, QWebEngineSettings,
+                                      QWebEngineScript)
+from PyQt5.QtWebEngineCore import QWebEngineUrlRequestInterceptor, QWebEngineUrlRequestInfo
 from PyQt5.QtGui import QKeySequence, QIcon, QPainter, QFont, QCursor
 from ui import BrowserUI
 from voice_search import voice_search
 from security_manager import SecurityManager
+from ad_blocker import AdBlocker
+from filter_engine import base_domain
+from history_manager import (TRANSITION_LINK, TRANSITION_TYPED, TRANSITION_RELOAD, TRANSITION_REDIRECT,
+                             TRANSITION_FORM, TRANSITION_BACK_FORWARD, RECORDED_SCHEMES)
 import platform
 import logging
+import json
 try:
     import psutil
 except ImportError:
@@ -337,16 +344,183 @@ class WebView(QWebEngineView):
         self.page().setDevToolsPage(self.page())
         self.page().triggerAction(QWebEnginePage.InspectElement)
 
+# QtWebEngine resource types mapped to Adblock Plus type option names
+RESOURCE_TYPE_NAMES = {
+    getattr(QWebEngineUrlRequestInfo, qt_name): abp_name
+    for qt_name, abp_name in (
+        ('ResourceTypeMainFrame', 'document'),
+        ('ResourceTypeNavigationPreloadMainFrame', 'document'),
+        ('ResourceTypeSubFrame', 'subdocument'),
+        ('ResourceTypeNavigationPreloadSubFrame', 'subdocument'),
+        ('ResourceTypeStylesheet', 'stylesheet'),
+        ('ResourceTypeScript', 'script'),
+        ('ResourceTypeWorker', 'script'),
+        ('ResourceTypeSharedWorker', 'script'),
+        ('ResourceTypeServiceWorker', 'script'),
+        ('ResourceTypeImage', 'image'),
+        ('ResourceTypeFavicon', 'image'),
+        ('ResourceTypeFontResource', 'font'),
+        ('ResourceTypeObject', 'object'),
+        ('ResourceTypePluginResource', 'object'),
+        ('ResourceTypeMedia', 'media'),
+        ('ResourceTypeXhr', 'xmlhttprequest'),
+        ('ResourceTypePing', 'ping'),
+        ('ResourceTypeCspReport', 'ping'),
+    )
+    if hasattr(QWebEngineUrlRequestInfo, qt_name)
+}
+
+
 class UrlRequestInterceptor(QWebEngineUrlRequestInterceptor):
-    def __init__(self, parent=None):
+    def __init__(self, ad_blocker=None, parent=None):
         super().__init__(parent)
+        # Resolved once here: interceptRequest runs on the Chromium IO thread for every sub-resource
+        self.ad_blocker = ad_blocker or AdBlocker.instance()
 
     def interceptRequest(self, info):
-        request_url = info.requestUrl().toString()
-        from ad_blocker import AdBlocker
-        if AdBlocker.instance().should_block(request_url):
+        resource_type = RESOURCE_TYPE_NAMES.get(info.resourceType(), 'other')
+        if resource_type == 'document':
+            return  # Top-level navigations are never subject to network filters
+        # should_block returns before any rule work for allowlisted first parties
+        if self.ad_blocker.should_block(info.requestUrl().toString(), resource_type,
+                                        first_party_host=info.firstPartyUrl().host()):
             info.block(True)
 
+class AdBlockPage(QWebEnginePage):
+    """Page that injects the element-hiding stylesheet for each site it loads"""
+    COSMETIC_SCRIPT_NAME = "apex-cosmetic-filters"
+
+    def __init__(self, profile, parent=None, ad_blocker=None):
+        super().__init__(profile, parent)
+        self.ad_blocker = ad_blocker or AdBlocker.instance()
+        self.cosmetic_host = None
+        self.last_navigation_type = None
+
+    def acceptNavigationRequest(self, url, navigation_type, is_main_frame):
+        # Runs before the new document is created, so the script is in
+        # place for its DocumentCreation injection point
+        if is_main_frame:
+            # A redirect keeps the type of the navigation that led to it
+            if navigation_type != QWebEnginePage.NavigationTypeRedirect or self.last_navigation_type is None:
+                self.last_navigation_type = navigation_type
+            self.update_cosmetic_script(url.host())
+        return super().acceptNavigationRequest(url, navigation_type, is_main_frame)
+
+    def update_cosmetic_script(self, host):
+        if host == self.cosmetic_host:
+            return
+        self.cosmetic_host = host
+        scripts = self.scripts()
+        existing = scripts.findScript(self.COSMETIC_SCRIPT_NAME)
+        if not existing.isNull():
+            scripts.remove(existing)
+        css = self.ad_blocker.get_cosmetic_stylesheet(host)
+        if not css:
+            return
+        script = QWebEngineScript()
+        script.setName(self.COSMETIC_SCRIPT_NAME)
+        script.setInjectionPoint(QWebEngineScript.DocumentCreation)
+        script.setWorldId(QWebEngineScript.ApplicationWorld)
+        script.setRunsOnSubFrames(True)
+        # One <style> element per document; hiding is left to the CSS engine
+        script.setSourceCode(
+            "(function(){var s=document.createElement('style');"
+            f"s.textContent={json.dumps(css)};"
+            "(document.head||document.documentElement).appendChild(s);})();")
+        scripts.insert(script)
+
+
+NAVIGATION_TRANSITIONS = {
+    QWebEnginePage.NavigationTypeLinkClicked: TRANSITION_LINK,
+    QWebEnginePage.NavigationTypeTyped: TRANSITION_TYPED,
+    QWebEnginePage.NavigationTypeFormSubmitted: TRANSITION_FORM,
+    QWebEnginePage.NavigationTypeBackForward: TRANSITION_BACK_FORWARD,
+    QWebEnginePage.NavigationTypeReload: TRANSITION_RELOAD,
+    QWebEnginePage.NavigationTypeRedirect: TRANSITION_REDIRECT,
+}
+
+class VisitTracker(QObject):
+    """Turns one tab's navigation signals into history visits
+
+    A navigation's URL is held until its load finishes, so redirect hops
+    collapse into the final URL and the visit is written with the page's
+    own title rather than the previous one. Later title changes update
+    that visit, fragment-only changes and reloads are not new visits, and
+    same-document (pushState) navigations are recorded once they settle.
+    """
+    SETTLE_DELAY = 1000  # ms before a same-document navigation is recorded
+
+    def __init__(self, browser, history_manager):
+        super().__init__(browser)
+        self.browser = browser
+        self.history_manager = history_manager
+        self.visit_url = None
+        self.visit_title = None
+        self.pending_url = None
+        self.loading = False
+        self.settle_timer = QTimer(self)
+        self.settle_timer.setSingleShot(True)
+        self.settle_timer.setInterval(self.SETTLE_DELAY)
+        self.settle_timer.timeout.connect(self.record_pending)
+        browser.loadStarted.connect(self.load_started)
+        browser.urlChanged.connect(self.url_changed)
+        browser.titleChanged.connect(self.title_changed)
+        browser.loadFinished.connect(self.load_finished)
+
+    @staticmethod
+    def _without_fragment(url):
+        return url.split('#', 1)[0] if url else url
+
+    def _title(self, url):
+        title = self.browser.title()
+        # QWebEngineView reports the URL as the title of untitled pages
+        return "" if title in (url, self._without_fragment(url)) else title
+
+    def load_started(self):
+        self.loading = True
+        self.settle_timer.stop()
+
+    def url_changed(self, qurl):
+        if qurl.scheme() not in RECORDED_SCHEMES:
+            return
+        url = qurl.toString()
+        if self.pending_url is None and self._without_fragment(url) == self._without_fragment(self.visit_url):
+            return
+        self.pending_url = url
+        if not self.loading:
+            self.settle_timer.start()
+
+    def load_finished(self, ok):
+        self.loading = False
+        if ok:
+            self.record_pending()
+        else:
+            self.pending_url = None
+
+    def record_pending(self):
+        self.settle_timer.stop()
+        url, self.pending_url = self.pending_url, None
+        if url is None:
+            return
+        navigation_type = getattr(self.browser.page(), 'last_navigation_type', None)
+        transition = NAVIGATION_TRANSITIONS.get(navigation_type, TRANSITION_LINK)
+        title = self._title(url)
+        if url == self.visit_url and transition == TRANSITION_RELOAD:
+            self.title_changed(title)
+            return
+        self.history_manager.add_entry(url, title, transition)
+        self.visit_url = url
+        self.visit_title = title
+
+    def title_changed(self, title):
+        if self.loading or self.pending_url is not None or self.visit_url is None:
+            return  # Read when the pending visit is recorded
+        title = self._title(self.visit_url)
+        if title and title != self.visit_title:
+            self.visit_title = title
+            self.history_manager.update_title(self.visit_url, title)
+
+
 class Browser(QMainWindow):
     tab_count_changed = pyqtSignal(int)
     fullscreen_toggled = pyqtSignal(bool)
@@ -376,6 +550,9 @@ class Browser(QMainWindow):
         self.is_fullscreen = False
         self.cpu_monitor_enabled = self.settings.value("monitoring/cpu_enabled", True, type=bool)
         self.cpu_monitor_timer = None
+        self.request_interceptor = UrlRequestInterceptor(self.ad_blocker, parent=self)
+        self.adblock_stats_timer = None
+        self.adblock_reorder_timer = None
 
         # Set window properties
         self.setWindowTitle("Apex Browser")
@@ -391,6 +568,7 @@ class Browser(QMainWindow):
         self.setup_shortcuts()
         self.setup_connections()
         self.setup_cpu_monitor()
+        self.setup_adblock_stats()
 
     def setup_ui(self):
         self.ui = BrowserUI(self)
@@ -453,7 +631,9 @@ class Browser(QMainWindow):
             }
         """)
         self.security_status = QLabel()
+        self.adblock_status = QLabel()
         self.loading_progress = QLabel()
+        status_bar.addPermanentWidget(self.adblock_status)
         status_bar.addPermanentWidget(self.security_status)
         status_bar.addPermanentWidget(self.loading_progress)
         return status_bar
@@ -483,6 +663,16 @@ class Browser(QMainWindow):
         self.tabs.currentChanged.connect(self.tab_changed)
         self.tab_count_changed.connect(self.update_window_title)
         self.fullscreen_toggled.connect(self.handle_fullscreen_change)
+        if self.ad_blocker:
+            self.ad_blocker.rules_updated.connect(self.handle_rules_updated)
+
+    def handle_rules_updated(self, added, removed):
+        # Pages rebuild their element-hiding script on the next navigation
+        for i in range(self.tabs.count()):
+            page = self.tabs.widget(i).page()
+            if isinstance(page, AdBlockPage):
+                page.cosmetic_host = None
+        self.ui.show_notification(f"Ad-block filters updated (+{added} / -{removed} rules)")
 
     def setup_cpu_monitor(self):
         if self.cpu_monitor_enabled and psutil:
@@ -495,6 +685,41 @@ class Browser(QMainWindow):
         else:
             logger.info("CPU monitoring disabled")
 
+    def setup_adblock_stats(self):
+        if self.ad_blocker:
+            self.adblock_stats_timer = QTimer(self)
+            self.adblock_stats_timer.timeout.connect(self.update_adblock_status)
+            self.adblock_stats_timer.start(2000)
+            # Re-sort rule buckets by hit count now and then so hot rules are tried first
+            self.adblock_reorder_timer = QTimer(self)
+            self.adblock_reorder_timer.timeout.connect(self.ad_blocker.reorder_rules)
+            self.adblock_reorder_timer.start(300000)
+
+    def track_adblock_site(self, browser, url):
+        """Start a tab's block count over when it moves to another site
+
+        The profile-wide interceptor runs on the Chromium IO thread and only
+        knows a request's first party, so blocks are counted per site. A tab
+        shows the blocks on its site since it got there; other tabs open on
+        the same site add to it.
+        """
+        site = base_domain(url.host().lower()) if url.host() else None
+        if site != getattr(browser, 'adblock_site', None):
+            browser.adblock_site = site
+            browser.adblock_baseline = self.ad_blocker.get_blocked_count(site) if site else 0
+
+    def update_adblock_status(self):
+        browser = self.current_browser()
+        site = getattr(browser, 'adblock_site', None)
+        blocked = self.ad_blocker.get_blocked_count(site) - browser.adblock_baseline if site else 0
+        totals = self.ad_blocker.stats.totals.snapshot()
+        requests = totals.get('requests', 0)
+        mean_us = totals.get('time_ns', 0) / requests / 1000 if requests else 0.0
+        self.adblock_status.setText(f"🛡 {blocked} blocked")
+        self.adblock_status.setToolTip(
+            f"{totals.get('blocked', 0)} of {requests} requests blocked in total\n"
+            f"{mean_us:.1f} µs per decision")
+
     def log_cpu_usage(self):
         if psutil:
             cpu_percent = psutil.cpu_percent(interval=1)
@@ -557,17 +782,20 @@ class Browser(QMainWindow):
         browser = WebView(self)
         profile = QWebEngineProfile.defaultProfile()
         self.configure_web_engine_profile(profile)  # This now sets user agent too
-        browser.setPage(QWebEnginePage(profile, browser))
-        profile.setRequestInterceptor(UrlRequestInterceptor())
+        browser.setPage(AdBlockPage(profile, browser, self.ad_blocker))
 
         if self.incognito_manager and self.incognito_manager.is_incognito():
             incognito_profile = QWebEngineProfile()
             self.configure_web_engine_profile(incognito_profile)
-            browser.setPage(QWebEnginePage(incognito_profile, browser))
+            browser.setPage(AdBlockPage(incognito_profile, browser, self.ad_blocker))
+        # One interceptor per profile: it runs on the Chromium IO thread and also sees service worker requests
+        browser.page().profile().setRequestInterceptor(self.request_interceptor)
+        browser.urlChanged.connect(lambda url: self.track_adblock_site(browser, url))
 
         browser.setZoomFactor(float(self.settings.value("browser/zoom", 1.0)))
+        if self.history_manager:
+            browser.visit_tracker = VisitTracker(browser, self.history_manager)
         browser.load(QUrl(url))
-        browser.urlChanged.connect(lambda url: self.history_manager.add_entry(url.toString(), browser.title()))
         browser.loadStarted.connect(lambda: self.ui.start_loading_animation())
         browser.loadProgress.connect(self.ui.update_progress)
         browser.loadFinished.connect(lambda ok: self.handle_load_finished(browser, ok))
@@ -730,6 +958,11 @@ class Browser(QMainWindow):
     def closeEvent(self, event):
         if self.cpu_monitor_timer:
             self.cpu_monitor_timer.stop()
+        if self.adblock_stats_timer:
+            self.adblock_stats_timer.stop()
+            self.adblock_reorder_timer.stop()
+        if self.history_manager:
+            self.history_manager.flush()
         event.accept()
 
     def force_repaint(self):
@@ -0,0 +1,149 @@
+from filter_engine import DecisionCache
+
+# Selectors per CSS rule: an invalid selector only disables its own group
+SELECTORS_PER_RULE = 1000
+HIDE_DECLARATION = "{display:none!important}"
+# Extended syntax Chromium's CSS cannot parse; uBO and ABP also allow these after plain ##
+SCRIPTLET_PREFIXES = ('+js(', '^')
+PROCEDURAL_PSEUDO_CLASSES = (
+    ':has(', ':has-text(', ':upward(', ':remove(', ':style(', ':xpath(', ':contains(',
+    ':matches-css(', ':matches-css-before(', ':matches-css-after(', ':matches-attr(',
+    ':matches-path(', ':matches-media(', ':min-text-length(', ':watch-attr(', ':others(',
+    ':remove-attr(', ':remove-class(', ':if(', ':if-not(', ':-abp-has(', ':-abp-contains(',
+    ':-abp-properties(',
+)
+
+
+def _hosts_of(host):
+    """Yield a host and each of its parent domains"""
+    while host:
+        yield host
+        dot = host.find('.')
+        if dot < 0:
+            return
+        host = host[dot + 1:]
+
+
+def _is_plain_selector(selector):
+    """True unless the selector uses syntax that would invalidate its whole CSS rule"""
+    if selector.startswith(SCRIPTLET_PREFIXES):
+        return False
+    return not any(pseudo in selector for pseudo in PROCEDURAL_PSEUDO_CLASSES)
+
+
+def build_stylesheet(selectors):
+    """Combine selectors into element-hiding CSS rules"""
+    selectors = list(selectors)
+    return "\n".join(
+        ",".join(selectors[i:i + SELECTORS_PER_RULE]) + HIDE_DECLARATION
+        for i in range(0, len(selectors), SELECTORS_PER_RULE)
+    )
+
+
+class CosmeticFilterIndex:
+    """Element-hiding rules (`##selector`, `domain##selector`, `#@#` exceptions)
+
+    Rules are parsed once when the lists load. The stylesheet for a host,
+    generic selectors plus those specific to the host or its parent
+    domains minus any exceptions, is built on first request and kept in
+    an LRU so later navigations to the same host reuse the CSS string.
+    """
+
+    def __init__(self, cache_size=256):
+        self.generic = set()
+        self.generic_restricted = {}    # selector -> domains it is disabled on (~domain##selector)
+        self.specific = {}              # domain -> list of selectors
+        self.exceptions = {}            # domain -> set of excepted selectors
+        self.generic_exceptions = set()
+        self.rule_count = 0
+        self._generic_css = None
+        self._cache_size = cache_size
+        self._cache = DecisionCache(cache_size)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_cache']
+        state['_generic_css'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._cache = DecisionCache(self._cache_size)
+
+    def add_filter(self, line):
+        """Index a cosmetic filter line; return False if it is not one"""
+        text = line.strip()
+        if text.startswith('!'):
+            return False
+        if '#?#' in text or '#$#' in text:
+            return True  # Procedural and scriptlet filters are not supported
+        if '#@#' in text:
+            domains, selector = text.split('#@#', 1)
+            exception = True
+        elif '##' in text:
+            domains, selector = text.split('##', 1)
+            exception = False
+        else:
+            return False
+        if not selector or not _is_plain_selector(selector):
+            return True  # Scriptlets, HTML filters and procedural selectors are not supported
+
+        include = [d.lower() for d in domains.split(',') if d and not d.startswith('~')]
+        exclude = [d[1:].lower() for d in domains.split(',') if d.startswith('~')]
+        if exception:
+            if include:
+                for domain in include:
+                    self.exceptions.setdefault(domain, set()).add(selector)
+            else:
+                self.generic_exceptions.add(selector)
+        elif include:
+            for domain in include:
+                self.specific.setdefault(domain, []).append(selector)
+        elif exclude:
+            self.generic_restricted.setdefault(selector, set()).update(exclude)
+        else:
+            self.generic.add(selector)
+        self.rule_count += 1
+        self._generic_css = None
+        self._cache.clear()
+        return True
+
+    def _generic_stylesheet(self):
+        """CSS shared by every host for the unrestricted generic selectors"""
+        if self._generic_css is None:
+            self._generic_css = build_stylesheet(
+                selector for selector in self.generic if selector not in self.generic_exceptions)
+        return self._generic_css
+
+    def stylesheet_for(self, host):
+        """Return the element-hiding CSS for pages on host"""
+        host = (host or '').lower()
+        css = self._cache.get(host, 0)
+        if css is not None:
+            return css
+
+        hosts = list(_hosts_of(host))
+        excepted = set()
+        for domain in hosts:
+            excepted.update(self.exceptions.get(domain, ()))
+        selectors = []
+        for domain in hosts:
+            selectors.extend(s for s in self.specific.get(domain, ()) if s not in excepted)
+        for selector, excluded in self.generic_restricted.items():
+            if selector not in self.generic_exceptions and selector not in excepted \
+                    and not any(domain in excluded for domain in hosts):
+                selectors.append(selector)
+
+        # Hosts with their own exceptions cannot share the generic sheet
+        if excepted.isdisjoint(self.generic):
+            generic_css = self._generic_stylesheet()
+        else:
+            generic_css = build_stylesheet(
+                selector for selector in self.generic
+                if selector not in self.generic_exceptions and selector not in excepted)
+        css = "\n".join(part for part in (generic_css, build_stylesheet(selectors)) if part)
+        self._cache.put(host, css, 0)
+        return css
+
+    def cache_stats(self):
+        return self._cache.stats()
@@ -4,6 +4,14 @@ from datetime import datetime
 from PyQt5.QtCore import QObject, pyqtSignal, QUrl
 from PyQt5.QtNetwork import QNetworkAccessManager, QNetworkRequest
 
+# Bytes Qt may hold for a reply before it stops reading from the socket,
+# bytes taken from the reply per read, and the size of the file write buffer
+READ_BUFFER_SIZE = 1 << 20
+READ_CHUNK = 256 * 1024
+WRITE_BUFFER_SIZE = 1 << 20
+# Suffix of a file still being downloaded; renamed away once it is complete
+PART_SUFFIX = ".part"
+
 class DownloadManager(QObject):
     download_progress = pyqtSignal(int, int, str)  # bytes_received, bytes_total, filename
     download_finished = pyqtSignal(str, bool)     # filepath, success
@@ -46,49 +54,87 @@ class DownloadManager(QObject):
         counter = 1
         base_name = os.path.splitext(download_path)[0]
         extension = os.path.splitext(download_path)[1]
-        while os.path.exists(download_path):
+        while os.path.exists(download_path) or os.path.exists(download_path + PART_SUFFIX):
             download_path = f"{base_name}_{counter}{extension}"
             counter += 1
 
+        try:
+            file = open(download_path + PART_SUFFIX, 'wb', buffering=WRITE_BUFFER_SIZE)
+        except OSError as e:
+            print(f"Error starting download: {e}")
+            self.download_finished.emit(download_path, False)
+            return
+
         request = QNetworkRequest(QUrl(url))
         reply = self.network_manager.get(request)
-        self.current_download = {
+        # Bounds what Qt buffers in memory; the socket is throttled until readyRead drains it
+        reply.setReadBufferSize(READ_BUFFER_SIZE)
+        download = self.current_download = {
             'reply': reply,
-            'file': open(download_path, 'wb'),
+            'file': file,
             'url': url,
             'path': download_path,
-            'start_time': datetime.now().isoformat()
+            'start_time': datetime.now().isoformat(),
+            'error': None
         }
 
+        reply.readyRead.connect(lambda: self._write_available(download))
         reply.downloadProgress.connect(lambda received, total: self.download_progress.emit(received, total, filename))
         reply.finished.connect(lambda: self._handle_download_finished(download_path))
 
+    def _write_available(self, download):
+        """Move the bytes received so far from the reply to the .part file, READ_CHUNK at a time"""
+        reply = download['reply']
+        if download['error']:
+            return
+        try:
+            while reply.bytesAvailable() > 0:
+                download['file'].write(reply.read(READ_CHUNK))
+        except OSError as e:
+            download['error'] = str(e)
+            reply.abort()
+
     def _handle_download_finished(self, filepath):
         """Handle download completion"""
-        if not self.current_download:
+        download = self.current_download
+        if not download or download['path'] != filepath:
             return
+        self.current_download = None
 
-        reply = self.current_download['reply']
-        file = self.current_download['file']
-        success = not reply.error()
+        reply = download['reply']
+        part_path = filepath + PART_SUFFIX
+        success = not reply.error() and not download['error']
+        try:
+            if success:
+                self._write_available(download)
+                success = not download['error']
+            download['file'].close()
+            if success:
+                os.replace(part_path, filepath)
+        except OSError as e:
+            download['error'] = str(e)
+            success = False
 
         if success:
-            data = reply.readAll()
-            file.write(data)
             self.downloads.append({
-                'url': self.current_download['url'],
+                'url': download['url'],
                 'path': filepath,
                 'date': datetime.now().isoformat(),
                 'size': os.path.getsize(filepath)
             })
             self._save_downloads()
         else:
-            print(f"Download failed: {reply.errorString()}")
+            print(f"Download failed: {download['error'] or reply.errorString()}")
+            try:
+                if not download['file'].closed:
+                    download['file'].close()
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+            except OSError as e:
+                print(f"Error removing partial download: {e}")
 
-        file.close()
         reply.deleteLater()
         self.download_finished.emit(filepath, success)
-        self.current_download = None
 
     def get_download_history(self):
         """Return the download history"""
@@ -101,9 +147,10 @@ class DownloadManager(QObject):
 
     def cancel_download(self):
         """Cancel the current download"""
-        if self.current_download:
-            self.current_download['reply'].abort()
-            self.current_download['file'].close()
-            if os.path.exists(self.current_download['path']):
-                os.remove(self.current_download['path'])
-            self.current_download = None
+        download = self.current_download
+        if download:
+            download['error'] = "Cancelled"
+            # Emits finished, whose handler closes and removes the .part file
+            download['reply'].abort()
+            if self.current_download is download:
+                self._handle_download_finished(download['path'])
@@ -0,0 +1,783 @@
+import pickle
+import re
+import threading
+from array import array
+from collections import OrderedDict
+from bisect import bisect_left
+from functools import lru_cache
+from hashlib import blake2b
+
+# URL tokens are maximal runs of these characters; rules are indexed by one of
+# their tokens so a request only visits rules sharing a token with its URL.
+TOKEN_RE = re.compile(r'[a-z0-9%]+')
+
+RESOURCE_TYPES = {
+    'script': 1 << 0,
+    'image': 1 << 1,
+    'stylesheet': 1 << 2,
+    'object': 1 << 3,
+    'xmlhttprequest': 1 << 4,
+    'subdocument': 1 << 5,
+    'ping': 1 << 6,
+    'media': 1 << 7,
+    'font': 1 << 8,
+    'websocket': 1 << 9,
+    'other': 1 << 10,
+    'document': 1 << 11,
+}
+TYPE_ALIASES = {
+    'xhr': 'xmlhttprequest',
+    'css': 'stylesheet',
+    'frame': 'subdocument',
+    'beacon': 'ping',
+    'object-subrequest': 'object',
+}
+# Rules without a type option apply to everything but top-level documents
+DEFAULT_TYPE_MASK = sum(RESOURCE_TYPES.values()) & ~RESOURCE_TYPES['document']
+
+# Tokens present in almost every URL make useless index keys
+BAD_TOKENS = {'http', 'https', 'www', 'com', 'net', 'org', 'js', 'html', 'php'}
+
+SEPARATOR_RE = r'(?:[^\w\-.%]|$)'
+HOST_ANCHOR_RE = r'^[a-z][a-z0-9+.\-]*://(?:[^/?#]*[.@])?'
+
+HOST_RE = re.compile(r'^[a-z][a-z0-9+.\-]*://(?:[^/?#]*@)?(\[[^\]/?#]*\]|[^:/?#]*)')
+
+HOST_RULE_RE = re.compile(r'^\|\|([a-z0-9\-]+(?:\.[a-z0-9\-]+)+)\^$')
+HOSTS_FILE_ADDRESSES = {'0.0.0.0', '127.0.0.1', '::', '::1'}
+HOSTS_FILE_IGNORED = {'localhost', 'localhost.localdomain', 'local', 'broadcasthost', '0.0.0.0'}
+
+SECOND_LEVEL_LABELS = {'co', 'com', 'net', 'org', 'gov', 'edu', 'ac', 'or', 'ne', 'go'}
+
+
+def extract_host(url):
+    """Return the lower-cased host of a URL, without userinfo or port"""
+    match = HOST_RE.match(url.lower())
+    return match.group(1).rstrip('.') if match else ''
+
+
+@lru_cache(maxsize=4096)
+def base_domain(host):
+    """Approximate the registrable domain of a host (eTLD+1)"""
+    if not host or host[0] == '[' or host.replace('.', '').isdigit():
+        return host
+    labels = host.split('.')
+    if len(labels) > 2 and len(labels[-1]) == 2 and labels[-2] in SECOND_LEVEL_LABELS:
+        return '.'.join(labels[-3:])
+    return '.'.join(labels[-2:])
+
+
+def is_third_party(host, first_party_host):
+    """Check whether a request host belongs to a different site than the page"""
+    if not first_party_host:
+        return False
+    return base_domain(host) != base_domain(first_party_host)
+
+
+def domain_in(host, domains):
+    """Check whether a host or any of its parent domains is in the set"""
+    while host:
+        if host in domains:
+            return True
+        dot = host.find('.')
+        if dot < 0:
+            return False
+        host = host[dot + 1:]
+    return False
+
+
+def parse_hosts_line(line):
+    """Return the domains listed on one hosts-file or plain domain-list line"""
+    line = line.split('#', 1)[0].strip().lower()
+    if not line:
+        return []
+    fields = line.split()
+    if fields[0] in HOSTS_FILE_ADDRESSES:
+        fields = fields[1:]
+    elif len(fields) > 1:
+        return []
+    return [field.rstrip('.') for field in fields if field not in HOSTS_FILE_IGNORED]
+
+
+def domain_hash(domain):
+    """Stable 64-bit hash of a domain name"""
+    return int.from_bytes(blake2b(domain.encode(), digest_size=8).digest(), 'little')
+
+
+class DomainSuffixIndex:
+    """Blocked domains matched against a host and each of its parent domains
+
+    Domains are kept as sorted 64-bit hashes in a flat array (8 bytes each)
+    instead of a set of strings, so hosts-file sized lists of millions of
+    entries stay compact. A lookup walks the host's labels from the full
+    name up to the TLD and costs one binary search per label. Single
+    additions are buffered and merged by compact().
+    """
+
+    def __init__(self):
+        self.hashes = array('Q')
+        self._pending = set()
+
+    def __len__(self):
+        return len(self.hashes) + len(self._pending)
+
+    def _contains_hash(self, value):
+        hashes = self.hashes
+        i = bisect_left(hashes, value)
+        return (i < len(hashes) and hashes[i] == value) or value in self._pending
+
+    def add(self, domain):
+        """Add a single domain"""
+        value = domain_hash(domain)
+        if not self._contains_hash(value):
+            self._pending.add(value)
+            if len(self._pending) > max(4096, len(self.hashes) // 4):
+                self.compact()
+
+    def add_many(self, domains):
+        """Bulk-add domains with a single sort at the end"""
+        hashes = array('Q', self.hashes)
+        hashes.extend(domain_hash(domain) for domain in domains)
+        self.hashes = hashes
+        self.compact()
+
+    def compact(self):
+        """Merge buffered additions into the sorted hash array"""
+        merged = sorted(self.hashes)
+        merged.extend(self._pending)
+        merged.sort()
+        unique = array('Q')
+        previous = None
+        for value in merged:
+            if value != previous:
+                unique.append(value)
+                previous = value
+        self.hashes = unique
+        self._pending = set()
+
+    def lookup(self, host):
+        """Return the listed domain covering host (itself or a parent), or None"""
+        hashes, pending = self.hashes, self._pending
+        if not host or (not hashes and not pending):
+            return None
+        size = len(hashes)
+        while True:
+            # domain_hash and _contains_hash inlined: this runs per label per request
+            value = int.from_bytes(blake2b(host.encode(), digest_size=8).digest(), 'little')
+            i = bisect_left(hashes, value)
+            if (i < size and hashes[i] == value) or value in pending:
+                return host
+            dot = host.find('.')
+            if dot < 0:
+                return None
+            host = host[dot + 1:]
+
+
+class FilterRule:
+    """A single compiled Adblock Plus network filter"""
+    __slots__ = ('text', 'regex_source', '_regex', 'is_exception', 'important',
+                 'third_party', 'type_mask', 'include_domains', 'exclude_domains')
+
+    def __init__(self, text, regex_source, is_exception=False, important=False,
+                 third_party=None, type_mask=DEFAULT_TYPE_MASK,
+                 include_domains=None, exclude_domains=None):
+        self.text = text
+        self.regex_source = regex_source
+        self._regex = None
+        self.is_exception = is_exception
+        self.important = important
+        self.third_party = third_party
+        self.type_mask = type_mask
+        self.include_domains = include_domains
+        self.exclude_domains = exclude_domains
+
+    @property
+    def regex(self):
+        # Compiled lazily: most rules are never a candidate for any request
+        if self._regex is None:
+            self._regex = re.compile(self.regex_source)
+        return self._regex
+
+    def matches(self, url, type_mask, host, first_party_host):
+        """Check the rule's options and pattern against a request"""
+        if not self.type_mask & type_mask:
+            return False
+        if self.third_party is not None and first_party_host:
+            if is_third_party(host, first_party_host) != self.third_party:
+                return False
+        if self.include_domains or self.exclude_domains:
+            if not first_party_host:
+                if self.include_domains:
+                    return False
+            else:
+                if self.exclude_domains and domain_in(first_party_host, self.exclude_domains):
+                    return False
+                if self.include_domains and not domain_in(first_party_host, self.include_domains):
+                    return False
+        return self.regex.search(url) is not None
+
+    def state(self):
+        """Constructor arguments, used to serialize the rule"""
+        return (self.text, self.regex_source, self.is_exception, self.important,
+                self.third_party, self.type_mask, self.include_domains, self.exclude_domains)
+
+    def __repr__(self):
+        return f"FilterRule({self.text!r})"
+
+
+def _pattern_to_regex(pattern):
+    """Translate an ABP pattern into a regular expression source"""
+    if len(pattern) > 2 and pattern.startswith('/') and pattern.endswith('/'):
+        return pattern[1:-1]
+    prefix = ''
+    if pattern.startswith('||'):
+        prefix = HOST_ANCHOR_RE
+        pattern = pattern[2:]
+    elif pattern.startswith('|'):
+        prefix = '^'
+        pattern = pattern[1:]
+    suffix = ''
+    if pattern.endswith('|'):
+        suffix = '$'
+        pattern = pattern[:-1]
+    body = re.escape(pattern).replace(r'\*', '.*').replace(r'\^', SEPARATOR_RE)
+    return prefix + body + suffix
+
+
+def rule_tokens(pattern):
+    """Return the tokens of a pattern that must appear whole in a matching URL"""
+    if len(pattern) > 2 and pattern.startswith('/') and pattern.endswith('/'):
+        return []
+    left_anchored = pattern.startswith('|')
+    right_anchored = pattern.endswith('|')
+    body = pattern.lstrip('|').rstrip('|')
+    tokens = []
+    for match in TOKEN_RE.finditer(body):
+        start, end = match.span()
+        before = body[start - 1] if start > 0 else None
+        after = body[end] if end < len(body) else None
+        if before == '*' or after == '*':
+            continue
+        if before is None and not left_anchored:
+            continue
+        if after is None and not right_anchored:
+            continue
+        tokens.append(match.group())
+    return tokens
+
+
+def _parse_options(options, rule):
+    """Apply a `$option,...` list to a rule; return False for unsupported options"""
+    include_types = 0
+    exclude_types = 0
+    for option in options.split(','):
+        option = option.strip()
+        negated = option.startswith('~')
+        name = option[1:] if negated else option
+        if name in ('third-party', '3p'):
+            rule.third_party = not negated
+        elif name in ('first-party', '1p'):
+            rule.third_party = negated
+        elif name.startswith('domain='):
+            include, exclude = set(), set()
+            for domain in name[7:].split('|'):
+                if domain.startswith('~'):
+                    exclude.add(domain[1:])
+                elif domain:
+                    include.add(domain)
+            rule.include_domains = include or None
+            rule.exclude_domains = exclude or None
+        elif name == 'important':
+            rule.important = True
+        elif name == 'match-case':
+            continue
+        else:
+            name = TYPE_ALIASES.get(name, name)
+            if name not in RESOURCE_TYPES:
+                return False
+            if negated:
+                exclude_types |= RESOURCE_TYPES[name]
+            else:
+                include_types |= RESOURCE_TYPES[name]
+    if include_types:
+        rule.type_mask = include_types
+    if exclude_types:
+        rule.type_mask &= ~exclude_types
+    return True
+
+
+def parse_filter(line):
+    """Parse one line of an Adblock Plus filter list into a FilterRule
+
+    Comments, headers, cosmetic filters and rules with unsupported options
+    yield None.
+    """
+    text = line.strip()
+    if not text or text.startswith('!') or text.startswith('['):
+        return None
+    if '##' in text or '#@#' in text or '#?#' in text or '#$#' in text:
+        return None
+
+    is_exception = text.startswith('@@')
+    pattern = text[2:] if is_exception else text
+    options = None
+    dollar = pattern.rfind('$')
+    if dollar >= 0 and not (pattern.startswith('/') and pattern.endswith('/')):
+        pattern, options = pattern[:dollar], pattern[dollar + 1:]
+    is_regex = len(pattern) > 2 and pattern.startswith('/') and pattern.endswith('/')
+    if not is_regex:
+        pattern = pattern.lower() or '*'
+
+    rule = FilterRule(text, _pattern_to_regex(pattern), is_exception=is_exception)
+    if options and not _parse_options(options, rule):
+        return None
+    if is_regex:
+        try:
+            re.compile(rule.regex_source)
+        except re.error:
+            return None
+    return rule, pattern
+
+
+class TokenIndex:
+    """Rules bucketed by their rarest token; '' holds rules without one
+
+    A bucket is either a list of rules or, for an index attached to a
+    snapshot, an (offset, length) span into the snapshot buffer that is
+    unpickled the first time a request touches that token.
+    """
+
+    def __init__(self):
+        self.buckets = {}
+        self.size = 0
+        self._blob = None
+
+    def attach(self, spans, blob, size):
+        """Use lazily-loaded buckets from a snapshot buffer"""
+        self.buckets = spans
+        self._blob = blob
+        self.size = size
+
+    def _materialize(self, token, span):
+        offset, length = span
+        bucket = [FilterRule(*state) for state in pickle.loads(self._blob[offset:offset + length])]
+        self.buckets[token] = bucket
+        return bucket
+
+    def _bucket(self, token):
+        bucket = self.buckets.get(token)
+        if bucket.__class__ is tuple:
+            bucket = self._materialize(token, bucket)
+        return bucket
+
+    def items(self):
+        """Yield (token, rules) for every bucket, loading any lazy ones"""
+        for token in list(self.buckets):
+            yield token, self._bucket(token)
+
+    def add(self, rule, pattern):
+        tokens = [t for t in rule_tokens(pattern) if t not in BAD_TOKENS] or rule_tokens(pattern)
+        if tokens:
+            # Prefer the least populated bucket, then the longest token
+            key = min(tokens, key=lambda t: (len(self._bucket(t) or ()), -len(t)))
+        else:
+            key = ''
+        bucket = self._bucket(key)
+        if bucket is None:
+            self.buckets[key] = [rule]
+        else:
+            bucket.append(rule)
+        self.size += 1
+
+    def reorder(self, hits):
+        """Move frequently matching rules to the front of their buckets"""
+        for token, bucket in list(self.buckets.items()):
+            if bucket.__class__ is list and len(bucket) > 1:
+                # Replaced rather than sorted in place so concurrent lookups
+                # keep iterating a consistent list
+                self.buckets[token] = sorted(bucket, key=lambda rule: -hits.get(rule.text, 0))
+
+    def find(self, url, tokens, type_mask, host, first_party_host):
+        """Return the first rule matching the request, or None"""
+        buckets = self.buckets
+        if not buckets:
+            return None
+        for token in tokens:
+            bucket = buckets.get(token)
+            if bucket:
+                if bucket.__class__ is tuple:
+                    bucket = self._materialize(token, bucket)
+                for rule in bucket:
+                    if rule.matches(url, type_mask, host, first_party_host):
+                        return rule
+        return None
+
+
+class FilterEngine:
+    """Token-indexed matcher for Adblock Plus network filters"""
+
+    def __init__(self):
+        self.blocking = TokenIndex()
+        self.exceptions = TokenIndex()
+        self.important = TokenIndex()
+        # Plain `||domain^` rules, by far the most common kind, bypass the
+        # token index and live in the compact suffix index instead
+        self.domains = DomainSuffixIndex()
+        self.rule_count = 0
+
+    def add_filter(self, line):
+        """Parse and index one filter line; return True if it was accepted"""
+        parsed = parse_filter(line)
+        if parsed is None:
+            return False
+        rule, pattern = parsed
+        host_rule = HOST_RULE_RE.match(pattern)
+        if host_rule and self._is_plain(rule):
+            self.domains.add(host_rule.group(1))
+        elif rule.is_exception:
+            self.exceptions.add(rule, pattern)
+        elif rule.important:
+            self.important.add(rule, pattern)
+        else:
+            self.blocking.add(rule, pattern)
+        self.rule_count += 1
+        return True
+
+    @staticmethod
+    def _is_plain(rule):
+        return (not rule.is_exception and not rule.important and rule.third_party is None
+                and rule.type_mask == DEFAULT_TYPE_MASK
+                and not rule.include_domains and not rule.exclude_domains)
+
+    def add_domains(self, domains):
+        """Bulk-add domains to block; return the number added"""
+        domains = [domain.lower() for domain in domains]
+        self.domains.add_many(domains)
+        self.rule_count += len(domains)
+        return len(domains)
+
+    def add_filters(self, lines):
+        """Index an iterable of filter lines; return the number accepted"""
+        added = 0
+        for line in lines:
+            if self.add_filter(line):
+                added += 1
+        return added
+
+    def reorder_by_hits(self, hits):
+        """Order each token bucket by descending hit count (rule text -> hits)"""
+        for index in (self.blocking, self.exceptions, self.important):
+            index.reorder(hits)
+
+    def match(self, url, resource_type=None, first_party_host=None):
+        """Return the deciding rule for a request, or None if no rule applies
+
+        A blocking rule means the request should be blocked; an exception
+        rule means a blocking rule matched but was overridden.
+        """
+        if not self.rule_count:
+            return None
+        url = url.lower()
+        tokens = dict.fromkeys(TOKEN_RE.findall(url))
+        tokens[''] = None
+        type_mask = RESOURCE_TYPES.get(resource_type, RESOURCE_TYPES['other'])
+        host = extract_host(url)
+
+        rule = self.important.find(url, tokens, type_mask, host, first_party_host)
+        if rule is not None:
+            return rule
+        domain = self.domains.lookup(host) if type_mask & DEFAULT_TYPE_MASK else None
+        if domain is not None:
+            rule = FilterRule(f'||{domain}^', None)
+        else:
+            rule = self.blocking.find(url, tokens, type_mask, host, first_party_host)
+        if rule is None:
+            return None
+        exception = self.exceptions.find(url, tokens, type_mask, host, first_party_host)
+        return exception if exception is not None else rule
+
+    def find_exception(self, url, resource_type=None, first_party_host=None):
+        """Return an exception rule allowing the request, or None"""
+        url = url.lower()
+        tokens = dict.fromkeys(TOKEN_RE.findall(url))
+        tokens[''] = None
+        type_mask = RESOURCE_TYPES.get(resource_type, RESOURCE_TYPES['other'])
+        return self.exceptions.find(url, tokens, type_mask, extract_host(url), first_party_host)
+
+
+class LiteralMatcher:
+    """Aho-Corasick automaton finding any of a set of substrings in one pass
+
+    The trie and its failure links are built once from the patterns and
+    never change afterwards, so a matcher is safe to search from any
+    thread; a changed pattern set gets a new matcher. Small sets are
+    checked with plain substring tests, which beat a per-character
+    Python loop until there are a few dozen patterns.
+    """
+    SCAN_THRESHOLD = 16
+
+    def __init__(self, patterns=()):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [None]
+        self._dict_link = [0]
+        self._terminal = {}
+        for pattern in patterns:
+            self._add(pattern)
+        self._build()
+
+    def __len__(self):
+        return len(self._terminal)
+
+    def __contains__(self, pattern):
+        return pattern in self._terminal
+
+    def _add(self, pattern):
+        """Insert a substring pattern into the trie"""
+        if not pattern or pattern in self._terminal:
+            return
+        node = 0
+        for char in pattern:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(None)
+                self._dict_link.append(0)
+            node = next_node
+        self._output[node] = pattern
+        self._terminal[pattern] = node
+
+    def _build(self):
+        """Compute failure and output links breadth-first"""
+        goto, fail, output, dict_link = self._goto, self._fail, self._output, self._dict_link
+        queue = []
+        for node in goto[0].values():
+            fail[node] = 0
+            dict_link[node] = 0
+            queue.append(node)
+        for node in queue:
+            for char, child in goto[node].items():
+                state = fail[node]
+                while state and char not in goto[state]:
+                    state = fail[state]
+                target = goto[state].get(char, 0)
+                fail[child] = target if target != child else 0
+                dict_link[child] = fail[child] if output[fail[child]] is not None else dict_link[fail[child]]
+                queue.append(child)
+
+    def search(self, text):
+        """Return the first pattern found in text, or None"""
+        if not self._terminal:
+            return None
+        if len(self._terminal) <= self.SCAN_THRESHOLD:
+            for pattern in self._terminal:
+                if pattern in text:
+                    return pattern
+            return None
+        goto, fail, output, dict_link = self._goto, self._fail, self._output, self._dict_link
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state] is not None:
+                return output[state]
+            if dict_link[state]:
+                return output[dict_link[state]]
+        return None
+
+
+class RegexSet:
+    """Several `re.match`-style patterns merged into a single alternation
+
+    Leading `.*` is stripped so the combined expression is evaluated with
+    one `search` over the URL rather than one full scan per pattern;
+    patterns that cannot be safely merged (backreferences, or a merged
+    expression that fails to compile) are kept and tried separately.
+    """
+    BACKREFERENCE_RE = re.compile(r'\\[1-9]|\(\?P=')
+
+    def __init__(self, patterns=()):
+        self.patterns = list(patterns)
+        self._combined = None
+        self._separate = []
+        self._compile()
+
+    def _compile(self):
+        merged = []
+        self._separate = []
+        # Each pattern gets an outer capturing group; it closes last, so
+        # match.lastindex identifies which pattern matched
+        self._group_patterns = {}
+        group = 1
+        for pattern in self.patterns:
+            compiled = re.compile(pattern)
+            if self.BACKREFERENCE_RE.search(pattern):
+                self._separate.append(compiled)
+                continue
+            self._group_patterns[group] = pattern
+            group += 1 + compiled.groups
+            if pattern.startswith('.*'):
+                merged.append(f'({pattern[2:]})')
+            else:
+                merged.append(fr'\A({pattern})')
+        self._combined = None
+        if merged:
+            try:
+                self._combined = re.compile('|'.join(merged))
+            except re.error:
+                self._separate = [re.compile(pattern) for pattern in self.patterns]
+
+    def match(self, text):
+        """Return the first pattern matching at the start of text, or None"""
+        if self._combined is not None:
+            found = self._combined.search(text)
+            if found:
+                return self._group_patterns[found.lastindex]
+        for regex in self._separate:
+            if regex.match(text):
+                return regex.pattern
+        return None
+
+
+def normalize_url(url):
+    """Cache key form of a URL: lower-cased, without fragment"""
+    return url.split('#', 1)[0].lower()
+
+
+class DecisionCache:
+    """Bounded, thread-safe LRU of block decisions
+
+    Requests arrive on the Chromium IO thread while rule changes happen on
+    the GUI or updater thread, so every access takes a lock. Entries are
+    tagged implicitly by the rule-set generation: passing a newer
+    generation to get() or put() drops everything cached before it, and
+    decisions computed against an older generation are discarded.
+    """
+
+    def __init__(self, maxsize=8192):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._generation = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _check_generation(self, generation):
+        """Drop entries from older generations; False if the caller is stale"""
+        if generation > self._generation:
+            self._entries.clear()
+            self._generation = generation
+        return generation == self._generation
+
+    def get(self, key, generation):
+        """Return the cached decision for key, or None on a miss"""
+        with self._lock:
+            decision = self._entries.get(key) if self._check_generation(generation) else None
+            if decision is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return decision
+
+    def put(self, key, decision, generation):
+        """Store a decision computed against the given generation"""
+        with self._lock:
+            if not self._check_generation(generation):
+                return
+            self._entries[key] = decision
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Return hit/miss counters and current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+class ShardedCounter:
+    """Counters kept in one dict per thread and merged on read
+
+    Only the owning thread ever writes to its shard, so increments from the
+    Chromium IO thread are exact without taking a lock; the lock is only
+    held when a new thread registers its shard.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def add(self, key, amount=1):
+        shard = self._shard()
+        shard[key] = shard.get(key, 0) + amount
+
+    def snapshot(self):
+        """Return the merged counts as a plain dict"""
+        with self._lock:
+            shards = list(self._shards)
+        merged = {}
+        for shard in shards:
+            for key, count in dict(shard).items():
+                merged[key] = merged.get(key, 0) + count
+        return merged
+
+    def get(self, key):
+        return self.snapshot().get(key, 0)
+
+
+class BlockingStats:
+    """Hits per rule, blocks per first-party site, and time spent deciding"""
+
+    def __init__(self):
+        self.rule_hits = ShardedCounter()
+        self.site_blocks = ShardedCounter()
+        self.totals = ShardedCounter()
+
+    def record(self, rule_text, blocked, site, elapsed_ns):
+        """Account for one should_block decision"""
+        totals = self.totals
+        totals.add('requests')
+        totals.add('time_ns', elapsed_ns)
+        if rule_text:
+            self.rule_hits.add(rule_text)
+        if blocked:
+            totals.add('blocked')
+            if site:
+                self.site_blocks.add(site)
+
+    def to_dict(self):
+        """Return all counters, hottest rules and sites first"""
+        totals = self.totals.snapshot()
+        requests = totals.get('requests', 0)
+        return {
+            'requests': requests,
+            'blocked': totals.get('blocked', 0),
+            'time_ns': totals.get('time_ns', 0),
+            'mean_ns': totals.get('time_ns', 0) // requests if requests else 0,
+            'rule_hits': dict(sorted(self.rule_hits.snapshot().items(), key=lambda item: -item[1])),
+            'site_blocks': dict(sorted(self.site_blocks.snapshot().items(), key=lambda item: -item[1])),
+        }
@@ -0,0 +1,105 @@
+import hashlib
+import mmap
+import os
+import pickle
+import struct
+from array import array
+from filter_engine import FilterEngine
+
+# Bump whenever the layout or the meaning of compiled rules changes
+SNAPSHOT_VERSION = 3
+SNAPSHOT_MAGIC = b'APXFLT'
+# magic, version, source digest, domains bytes, table bytes, extras bytes
+HEADER = struct.Struct('<6sH32sQQQ')
+INDEX_NAMES = ('blocking', 'exceptions', 'important')
+
+
+def source_digest(paths, rules=b''):
+    """SHA-256 over the names and contents of the rule source files and the serialized built-in rules"""
+    digest = hashlib.sha256(f"v{SNAPSHOT_VERSION}".encode())
+    digest.update(rules + b'\0')
+    for path in sorted(paths):
+        digest.update(os.path.basename(path).encode() + b'\0')
+        try:
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(chunk)
+        except OSError:
+            digest.update(b'<missing>')
+        digest.update(b'\0')
+    return digest.digest()
+
+
+def save_snapshot(path, engine, literal_matcher, cosmetic_filters, digest):
+    """Serialize a compiled FilterEngine, literal automaton and cosmetic index to path
+
+    Each token bucket is pickled separately so a loaded snapshot only
+    unpickles the buckets that requests actually hit. The file is written
+    to a temporary name and renamed into place.
+    """
+    engine.domains.compact()
+    domains = engine.domains.hashes.tobytes()
+    blobs = bytearray()
+    table = []
+    for name in INDEX_NAMES:
+        index = getattr(engine, name)
+        spans = {}
+        for token, bucket in index.items():
+            blob = pickle.dumps([rule.state() for rule in bucket], protocol=pickle.HIGHEST_PROTOCOL)
+            spans[token] = (len(blobs), len(blob))
+            blobs += blob
+        table.append((name, spans, index.size))
+    table = pickle.dumps(table, protocol=pickle.HIGHEST_PROTOCOL)
+    extras = pickle.dumps({'rule_count': engine.rule_count, 'literal_matcher': literal_matcher,
+                           'cosmetic_filters': cosmetic_filters},
+                          protocol=pickle.HIGHEST_PROTOCOL)
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, digest, len(domains), len(table), len(extras)))
+        f.write(domains)
+        f.write(table)
+        f.write(extras)
+        f.write(blobs)
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(path, digest):
+    """Map a snapshot written by save_snapshot
+
+    Returns (engine, literal_matcher, cosmetic_filters), or None if the
+    file is missing, from another snapshot version or built from different
+    sources. The domain index is copied straight out of the mapping and token buckets
+    stay in it until first use, so no rule is parsed at load time.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return None
+    if len(mapped) < HEADER.size:
+        mapped.close()
+        return None
+    magic, version, stored_digest, domains_size, table_size, extras_size = HEADER.unpack_from(mapped)
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION or stored_digest != digest:
+        mapped.close()
+        return None
+
+    view = memoryview(mapped)
+    offset = HEADER.size
+    engine = FilterEngine()
+    engine.domains.hashes = array('Q')
+    engine.domains.hashes.frombytes(view[offset:offset + domains_size])
+    offset += domains_size
+    table = pickle.loads(view[offset:offset + table_size])
+    offset += table_size
+    extras = pickle.loads(view[offset:offset + extras_size])
+    offset += extras_size
+
+    blobs = view[offset:]
+    for name, spans, size in table:
+        getattr(engine, name).attach(spans, blobs, size)
+    engine.rule_count = extras['rule_count']
+    return engine, extras['literal_matcher'], extras['cosmetic_filters']
@@ -0,0 +1,147 @@
+import json
+import os
+import urllib.error
+import urllib.request
+from email.utils import formatdate
+
+USER_AGENT = "ApexBrowser/1.2 (filter list updater)"
+
+
+class FilterListUpdate:
+    """Outcome of refreshing one filter list source"""
+    __slots__ = ('name', 'status', 'added', 'removed')
+
+    def __init__(self, name, status, added=0, removed=0):
+        self.name = name
+        self.status = status  # 'updated', 'unchanged', 'not-modified' or 'error'
+        self.added = added
+        self.removed = removed
+
+    @property
+    def changed(self):
+        return self.status == 'updated'
+
+    def __repr__(self):
+        return f"FilterListUpdate({self.name!r}, {self.status!r}, +{self.added}, -{self.removed})"
+
+
+def _rule_lines(text):
+    """Set of meaningful lines of a filter list, ignoring comments and blanks"""
+    lines = set()
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith(('!', '[')):
+            continue
+        if line.startswith('#') and not line.startswith(('##', '#@#', '#?#', '#$#')):
+            continue
+        lines.add(line)
+    return lines
+
+
+class FilterListUpdater:
+    """Conditional fetcher for the filter lists configured in adblock_rules.json
+
+    Each source is a dict with a 'name', a 'url' (http(s)://, file:// or a
+    local path, so a local mirror can stand in for the network) and an
+    optional 'format' of 'abp' (default) or 'hosts'. ETag and
+    Last-Modified validators are kept in sources.json next to the lists so
+    unchanged lists are not downloaded again.
+    """
+
+    def __init__(self, sources, filters_dir="data/filters", timeout=30):
+        self.sources = sources
+        self.filters_dir = filters_dir
+        self.timeout = timeout
+        self.metadata_path = os.path.join(filters_dir, "sources.json")
+
+    def _load_metadata(self):
+        try:
+            with open(self.metadata_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_metadata(self, metadata):
+        tmp_path = self.metadata_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(metadata, f, indent=4)
+        os.replace(tmp_path, self.metadata_path)
+
+    def list_path(self, source):
+        """Local path a source's list is stored under"""
+        extension = '.hosts' if source.get('format') == 'hosts' else '.txt'
+        return os.path.join(self.filters_dir, os.path.basename(source['name']) + extension)
+
+    def _fetch(self, url, validators):
+        """Return (text, validators), or (None, validators) if not modified"""
+        if url.startswith('file://') or '://' not in url:
+            path = url[7:] if url.startswith('file://') else url
+            last_modified = formatdate(os.path.getmtime(path), usegmt=True)
+            if validators.get('last_modified') == last_modified:
+                return None, validators
+            with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                return f.read(), {'last_modified': last_modified}
+
+        request = urllib.request.Request(url, headers={'User-Agent': USER_AGENT})
+        if validators.get('etag'):
+            request.add_header('If-None-Match', validators['etag'])
+        if validators.get('last_modified'):
+            request.add_header('If-Modified-Since', validators['last_modified'])
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                charset = response.headers.get_content_charset() or 'utf-8'
+                text = response.read().decode(charset, errors='replace')
+                return text, {
+                    'etag': response.headers.get('ETag'),
+                    'last_modified': response.headers.get('Last-Modified'),
+                }
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return None, validators
+            raise
+
+    def refresh_source(self, source, metadata):
+        """Fetch one source and rewrite its local list if its rules changed"""
+        name = source['name']
+        try:
+            text, validators = self._fetch(source['url'], metadata.get(name, {}))
+        except (OSError, ValueError) as e:
+            print(f"Error fetching filter list {name}: {e}")
+            return FilterListUpdate(name, 'error')
+        if text is None:
+            return FilterListUpdate(name, 'not-modified')
+
+        path = self.list_path(source)
+        try:
+            with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                old_lines = _rule_lines(f.read())
+        except OSError:
+            old_lines = set()
+        new_lines = _rule_lines(text)
+        added = len(new_lines - old_lines)
+        removed = len(old_lines - new_lines)
+        if not added and not removed:
+            metadata[name] = validators
+            return FilterListUpdate(name, 'unchanged')
+
+        try:
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Error writing filter list {name}: {e}")
+            return FilterListUpdate(name, 'error')
+        metadata[name] = validators
+        return FilterListUpdate(name, 'updated', added, removed)
+
+    def refresh(self):
+        """Refresh every configured source; return a list of FilterListUpdate"""
+        os.makedirs(self.filters_dir, exist_ok=True)
+        metadata = self._load_metadata()
+        updates = [self.refresh_source(source, metadata) for source in self.sources]
+        try:
+            self._save_metadata(metadata)
+        except OSError as e:
+            print(f"Error saving filter list metadata: {e}")
+        return updates
@@ -1,90 +1,1066 @@
+import itertools
+import json
+import os
+import queue
+import re
 import sqlite3
-from datetime import datetime
+import threading
+import time
+from datetime import date, datetime, timedelta
+from urllib.parse import urlsplit
+from urllib.request import pathname2url
+
+# Group commit: write queued visits every BATCH_SIZE entries or FLUSH_INTERVAL seconds
+BATCH_SIZE = 100
+FLUSH_INTERVAL = 0.5
+
+SCHEMA_VERSION = 4
+
+# Retention: enforced in the background every RETENTION_INTERVAL seconds,
+# deleting RETENTION_BATCH visits per transaction so writes interleave.
+# Nothing is deleted until the user sets a limit.
+RETENTION_PATH = "data/history_retention.json"
+RETENTION_DEFAULTS = {
+    'max_age_days': None,       # None keeps visits forever
+    'max_visits': None,         # None for no limit
+    'domains': {},              # domain -> days to keep its visits (0 keeps none)
+}
+RETENTION_DELAY = 300
+RETENTION_INTERVAL = 6 * 3600
+RETENTION_BATCH = 1000
+VACUUM_PAGES = 256
+# How a visit was reached, stored in visits.transition
+TRANSITION_LINK = 0
+TRANSITION_TYPED = 1
+TRANSITION_RELOAD = 2
+TRANSITION_REDIRECT = 3
+TRANSITION_FORM = 4
+TRANSITION_BACK_FORWARD = 5
+RECORDED_SCHEMES = ('http', 'https', 'file')
+
+# Import/export: JSON lines of {"url", "title", "visit_time", "transition"}, visit_time
+# in epoch microseconds. Imports commit IMPORT_BATCH visits per transaction.
+IMPORT_BATCH = 10000
+EXPORT_BATCH = 1000
+# Chrome's History stores microseconds since 1601-01-01 UTC
+CHROME_EPOCH_OFFSET_US = 11644473600 * 1000000
+CHROME_CORE_TRANSITIONS = {1: TRANSITION_TYPED, 7: TRANSITION_FORM, 8: TRANSITION_RELOAD}
+CHROME_SUBFRAME_TRANSITIONS = (3, 4)
+CHROME_REDIRECT_FLAGS = 0xC0000000
+# Firefox places.sqlite visit_type; embeds, downloads and framed links are not page visits
+FIREFOX_TRANSITIONS = {2: TRANSITION_TYPED, 5: TRANSITION_REDIRECT, 6: TRANSITION_REDIRECT, 9: TRANSITION_RELOAD}
+FIREFOX_SKIPPED_TYPES = (4, 7, 8)
+
+# One row per distinct URL, one row per visit; times are integer epoch microseconds
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS urls (
+        id INTEGER PRIMARY KEY,
+        url TEXT NOT NULL UNIQUE,
+        title TEXT,
+        visit_count INTEGER NOT NULL DEFAULT 0,
+        last_visit INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS urls_last_visit ON urls (last_visit);
+    CREATE INDEX IF NOT EXISTS urls_title ON urls (IFNULL(title, ''));
+    CREATE TABLE IF NOT EXISTS visits (
+        id INTEGER PRIMARY KEY,
+        url_id INTEGER NOT NULL REFERENCES urls (id),
+        visit_time INTEGER NOT NULL,
+        transition INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS visits_time ON visits (visit_time, url_id);
+    CREATE INDEX IF NOT EXISTS visits_url ON visits (url_id, visit_time);
+    CREATE TABLE IF NOT EXISTS domain_days (
+        day TEXT NOT NULL,
+        domain TEXT NOT NULL,
+        visits INTEGER NOT NULL,
+        urls INTEGER NOT NULL,
+        first_seen INTEGER NOT NULL,
+        last_seen INTEGER NOT NULL,
+        PRIMARY KEY (day, domain)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS domain_days_domain ON domain_days (domain, day);
+    CREATE TABLE IF NOT EXISTS domain_months (
+        month TEXT NOT NULL,
+        domain TEXT NOT NULL,
+        visits INTEGER NOT NULL,
+        urls INTEGER NOT NULL,
+        first_seen INTEGER NOT NULL,
+        last_seen INTEGER NOT NULL,
+        PRIMARY KEY (month, domain)
+    ) WITHOUT ROWID;
+"""
+# Local calendar day (YYYY-MM-DD) of an epoch-microsecond column
+DAY_OF = "date({0} / 1000000, 'unixepoch', 'localtime')"
+ROLLUP_UPSERT = """
+    INSERT INTO {0} VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT ({1}, domain) DO UPDATE SET
+        visits = visits + excluded.visits,
+        urls = urls + excluded.urls,
+        first_seen = MIN(first_seen, excluded.first_seen),
+        last_seen = MAX(last_seen, excluded.last_seen)
+"""
+# Full-text index over urls, kept in sync by triggers. unicode61 splits URLs into
+# their host labels and path segments; the prefix indexes serve "term*" queries.
+SEARCH_SCHEMA = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS urls_fts USING fts5 (
+        title, url, content='urls', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    );
+    CREATE TRIGGER IF NOT EXISTS urls_fts_insert AFTER INSERT ON urls BEGIN
+        INSERT INTO urls_fts (rowid, title, url) VALUES (new.id, new.title, new.url);
+    END;
+    CREATE TRIGGER IF NOT EXISTS urls_fts_delete AFTER DELETE ON urls BEGIN
+        INSERT INTO urls_fts (urls_fts, rowid, title, url) VALUES ('delete', old.id, old.title, old.url);
+    END;
+    CREATE TRIGGER IF NOT EXISTS urls_fts_update AFTER UPDATE OF title, url ON urls
+    WHEN old.title IS NOT new.title OR old.url IS NOT new.url BEGIN
+        INSERT INTO urls_fts (urls_fts, rowid, title, url) VALUES ('delete', old.id, old.title, old.url);
+        INSERT INTO urls_fts (rowid, title, url) VALUES (new.id, new.title, new.url);
+    END;
+"""
+# Most recently visited matching pages that are ranked by bm25 and recency;
+# bounds the ranking work for common words that match a large share of history
+SEARCH_CANDIDATES = 1000
+# Columns search results can be re-sorted by instead of relevance
+SEARCH_SORT_KEYS = {'time': "last_visit", 'url': "url", 'title': "IFNULL(title, '')"}
+SEARCH_TOKEN_RE = re.compile(r"\w+")
+# Keyset columns for each visit ordering; each tuple matches an index so pages
+# are read straight off it, and ends in a unique column so keys never tie
+VISIT_SORT_KEYS = {
+    'time': ("visits.visit_time", "visits.url_id", "visits.id"),
+    'url': ("urls.url", "visits.visit_time", "visits.id"),
+    'title': ("IFNULL(urls.title, '')", "urls.id", "visits.visit_time", "visits.id"),
+}
+
+
+def _now_us():
+    return time.time_ns() // 1000
+
+
+def url_host(url):
+    """Host of a URL without a leading www., as used for per-domain rollups"""
+    try:
+        host = urlsplit(url).hostname or ''
+    except ValueError:
+        return ''
+    return host[4:] if host.startswith('www.') else host
+
+
+def iso_to_epoch_us(value):
+    """Epoch microseconds of a naive local-time ISO string from the old history table, 0 if unreadable
+
+    Whole seconds and microseconds are converted separately so no float rounding creeps in.
+    """
+    try:
+        moment = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return 0
+    return int(moment.replace(microsecond=0).timestamp()) * 1000000 + moment.microsecond
+
+
+def _day_bounds(epoch_us):
+    """(YYYY-MM-DD, start, end) of the local day containing a time, bounds in epoch microseconds"""
+    start = datetime.fromtimestamp(epoch_us / 1e6).replace(hour=0, minute=0, second=0, microsecond=0)
+    end = start + timedelta(days=1)
+    return start.date().isoformat(), int(start.timestamp() * 1e6), int(end.timestamp() * 1e6)
+
+
+def _month_rebuild(where, params=()):
+    """Statements recomputing the domain_months rows matching where from domain_days
+
+    where may use domain and {month}; month rows are always the sum of their day rows.
+    """
+    return [
+        (f"DELETE FROM domain_months WHERE {where.format(month='month')}", params),
+        (f"""
+            INSERT INTO domain_months
+            SELECT substr(day, 1, 7) AS month, domain, SUM(visits), SUM(urls), MIN(first_seen), MAX(last_seen)
+            FROM domain_days WHERE {where.format(month='substr(day, 1, 7)')}
+            GROUP BY month, domain
+        """, params),
+    ]
+
+
+def _date_ranges(start_date, end_date):
+    """Split an inclusive date range into (edge day ranges, whole month range or None)"""
+    start = date.fromisoformat(str(start_date or '1970-01-01'))
+    end = date.fromisoformat(str(end_date or '9999-12-30'))
+    first_month = start if start.day == 1 else (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    after_end = end + timedelta(days=1)
+    end_month = after_end if after_end.day == 1 else after_end.replace(day=1)
+    if first_month >= end_month:
+        return [(start.isoformat(), end.isoformat())], None
+    days = []
+    if start < first_month:
+        days.append((start.isoformat(), (first_month - timedelta(days=1)).isoformat()))
+    if end_month <= end:
+        days.append((end_month.isoformat(), end.isoformat()))
+    last_month = end_month - timedelta(days=1)
+    return days, (first_month.isoformat()[:7], last_month.isoformat()[:7])
+
+
+def _format_time(epoch_us):
+    return datetime.fromtimestamp(epoch_us / 1e6).isoformat(timespec='seconds')
+
+
+def _open_read_only(path):
+    return sqlite3.connect(f"file:{pathname2url(os.path.abspath(path))}?mode=ro", uri=True)
+
+
+def _clean_retention(policy):
+    """Retention policy with limits coerced to non-negative numbers; invalid ones are dropped"""
+    def limit(value, name):
+        if value is None:
+            return None
+        try:
+            if isinstance(value, bool):
+                raise ValueError
+            value = int(value)
+            if value < 0:
+                raise ValueError
+            return value
+        except (TypeError, ValueError):
+            print(f"Ignoring invalid history retention setting {name}: {value!r}")
+            return None
+
+    domains = policy.get('domains') or {}
+    if not isinstance(domains, dict):
+        print(f"Ignoring invalid history retention domains: {domains!r}")
+        domains = {}
+    cleaned = {}
+    for domain, days in domains.items():
+        days = limit(days, domain)
+        if isinstance(domain, str) and domain.strip('.') and days is not None:
+            cleaned[domain] = days
+    return {'max_age_days': limit(policy.get('max_age_days'), 'max_age_days'),
+            'max_visits': limit(policy.get('max_visits'), 'max_visits'),
+            'domains': cleaned}
+
+
+def history_source_format(path):
+    """'chrome', 'firefox' or 'jsonl' for a file to import"""
+    with open(path, 'rb') as f:
+        if f.read(16) != b"SQLite format 3\x00":
+            return 'jsonl'
+    conn = _open_read_only(path)
+    try:
+        tables = {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        visit_columns = {row[1] for row in conn.execute("PRAGMA table_info(visits)")}
+    finally:
+        conn.close()
+    if {'moz_places', 'moz_historyvisits'} <= tables:
+        return 'firefox'
+    if 'urls' in tables and {'url', 'visit_time', 'transition'} <= visit_columns:
+        return 'chrome'
+    raise ValueError("not a Chrome or Firefox history database")
+
+
+def _read_jsonl(path):
+    """Yield (url, title, time, transition) from an export, skipping malformed lines"""
+    # Undecodable bytes become U+FFFD so a wrong or damaged file is skipped line by line
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+                yield (record['url'], record.get('title'), int(record['visit_time']),
+                       int(record.get('transition', TRANSITION_LINK)))
+            except (ValueError, KeyError, TypeError):
+                continue
+
+
+def _read_database(path, sql):
+    """Yield the rows of a query on a read-only connection to another browser's database"""
+    conn = _open_read_only(path)
+    try:
+        cursor = conn.execute(sql)
+        while True:
+            rows = cursor.fetchmany(IMPORT_BATCH)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        conn.close()
+
+
+def _read_chrome(path):
+    for url, title, visit_time, transition in _read_database(path, """
+        SELECT urls.url, urls.title, visits.visit_time, visits.transition
+        FROM visits JOIN urls ON urls.id = visits.url ORDER BY visits.id
+    """):
+        core = transition & 0xFF
+        if core in CHROME_SUBFRAME_TRANSITIONS:
+            continue
+        if transition & CHROME_REDIRECT_FLAGS:
+            kind = TRANSITION_REDIRECT
+        else:
+            kind = CHROME_CORE_TRANSITIONS.get(core, TRANSITION_LINK)
+        yield url, title, visit_time - CHROME_EPOCH_OFFSET_US, kind
+
+
+def _read_firefox(path):
+    for url, title, visit_time, visit_type in _read_database(path, """
+        SELECT moz_places.url, moz_places.title, moz_historyvisits.visit_date, moz_historyvisits.visit_type
+        FROM moz_historyvisits JOIN moz_places ON moz_places.id = moz_historyvisits.place_id
+        ORDER BY moz_historyvisits.id
+    """):
+        if visit_type not in FIREFOX_SKIPPED_TYPES:
+            yield url, title, visit_time, FIREFOX_TRANSITIONS.get(visit_type, TRANSITION_LINK)
+
+
+HISTORY_READERS = {'jsonl': _read_jsonl, 'chrome': _read_chrome, 'firefox': _read_firefox}
+
+
+def fts_query(query):
+    """Turn free text into an FTS5 expression matching every word
+
+    The last word is matched as a prefix since it may still be being typed.
+    """
+    tokens = [f'"{token}"' for token in SEARCH_TOKEN_RE.findall(query)]
+    if tokens and not query[-1:].isspace():
+        tokens[-1] += '*'
+    return " ".join(tokens)
 
 
 class HistoryManager:
-    def __init__(self):
-        self.db_path = "data/history.db"
+    """Browsing history stored in data/history.db
+
+    Writes go through a queue to a background thread that owns one
+    long-lived WAL-mode connection and commits in batches, so navigations
+    never wait on the disk. Reads use a separate connection and see the
+    last committed snapshot without waiting for the writer; call flush()
+    first when a read must include entries queued just before it.
+    """
+
+    def __init__(self, db_path="data/history.db"):
+        self.db_path = db_path
+        self.full_text_search = False
+        # Objects with optional history_visit(url, title, time_us), history_title(url, title),
+        # history_deleted(url), history_cleared() and history_imported() methods,
+        # called on the thread making the change (the writer thread for history_imported)
+        self.observers = []
+        self.retention = self._load_retention()
+        self.last_retention_run = None
+        self.last_import = None
+        self._queue = queue.Queue()
+        self._read_lock = threading.Lock()
+        self._stopped = threading.Event()
         self._init_db()
+        self._reader = self._connect()
+        self._writer = threading.Thread(target=self._write_loop, name="history-writer", daemon=True)
+        self._writer.start()
+        threading.Thread(target=self._retention_loop, name="history-retention", daemon=True).start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        conn.create_function("url_host", 1, url_host, deterministic=True)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
 
     def _init_db(self):
-        """Initialize the history database"""
+        """Create the schema, migrating the old single-table layout if present"""
         try:
             with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS history (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        url TEXT NOT NULL,
-                        title TEXT,
-                        timestamp TEXT NOT NULL
-                    )
-                """)
+                conn.create_function("url_host", 1, url_host, deterministic=True)
+                conn.create_function("iso_to_epoch_us", 1, iso_to_epoch_us, deterministic=True)
+                # Only takes effect on a new database; existing ones are converted by compact()
+                conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                conn.executescript(SCHEMA)
+                version = conn.execute("PRAGMA user_version").fetchone()[0]
+                if version < SCHEMA_VERSION:
+                    legacy = conn.execute(
+                        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'history'"
+                    ).fetchone()
+                    if legacy:
+                        self._migrate_legacy(conn)
+                    if version < 4:
+                        self._build_rollups(conn)
+                self.full_text_search = self._init_search(conn, rebuild=version < 3)
+                conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
                 conn.commit()
         except sqlite3.Error as e:
             print(f"Error initializing history database: {e}")
 
-    def add_entry(self, url, title):
-        """Add a new history entry"""
-        if not url:
+    def _build_rollups(self, conn):
+        """Fill domain_days from the visits already recorded"""
+        conn.execute("DELETE FROM domain_days")
+        conn.execute("CREATE TEMP TABLE url_domains AS SELECT id, url_host(url) AS domain FROM urls")
+        conn.execute(f"""
+            INSERT INTO domain_days (day, domain, visits, urls, first_seen, last_seen)
+            SELECT {DAY_OF.format('visits.visit_time')} AS day, url_domains.domain,
+                   COUNT(*), COUNT(DISTINCT visits.url_id), MIN(visits.visit_time), MAX(visits.visit_time)
+            FROM visits JOIN url_domains ON url_domains.id = visits.url_id
+            WHERE url_domains.domain != ''
+            GROUP BY day, url_domains.domain
+        """)
+        conn.execute("DROP TABLE url_domains")
+        for sql, params in _month_rebuild("1"):
+            conn.execute(sql, params)
+
+    def _init_search(self, conn, rebuild):
+        """Create the FTS5 index; return False if this SQLite lacks FTS5"""
+        try:
+            conn.executescript(SEARCH_SCHEMA)
+        except sqlite3.OperationalError as e:
+            print(f"Full-text history search unavailable: {e}")
+            return False
+        if rebuild:
+            conn.execute("INSERT INTO urls_fts (urls_fts) VALUES ('rebuild')")
+            # Make FTS5's built-in rank weight titles above URLs
+            conn.execute("INSERT INTO urls_fts (urls_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0)')")
+        return True
+
+    def _migrate_legacy(self, conn):
+        """Move rows from the old history(url, title, timestamp) table into urls/visits"""
+        # Bare columns next to MAX(id) come from the latest row, so each URL keeps its last title
+        conn.execute("""
+            INSERT OR IGNORE INTO urls (url, title, visit_count, last_visit)
+            SELECT url, title, visits, iso_to_epoch_us(timestamp)
+            FROM (SELECT url, title, timestamp, COUNT(*) AS visits, MAX(id) FROM history GROUP BY url)
+        """)
+        conn.execute(f"""
+            INSERT INTO visits (url_id, visit_time, transition)
+            SELECT urls.id, iso_to_epoch_us(history.timestamp), {TRANSITION_LINK}
+            FROM history JOIN urls ON urls.url = history.url
+            ORDER BY history.id
+        """)
+        conn.execute("DROP TABLE history")
+
+    def _write_loop(self):
+        """Writer thread: apply queued operations, committing in batches"""
+        try:
+            conn = self._writer_conn = self._connect()
+        except sqlite3.Error as e:
+            print(f"Error opening history database: {e}")
             return
+        visits = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                kind, payload = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                kind, payload = 'commit', None
+
+            if kind in ('visit', 'title'):
+                visits.append(payload)
+                if deadline is None:
+                    deadline = time.monotonic() + FLUSH_INTERVAL
+                if len(visits) < BATCH_SIZE:
+                    continue
+            elif kind == 'execute':
+                self._commit(conn, visits)
+                self._execute(conn, payload)
+            elif kind == 'task':
+                # A generator given the connection; each step is requeued behind newer work
+                self._commit(conn, visits)
+                try:
+                    next(payload)
+                    self._queue.put(('task', payload))
+                except StopIteration:
+                    pass
+                except Exception as e:
+                    # Drop the task; the writer must keep running for everything queued after it
+                    print(f"Error maintaining history database: {e}")
+            # Anything else ('commit', 'flush', 'stop') just forces a commit
+            self._commit(conn, visits)
+            visits = []
+            deadline = None
+
+            if kind in ('flush', 'stop'):
+                payload.set()
+            if kind == 'stop':
+                conn.close()
+                return
 
+    def _commit(self, conn, visits):
+        """Record the pending visits and title updates in one transaction
+
+        Visits are (url, title, time, transition); title updates have no time.
+        """
+        if not visits:
+            return
+        new_visits = [visit for visit in visits if visit[2] is not None]
+        titles = [(title, url) for url, title, visit_time, _ in visits if visit_time is None]
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                timestamp = datetime.now().isoformat()
-                cursor.execute(
-                    "INSERT INTO history (url, title, timestamp) VALUES (?, ?, ?)",
-                    (url, title, timestamp)
+            with conn:
+                self._rollup(conn, new_visits)
+                conn.executemany("""
+                    INSERT INTO urls (url, title, visit_count, last_visit) VALUES (?, NULLIF(?, ''), 1, ?)
+                    ON CONFLICT (url) DO UPDATE SET
+                        title = CASE WHEN excluded.last_visit >= last_visit
+                                     THEN COALESCE(excluded.title, title) ELSE COALESCE(title, excluded.title) END,
+                        visit_count = visit_count + 1,
+                        last_visit = MAX(last_visit, excluded.last_visit)
+                """, [visit[:3] for visit in new_visits])
+                conn.executemany(
+                    "INSERT INTO visits (url_id, visit_time, transition) SELECT id, ?, ? FROM urls WHERE url = ?",
+                    [(visit_time, transition, url) for url, _, visit_time, transition in new_visits]
                 )
-                conn.commit()
+                conn.executemany("UPDATE urls SET title = ? WHERE url = ?", titles)
         except sqlite3.Error as e:
-            print(f"Error adding history entry: {e}")
+            print(f"Error adding history entries: {e}")
+        visits.clear()
+
+    def _rollup(self, conn, visits):
+        """Fold new (url, title, time, transition) visits into the per-day, per-domain totals
+
+        Must run before the visits are inserted: a URL adds to the day's
+        distinct URL count only if it has no earlier visit that day.
+        """
+        totals = {}
+        seen = set()
+        bounds = None
+        for url, _, visit_time, _ in visits:
+            domain = url_host(url)
+            if not domain:
+                continue
+            # Batches almost always fall within one day
+            if bounds is None or not bounds[1] <= visit_time < bounds[2]:
+                bounds = _day_bounds(visit_time)
+            day, start, end = bounds
+            new_url = (url, day) not in seen and conn.execute(
+                "SELECT 1 FROM visits WHERE url_id = (SELECT id FROM urls WHERE url = ?) "
+                "AND visit_time >= ? AND visit_time < ? LIMIT 1",
+                (url, start, end)
+            ).fetchone() is None
+            seen.add((url, day))
+            total = totals.get((day, domain))
+            if total is None:
+                totals[(day, domain)] = [1, int(new_url), visit_time, visit_time]
+            else:
+                total[0] += 1
+                total[1] += new_url
+                total[2] = min(total[2], visit_time)
+                total[3] = max(total[3], visit_time)
+        conn.executemany(ROLLUP_UPSERT.format('domain_days', 'day'),
+                         [(day, domain, *total) for (day, domain), total in totals.items()])
+        months = {}
+        for (day, domain), (count, urls, first_seen, last_seen) in totals.items():
+            total = months.get((day[:7], domain))
+            if total is None:
+                months[(day[:7], domain)] = [count, urls, first_seen, last_seen]
+            else:
+                total[0] += count
+                total[1] += urls
+                total[2] = min(total[2], first_seen)
+                total[3] = max(total[3], last_seen)
+        conn.executemany(ROLLUP_UPSERT.format('domain_months', 'month'),
+                         [(month, domain, *total) for (month, domain), total in months.items()])
+
+    def _execute(self, conn, statements):
+        """Run (sql, params) statements in one transaction"""
+        try:
+            with conn:
+                for sql, params in statements:
+                    conn.execute(sql, params)
+        except sqlite3.Error as e:
+            print(f"Error updating history: {e}")
+
+    def _notify(self, event, *args):
+        for observer in self.observers:
+            handler = getattr(observer, event, None)
+            if handler:
+                handler(*args)
+
+    def _read(self, sql, params):
+        with self._read_lock:
+            return self._reader.execute(sql, params).fetchall()
+
+    def add_entry(self, url, title, transition=TRANSITION_LINK):
+        """Queue a new history entry"""
+        if not url:
+            return
+        visit_time = _now_us()
+        self._queue.put(('visit', (url, title, visit_time, transition)))
+        self._notify('history_visit', url, title, visit_time)
+
+    def update_title(self, url, title):
+        """Queue a new title for a page already in history"""
+        if not url or not title:
+            return
+        self._queue.put(('title', (url, title, None, None)))
+        self._notify('history_title', url, title)
+
+    def flush(self, timeout=5.0):
+        """Block until every queued entry has been committed"""
+        if not self._writer.is_alive():
+            return
+        done = threading.Event()
+        self._queue.put(('flush', done))
+        done.wait(timeout)
+
+    def close(self):
+        """Commit queued entries and stop the writer thread"""
+        self._stopped.set()
+        if self._writer.is_alive():
+            done = threading.Event()
+            self._queue.put(('stop', done))
+            self._writer.join()
+        with self._read_lock:
+            self._reader.close()
+
+    def _load_retention(self):
+        retention = dict(RETENTION_DEFAULTS)
+        try:
+            if os.path.exists(RETENTION_PATH):
+                with open(RETENTION_PATH, 'r') as f:
+                    data = json.load(f)
+                if not isinstance(data, dict):
+                    raise ValueError("Invalid history_retention.json format")
+                retention.update(data)
+        except (OSError, ValueError) as e:
+            print(f"Error loading history retention settings: {e}")
+        return _clean_retention(retention)
+
+    def set_retention(self, max_age_days=None, max_visits=None, domains=None):
+        """Change and save the retention policy; it applies from the next run"""
+        self.retention = _clean_retention({'max_age_days': max_age_days, 'max_visits': max_visits,
+                                           'domains': domains or {}})
+        try:
+            with open(RETENTION_PATH, 'w') as f:
+                json.dump(self.retention, f, indent=4)
+        except OSError as e:
+            print(f"Error saving history retention settings: {e}")
+
+    def _retention_loop(self):
+        delay = RETENTION_DELAY
+        while not self._stopped.wait(delay):
+            self.enforce_retention()
+            delay = RETENTION_INTERVAL
+
+    def enforce_retention(self, wait=False):
+        """Queue a retention run; with wait, block until it finishes and return its metrics"""
+        done = threading.Event()
+        self._queue.put(('task', self._retention_task(dict(self.retention), done)))
+        if wait:
+            done.wait()
+            return self.last_retention_run
+        return None
+
+    def _db_size(self):
+        return sum(os.path.getsize(path) for path in (self.db_path, self.db_path + "-wal")
+                   if os.path.exists(path))
+
+    def _retention_rules(self, conn, policy):
+        """(condition, params) selecting the visits each rule removes"""
+        now = _now_us()
+        day = 86400 * 1000000
+        if policy.get('max_age_days') is not None:
+            yield "visits.visit_time < ?", (now - policy['max_age_days'] * day,)
+        if policy.get('max_visits') is not None:
+            cutoff = conn.execute(
+                "SELECT visit_time FROM visits ORDER BY visit_time DESC LIMIT 1 OFFSET ?",
+                (policy['max_visits'],)
+            ).fetchone()
+            if cutoff:
+                yield "visits.visit_time <= ?", cutoff
+        for domain, days in (policy.get('domains') or {}).items():
+            domain = url_host(f"//{domain.lstrip('.')}") or domain.lower()
+            yield ("visits.visit_time < ? AND visits.url_id IN (SELECT id FROM urls WHERE "
+                   "url_host(url) = ? OR url_host(url) LIKE '%.' || ?)",
+                   (now - days * day, domain, domain))
+
+    def _prune_batch(self, conn, condition, params):
+        """Delete up to RETENTION_BATCH matching visits; return (visits, removed urls)"""
+        rows = conn.execute(
+            f"SELECT visits.id, visits.url_id FROM visits WHERE {condition} LIMIT ?",
+            (*params, RETENTION_BATCH)
+        ).fetchall()
+        if not rows:
+            return 0, []
+        url_ids = [(url_id,) for url_id in {url_id for _, url_id in rows}]
+        with conn:
+            conn.executemany("DELETE FROM visits WHERE id = ?", [(visit_id,) for visit_id, _ in rows])
+            conn.executemany("""
+                UPDATE urls SET
+                    visit_count = (SELECT COUNT(*) FROM visits WHERE url_id = urls.id),
+                    last_visit = IFNULL((SELECT MAX(visit_time) FROM visits WHERE url_id = urls.id), 0)
+                WHERE id = ?
+            """, url_ids)
+            removed = [url for (url,) in conn.execute(
+                f"SELECT url FROM urls WHERE visit_count = 0 AND id IN ({','.join('?' * len(url_ids))})",
+                [url_id for (url_id,) in url_ids]
+            )]
+            conn.executemany("DELETE FROM urls WHERE url = ?", [(url,) for url in removed])
+        return len(rows), removed
+
+    def _retention_task(self, policy, done):
+        """Writer-thread generator: prune in batches, then reclaim free pages"""
+        conn = self._writer_conn
+        started = time.monotonic()
+        size_before = self._db_size()
+        pruned = 0
+        urls_removed = 0
+        try:
+            for condition, params in list(self._retention_rules(conn, policy)):
+                while True:
+                    count, removed = self._prune_batch(conn, condition, params)
+                    pruned += count
+                    urls_removed += len(removed)
+                    for url in removed:
+                        self._notify('history_deleted', url)
+                    if count < RETENTION_BATCH:
+                        break
+                    yield
+            # Rollups hold no URLs and outlive visits, except for domains with their own limit
+            now_us = _now_us()
+            with conn:
+                for domain, days in (policy.get('domains') or {}).items():
+                    domain = url_host(f"//{domain.lstrip('.')}") or domain.lower()
+                    # The cutoff day is included so days=0 clears today's rollup with its visits
+                    cutoff = _day_bounds(now_us - days * 86400 * 1000000)[0]
+                    conn.execute(
+                        "DELETE FROM domain_days WHERE (domain = ? OR domain LIKE ?) AND day <= ?",
+                        (domain, f"%.{domain}", cutoff)
+                    )
+                    for sql, params in _month_rebuild("(domain = ? OR domain LIKE ?)", (domain, f"%.{domain}")):
+                        conn.execute(sql, params)
+            # Databases created before retention existed keep their free pages for
+            # reuse by later writes until compact() converts them
+            incremental = conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+            while incremental and conn.execute("PRAGMA freelist_count").fetchone()[0]:
+                conn.execute(f"PRAGMA incremental_vacuum({VACUUM_PAGES})").fetchall()
+                yield
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+        finally:
+            self.last_retention_run = {
+                'finished': datetime.now().isoformat(timespec='seconds'),
+                'visits_pruned': pruned,
+                'urls_removed': urls_removed,
+                'bytes_reclaimed': max(0, size_before - self._db_size()),
+                'seconds': round(time.monotonic() - started, 3),
+            }
+            done.set()
+
+    def compact(self, wait=False):
+        """Rewrite the database to release its free pages and switch it to incremental vacuum
+
+        VACUUM holds the writer for the whole rewrite (seconds on a large
+        history), so reads wait on it too; it only runs when asked for.
+        With wait, block until it finishes and return True if it succeeded.
+        """
+        done = threading.Event()
+        result = {}
+        self._queue.put(('task', self._compact_task(done, result)))
+        if wait:
+            done.wait()
+            return result.get('ok', False)
+        return None
+
+    def _compact_task(self, done, result):
+        """Writer-thread generator: the whole VACUUM is one step"""
+        conn = self._writer_conn
+        try:
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+            result['ok'] = True
+        except sqlite3.Error as e:
+            print(f"Error compacting history database: {e}")
+        finally:
+            done.set()
+        yield
 
     def get_history(self, limit=100):
-        """Retrieve history entries"""
+        """Retrieve the most recent visits as (url, title, timestamp)"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute(
-                    "SELECT url, title, timestamp FROM history ORDER BY timestamp DESC LIMIT ?",
-                    (limit,)
-                )
-                return cursor.fetchall()
+            rows = self._read("""
+                SELECT urls.url, urls.title, visits.visit_time
+                FROM visits JOIN urls ON urls.id = visits.url_id
+                ORDER BY visits.visit_time DESC LIMIT ?
+            """, (limit,))
         except sqlite3.Error as e:
             print(f"Error retrieving history: {e}")
             return []
+        return [(url, title, _format_time(visit_time)) for url, title, visit_time in rows]
 
-    def search_history(self, query, limit=50):
-        """Search history for entries matching the query"""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute(
-                    "SELECT url, title, timestamp FROM history WHERE url LIKE ? OR title LIKE ? ORDER BY timestamp DESC LIMIT ?",
-                    (f"%{query}%", f"%{query}%", limit)
+    def search_history(self, query, limit=50, sort=None, descending=True):
+        """Search history for pages matching the query
+
+        Words match title and URL tokens (host labels, path segments).
+        Among the most recently visited matching pages, results are
+        ordered by bm25 (titles weighted above URLs) boosted by how
+        recently the page was visited. With sort ('time', 'url' or 'title') the best limit
+        matches are returned ordered by that column instead.
+        """
+        match = fts_query(query)
+        if not match:
+            return []
+        if self.full_text_search:
+            sql = """
+                SELECT url, title, last_visit FROM (
+                    SELECT urls.url, urls.title, urls.last_visit, urls_fts.rank AS score
+                    FROM urls_fts JOIN urls ON urls.id = urls_fts.rowid
+                    WHERE urls_fts MATCH ?
+                    ORDER BY urls.last_visit DESC LIMIT ?
                 )
-                return cursor.fetchall()
+                ORDER BY score * (1.0 + 7.0 / (7.0 + (? - last_visit) / 86400000000.0)) LIMIT ?
+            """
+            params = (match, SEARCH_CANDIDATES, _now_us(), limit)
+        else:
+            sql = "SELECT url, title, last_visit FROM urls WHERE url LIKE ? OR title LIKE ? ORDER BY last_visit DESC LIMIT ?"
+            params = (f"%{query}%", f"%{query}%", limit)
+        if sort is not None:
+            sql = (f"SELECT url, title, last_visit FROM ({sql}) "
+                   f"ORDER BY {SEARCH_SORT_KEYS[sort]} {'DESC' if descending else 'ASC'}")
+        try:
+            rows = self._read(sql, params)
         except sqlite3.Error as e:
             print(f"Error searching history: {e}")
             return []
+        return [(url, title, _format_time(last_visit)) for url, title, last_visit in rows]
 
-    def clear_history(self):
-        """Clear all history entries"""
+    def get_visits_page(self, sort='time', descending=True, after=None, limit=200):
+        """Return one page of visits as ([(url, title, timestamp)], next_key)
+
+        Pages are keyset-paginated: pass the returned next_key as after to
+        read the following page, so every page costs the same however deep
+        into history it is. next_key is None on the last page.
+        """
+        columns = VISIT_SORT_KEYS[sort]
+        direction, operator = ("DESC", "<") if descending else ("ASC", ">")
+        where = ""
+        params = []
+        if after is not None:
+            # The bound on the leading column alone lets SQLite seek the index
+            where = (f"WHERE {columns[0]} {operator}= ? AND ({', '.join(columns)}) "
+                     f"{operator} ({', '.join('?' * len(columns))})")
+            params = [after[0], *after]
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute("DELETE FROM history")
-                conn.commit()
+            rows = self._read(f"""
+                SELECT urls.url, urls.title, visits.visit_time, {', '.join(columns)}
+                FROM visits JOIN urls ON urls.id = visits.url_id
+                {where}
+                ORDER BY {', '.join(f'{column} {direction}' for column in columns)}
+                LIMIT ?
+            """, (*params, limit))
         except sqlite3.Error as e:
-            print(f"Error clearing history: {e}")
+            print(f"Error retrieving history: {e}")
+            return [], None
+        next_key = tuple(rows[-1][3:]) if len(rows) == limit else None
+        return [(url, title, _format_time(visit_time)) for url, title, visit_time, *_ in rows], next_key
 
-    def delete_entry(self, url):
-        """Delete a specific history entry"""
+    def top_sites(self, start_date=None, end_date=None, limit=10):
+        """Most visited domains between two dates (inclusive, date or YYYY-MM-DD)
+
+        Returns (domain, visits, url_days, first_seen, last_seen); url_days
+        counts distinct URLs per day summed over the range. Whole months
+        are read from the monthly rollups and only the days at either end
+        from the daily ones, so the cost depends on the range and the
+        number of domains, not on how many visits are stored.
+        """
+        day_ranges, months = _date_ranges(start_date, end_date)
+        parts = ["SELECT domain, visits, urls, first_seen, last_seen FROM domain_days WHERE day BETWEEN ? AND ?"
+                 for _ in day_ranges]
+        params = [value for day_range in day_ranges for value in day_range]
+        if months:
+            parts.append("SELECT domain, visits, urls, first_seen, last_seen FROM domain_months "
+                         "WHERE month BETWEEN ? AND ?")
+            params.extend(months)
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute("DELETE FROM history WHERE url = ?", (url,))
-                conn.commit()
+            rows = self._read(f"""
+                SELECT domain, SUM(visits) AS total, SUM(urls), MIN(first_seen), MAX(last_seen)
+                FROM ({' UNION ALL '.join(parts)})
+                GROUP BY domain ORDER BY total DESC LIMIT ?
+            """, (*params, limit))
+        except sqlite3.Error as e:
+            print(f"Error retrieving top sites: {e}")
+            return []
+        return [(domain, visits, urls, _format_time(first), _format_time(last))
+                for domain, visits, urls, first, last in rows]
+
+    def daily_usage(self, domain=None, start_date=None, end_date=None):
+        """Per-day (day, visits, urls, first_seen, last_seen) for one domain or all of them"""
+        params = [str(start_date or '0000-00-00'), str(end_date or '9999-12-31')]
+        where = "day BETWEEN ? AND ?"
+        if domain:
+            where = "domain = ? AND " + where
+            params.insert(0, url_host(f"//{domain}") or domain)
+        try:
+            rows = self._read(f"""
+                SELECT day, SUM(visits), SUM(urls), MIN(first_seen), MAX(last_seen)
+                FROM domain_days WHERE {where}
+                GROUP BY day ORDER BY day
+            """, params)
         except sqlite3.Error as e:
-            print(f"Error deleting history entry: {e}")
+            print(f"Error retrieving usage: {e}")
+            return []
+        return [(day, visits, urls, _format_time(first), _format_time(last))
+                for day, visits, urls, first, last in rows]
+
+    def _iter_rows(self, sql, params, batch_size):
+        """Yield the rows of a query read batch by batch on a connection of its own"""
+        self.flush()
+        try:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+        except sqlite3.Error as e:
+            print(f"Error reading history: {e}")
+            return
+        try:
+            cursor = conn.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        except sqlite3.Error as e:
+            print(f"Error reading history: {e}")
+        finally:
+            conn.close()
+
+    def iter_urls(self, limit=None, batch_size=1000):
+        """Yield (url, title, visit_count, last_visit) for each page, most recent first
+
+        Uses its own connection so a background thread can walk a large
+        history without holding up other reads.
+        """
+        return self._iter_rows(
+            "SELECT url, title, visit_count, last_visit FROM urls ORDER BY last_visit DESC LIMIT ?",
+            (-1 if limit is None else limit,), batch_size
+        )
+
+    def iter_visits(self, batch_size=EXPORT_BATCH):
+        """Yield (url, title, visit_time, transition) for every visit, oldest first"""
+        return self._iter_rows("""
+            SELECT urls.url, urls.title, visits.visit_time, visits.transition
+            FROM visits JOIN urls ON urls.id = visits.url_id
+            ORDER BY visits.visit_time, visits.url_id
+        """, (), batch_size)
+
+    def export_history(self, path, progress=None):
+        """Write every visit to path as JSON lines; return the number written, or None on error
+
+        progress(visits_written) is called every EXPORT_BATCH visits. The file
+        is written beside path and renamed into place once complete.
+        """
+        count = 0
+        try:
+            with open(path + ".part", 'w', encoding='utf-8') as f:
+                for url, title, visit_time, transition in self.iter_visits():
+                    f.write(json.dumps({'url': url, 'title': title, 'visit_time': visit_time,
+                                        'transition': transition}, ensure_ascii=False) + "\n")
+                    count += 1
+                    if progress and count % EXPORT_BATCH == 0:
+                        progress(count)
+            os.replace(path + ".part", path)
+        except OSError as e:
+            print(f"Error exporting history: {e}")
+            return None
+        return count
+
+    def import_history(self, path, source_format=None, progress=None, wait=False):
+        """Queue an import of a JSON lines export, a Chrome History or a Firefox places.sqlite file
+
+        The format is detected when not given. Visits already in history
+        (same URL and time) are skipped, so importing a file twice is
+        harmless. progress(visits_read, visits_imported) is called on the
+        writer thread after each batch. Returns False if the file cannot be
+        read; with wait, blocks and returns the import's metrics.
+        """
+        try:
+            reader = HISTORY_READERS[source_format or history_source_format(path)]
+        except (OSError, ValueError, KeyError, sqlite3.Error) as e:
+            print(f"Error importing history from {path}: {e}")
+            return False
+        done = threading.Event()
+        self._queue.put(('task', self._import_task(reader(path), progress, done)))
+        if wait:
+            done.wait()
+            return self.last_import
+        return True
+
+    def _new_visits(self, conn, batch):
+        """The visits of an import batch that are not already recorded"""
+        seen = set()
+        visits = []
+        for url, title, visit_time, transition in batch:
+            key = (url, visit_time)
+            if not url or key in seen or url.split(':', 1)[0].lower() not in RECORDED_SCHEMES:
+                continue
+            seen.add(key)
+            if conn.execute(
+                "SELECT 1 FROM visits WHERE url_id = (SELECT id FROM urls WHERE url = ?) AND visit_time = ?",
+                key
+            ).fetchone() is None:
+                visits.append((url, title or None, visit_time, transition))
+        return visits
+
+    def _import_task(self, source, progress, done):
+        """Writer-thread generator: commit IMPORT_BATCH source visits per step"""
+        conn = self._writer_conn
+        started = time.monotonic()
+        read = imported = 0
+        error = None
+        try:
+            while True:
+                batch = list(itertools.islice(source, IMPORT_BATCH))
+                if not batch:
+                    break
+                read += len(batch)
+                visits = self._new_visits(conn, batch)
+                imported += len(visits)
+                self._commit(conn, visits)
+                if progress:
+                    progress(read, imported)
+                yield
+        except Exception as e:
+            print(f"Error importing history: {e}")
+            error = str(e)
+        finally:
+            self.last_import = {
+                'finished': datetime.now().isoformat(timespec='seconds'),
+                'visits_read': read,
+                'visits_imported': imported,
+                'visits_skipped': read - imported,
+                'error': error,
+                'seconds': round(time.monotonic() - started, 3),
+            }
+            try:
+                if imported:
+                    self._notify('history_imported')
+            finally:
+                done.set()
+
+    def clear_history(self):
+        """Clear all history entries"""
+        self._queue.put(('execute', [
+            ("DELETE FROM visits", ()),
+            ("DELETE FROM urls", ()),
+            ("DELETE FROM domain_days", ()),
+            ("DELETE FROM domain_months", ()),
+        ]))
+        # Views refresh right after clearing, so let them read the result
+        self.flush()
+        self._notify('history_cleared')
+
+    def delete_entry(self, url):
+        """Delete a page and all of its visits"""
+        self._queue.put(('execute', [
+            # Take the page's visits back out of the daily rollups first
+            (f"""
+                UPDATE domain_days SET
+                    visits = visits - (
+                        SELECT COUNT(*) FROM visits
+                        WHERE url_id = (SELECT id FROM urls WHERE url = :url)
+                        AND {DAY_OF.format('visit_time')} = domain_days.day
+                    ),
+                    urls = urls - 1
+                WHERE domain = url_host(:url) AND day IN (
+                    SELECT DISTINCT {DAY_OF.format('visit_time')} FROM visits
+                    WHERE url_id = (SELECT id FROM urls WHERE url = :url)
+                )
+            """, {'url': url}),
+            ("DELETE FROM domain_days WHERE visits <= 0", ()),
+            *_month_rebuild(
+                "domain = url_host(:url) AND {month} IN (SELECT DISTINCT substr("
+                + DAY_OF.format('visit_time')
+                + ", 1, 7) FROM visits WHERE url_id = (SELECT id FROM urls WHERE url = :url))",
+                {'url': url}
+            ),
+            ("DELETE FROM visits WHERE url_id = (SELECT id FROM urls WHERE url = ?)", (url,)),
+            ("DELETE FROM urls WHERE url = ?", (url,)),
+        ]))
+        self.flush()
+        self._notify('history_deleted', url)
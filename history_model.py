@@ -0,0 +1,123 @@
+from collections import OrderedDict
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, Qt
+
+PAGE_SIZE = 200
+# Pages kept in memory; others are re-read from their keyset start when scrolled back to
+CACHED_PAGES = 16
+# Matches shown for a search; the search index ranks them, so no paging is needed
+SEARCH_LIMIT = 1000
+
+
+class HistoryTableModel(QAbstractTableModel):
+    """Visits from HistoryManager, read page by page as the view scrolls
+
+    Only the keyset start of each page seen so far and a small LRU of page
+    contents are held, so memory stays flat however far the user scrolls.
+    Sorting is done by the database; a filter switches to the full-text
+    search results, in relevance order until a column header is clicked.
+    """
+    COLUMNS = ("URL", "Title", "Timestamp")
+    SORT_KEYS = ('url', 'title', 'time')
+
+    def __init__(self, history_manager, parent=None):
+        super().__init__(parent)
+        self.history_manager = history_manager
+        self.sort_key = 'time'
+        self.descending = True
+        self.filter_text = ""
+        self.search_sort = None         # column the search results are sorted by, None for relevance
+        self._row_count = 0
+        self._page_starts = [None]      # keyset key preceding each page
+        self._pages = OrderedDict()     # page number -> rows
+        self._exhausted = False
+        self._search_rows = None
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self._row_count
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.COLUMNS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.COLUMNS[section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role not in (Qt.DisplayRole, Qt.ToolTipRole):
+            return None
+        row = self.row_at(index.row())
+        if row is None:
+            return None
+        if role == Qt.ToolTipRole:
+            return row[0]
+        value = row[index.column()]
+        return (value or "Untitled") if index.column() == 1 else value
+
+    def row_at(self, row):
+        """(url, title, timestamp) of a row, fetching its page if it was evicted"""
+        if self._search_rows is not None:
+            return self._search_rows[row] if 0 <= row < len(self._search_rows) else None
+        page_number, offset = divmod(row, PAGE_SIZE)
+        page = self._pages.get(page_number)
+        if page is None:
+            if page_number >= len(self._page_starts):
+                return None
+            page, _ = self._fetch_page(self._page_starts[page_number])
+            self._cache_page(page_number, page)
+        else:
+            self._pages.move_to_end(page_number)
+        return page[offset] if offset < len(page) else None
+
+    def _fetch_page(self, after):
+        return self.history_manager.get_visits_page(self.sort_key, self.descending, after, PAGE_SIZE)
+
+    def _cache_page(self, page_number, page):
+        self._pages[page_number] = page
+        while len(self._pages) > CACHED_PAGES:
+            self._pages.popitem(last=False)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self._exhausted
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self._exhausted:
+            return
+        page_number = self._row_count // PAGE_SIZE
+        page, next_key = self._fetch_page(self._page_starts[page_number])
+        if next_key is None:
+            self._exhausted = True
+        else:
+            self._page_starts.append(next_key)
+        if not page:
+            return
+        self._cache_page(page_number, page)
+        self.beginInsertRows(QModelIndex(), self._row_count, self._row_count + len(page) - 1)
+        self._row_count += len(page)
+        self.endInsertRows()
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        self.sort_key = self.SORT_KEYS[column]
+        self.descending = order == Qt.DescendingOrder
+        self.search_sort = self.sort_key if self.filter_text else None
+        self.refresh()
+
+    def set_filter(self, text):
+        self.filter_text = text.strip()
+        self.search_sort = None
+        self.refresh()
+
+    def refresh(self):
+        """Drop everything loaded and start again from the first page"""
+        self.beginResetModel()
+        self._pages.clear()
+        self._page_starts = [None]
+        self._row_count = 0
+        self._exhausted = False
+        self._search_rows = None
+        if self.filter_text:
+            self._search_rows = self.history_manager.search_history(self.filter_text, SEARCH_LIMIT,
+                                                                    self.search_sort, self.descending)
+            self._row_count = len(self._search_rows)
+            self._exhausted = True
+        self.endResetModel()
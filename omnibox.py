@@ -0,0 +1,166 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5.QtCore import QObject, Qt, pyqtSignal
+from PyQt5.QtGui import QStandardItem, QStandardItemModel
+from PyQt5.QtWidgets import QCompleter
+from autocomplete import AutocompleteIndex
+
+SUGGESTION_COUNT = 8
+# Indexes up to this many pages are queried on the GUI thread, larger ones on a worker
+SYNC_QUERY_LIMIT = 50000
+# Most recently visited pages loaded into the index at startup
+HISTORY_LOAD_LIMIT = 200000
+
+
+class Omnibox(QObject):
+    """Autocomplete index shared by every window's URL bar
+
+    Registered as an observer of the history and bookmark managers so the
+    index follows every visit, deletion and bookmark. The initial contents
+    are loaded on a background thread and swapped in when ready.
+    """
+    index_loaded = pyqtSignal(object)
+    # Raised on the history writer thread, handled on the GUI thread
+    history_reload_needed = pyqtSignal()
+
+    _instance = None
+
+    @classmethod
+    def instance(cls, history_manager=None, bookmark_manager=None):
+        if cls._instance is None:
+            cls._instance = cls(history_manager, bookmark_manager)
+        return cls._instance
+
+    def __init__(self, history_manager=None, bookmark_manager=None):
+        if Omnibox._instance is not None:
+            raise RuntimeError("Use Omnibox.instance() to access the singleton")
+        super().__init__()
+        Omnibox._instance = self
+        self.index = AutocompleteIndex()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="Omnibox")
+        self.history_manager = history_manager
+        self.bookmark_manager = bookmark_manager
+        self._pending = []  # Changes made while a load runs, replayed onto it
+        self._loading = False
+        self.index_loaded.connect(self._swap_index)
+        self.history_reload_needed.connect(self._start_load, Qt.QueuedConnection)
+
+        for manager in (history_manager, bookmark_manager):
+            if manager is not None:
+                manager.observers.append(self)
+        self._start_load()
+
+    def _start_load(self):
+        """Build a fresh index on a background thread"""
+        bookmarks = []
+        if self.bookmark_manager is not None:
+            bookmarks = [(b['url'], b.get('title')) for b in self.bookmark_manager.get_bookmarks()]
+        self._loading = True
+        threading.Thread(target=self._load, args=(self.history_manager, bookmarks),
+                         name="OmniboxLoad", daemon=True).start()
+
+    def _load(self, history_manager, bookmarks):
+        index = AutocompleteIndex()
+        rows = ()
+        if history_manager is not None:
+            rows = ((url, title, visit_count, last_visit / 1e6)
+                    for url, title, visit_count, last_visit in history_manager.iter_urls(HISTORY_LOAD_LIMIT))
+        try:
+            index.load(rows, bookmarks)
+        except Exception as e:
+            print(f"Error loading autocomplete index: {e}")
+        self.index_loaded.emit(index)
+
+    def _swap_index(self, index):
+        for method, args in self._pending:
+            getattr(index, method)(*args)
+        self.index = index
+        self._pending = []
+        self._loading = False
+
+    def _apply(self, method, *args):
+        getattr(self.index, method)(*args)
+        if self._loading:
+            self._pending.append((method, args))
+
+    # HistoryManager / BookmarkManager observer interface
+    def history_visit(self, url, title, visit_time):
+        self._apply('record_visit', url, title, visit_time / 1e6)
+
+    def history_title(self, url, title):
+        self._apply('set_title', url, title)
+
+    def history_deleted(self, url):
+        self._apply('remove_history', url)
+
+    def history_cleared(self):
+        self._apply('clear_history')
+
+    def history_imported(self):
+        # Called on the history writer thread; bulk imports are reloaded from the
+        # database on the GUI thread rather than replayed visit by visit
+        self.history_reload_needed.emit()
+
+    def bookmarks_imported(self, count):
+        self._start_load()
+
+    def bookmark_added(self, url, title):
+        self._apply('set_bookmarked', url, title, True)
+
+    def bookmark_removed(self, url):
+        self._apply('set_bookmarked', url, None, False)
+
+    def suggest(self, text, limit=SUGGESTION_COUNT):
+        return self.index.query(text, limit)
+
+
+class OmniboxCompleter(QCompleter):
+    """Suggestion popup for a URL bar, filled from the shared Omnibox index"""
+    suggestions_ready = pyqtSignal(int, list)
+    url_chosen = pyqtSignal(str)
+
+    def __init__(self, omnibox, line_edit):
+        super().__init__(line_edit)
+        self.omnibox = omnibox
+        self.line_edit = line_edit
+        self.request_id = 0
+        self.suggestion_model = QStandardItemModel(self)
+        self.setModel(self.suggestion_model)
+        self.setWidget(line_edit)
+        # The index has already ranked and filtered the rows
+        self.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
+        self.setCompletionRole(Qt.UserRole)
+        self.setMaxVisibleItems(SUGGESTION_COUNT)
+        line_edit.textEdited.connect(self.request_suggestions)
+        self.suggestions_ready.connect(self.show_suggestions)
+        self.activated[str].connect(self.url_chosen)
+
+    def request_suggestions(self, text):
+        self.request_id += 1
+        if not text.strip():
+            self.popup().hide()
+            return
+        if len(self.omnibox.index) <= SYNC_QUERY_LIMIT:
+            self.show_suggestions(self.request_id, self.omnibox.suggest(text))
+        else:
+            self.omnibox.executor.submit(self._lookup, self.request_id, text)
+
+    def _lookup(self, request_id, text):
+        """Worker thread: skip requests overtaken by later keystrokes"""
+        if request_id == self.request_id:
+            self.suggestions_ready.emit(request_id, self.omnibox.suggest(text))
+
+    def show_suggestions(self, request_id, suggestions):
+        if request_id != self.request_id:
+            return
+        self.suggestion_model.clear()
+        for url, title, bookmarked in suggestions:
+            label = f"{title} — {url}" if title else url
+            item = QStandardItem(f"★ {label}" if bookmarked else label)
+            item.setData(url, Qt.UserRole)
+            item.setToolTip(url)
+            self.suggestion_model.appendRow(item)
+        if suggestions:
+            self.complete()
+        else:
+            self.popup().hide()
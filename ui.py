@@ -1,16 +1,21 @@
+import threading
 from PyQt5.QtWidgets import (QWidget, QHBoxLayout, QVBoxLayout, QPushButton,
                              QLineEdit, QFileDialog, QMenu, QAction,
                              QComboBox, QTabBar, QLabel,
                              QFrame, QSizePolicy, QDialog, QMessageBox,
-                             QTableWidget, QTableWidgetItem, QHeaderView)
+                             QTableWidget, QTableWidgetItem, QTableView, QHeaderView,
+                             QProgressDialog, QApplication)
 from PyQt5.QtCore import QUrl, Qt, pyqtSignal, QSize, QTimer, QPropertyAnimation, QEasingCurve
 from PyQt5.QtGui import QIcon, QPixmap, QCursor, QFont, QPalette, QColor
+from omnibox import Omnibox, OmniboxCompleter
+from history_model import HistoryTableModel
 
 
 class BrowserUI:
     def __init__(self, parent):
         self.parent = parent
         self.url_bar = None
+        self.omnibox_completer = None
         self.settings_menu = None
         self.theme = "light"
         self.setup_fonts()
@@ -66,6 +71,10 @@ class BrowserUI:
         self.url_bar.setFont(self.url_font)
         self.url_bar.setClearButtonEnabled(True)
         self.url_bar.returnPressed.connect(lambda: self.navigate_to_url(browser.current_browser()))
+        if getattr(browser, 'history_manager', None) or getattr(browser, 'bookmark_manager', None):
+            omnibox = Omnibox.instance(browser.history_manager, browser.bookmark_manager)
+            self.omnibox_completer = OmniboxCompleter(omnibox, self.url_bar)
+            self.omnibox_completer.url_chosen.connect(lambda url: self.open_suggestion(browser, url))
         self.url_bar.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Fixed)
         self.url_bar.setMinimumHeight(32)
         self.url_bar.setMaximumWidth(800)
@@ -200,6 +209,10 @@ class BrowserUI:
                 url_text = 'https://www.google.com/search?q=' + url_text.replace(' ', '+')
         browser.setUrl(QUrl(url_text))
 
+    def open_suggestion(self, browser, url):
+        self.url_bar.setText(url)
+        self.navigate_to_url(browser.current_browser())
+
     def start_loading_animation(self):
         self.parent.loading_bar.setVisible(True)
         self.loading_animation = QPropertyAnimation(self.parent.loading_bar, b"geometry")
@@ -240,13 +253,22 @@ class BrowserUI:
             layout = QVBoxLayout()
             layout.setContentsMargins(8, 8, 8, 8)
 
-            history_table = QTableWidget()
-            history_table.setRowCount(0)
-            history_table.setColumnCount(3)
-            history_table.setHorizontalHeaderLabels(["URL", "Title", "Timestamp"])
+            search_box = QLineEdit()
+            search_box.setPlaceholderText("Search history")
+            search_box.setClearButtonEnabled(True)
+            layout.addWidget(search_box)
+
+            history_model = HistoryTableModel(self.parent.history_manager, history_dialog)
+            history_table = QTableView()
+            history_table.setModel(history_model)
+            history_table.setSortingEnabled(True)
+            history_table.sortByColumn(2, Qt.DescendingOrder)
+            history_table.setSelectionBehavior(QTableView.SelectRows)
+            history_table.verticalHeader().setVisible(False)
+            history_table.verticalHeader().setDefaultSectionSize(24)
             history_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
             history_table.setStyleSheet("""
-                QTableWidget {
+                QTableView {
                     background-color: #ffffff;
                     border: 1px solid #dadce0;
                     border-radius: 4px;
@@ -258,18 +280,21 @@ class BrowserUI:
                     padding: 4px;
                 }
             """)
+            history_table.doubleClicked.connect(
+                lambda index: self.open_history_entry(history_model, index.row(), history_dialog))
 
-            history_entries = self.parent.history_manager.get_history()
-            history_table.setRowCount(len(history_entries))
-            for row, (url, title, timestamp) in enumerate(history_entries):
-                history_table.setItem(row, 0, QTableWidgetItem(url))
-                history_table.setItem(row, 1, QTableWidgetItem(title or "Untitled"))
-                history_table.setItem(row, 2, QTableWidgetItem(timestamp))
+            # Filter once typing pauses rather than on every keystroke
+            filter_timer = QTimer(history_dialog)
+            filter_timer.setSingleShot(True)
+            filter_timer.setInterval(150)
+            filter_timer.timeout.connect(lambda: history_model.set_filter(search_box.text()))
+            search_box.textChanged.connect(filter_timer.start)
 
             layout.addWidget(history_table)
 
             clear_btn = QPushButton("Clear History")
             clear_btn.clicked.connect(self.clear_history)
+            clear_btn.clicked.connect(history_model.refresh)
             clear_btn.setStyleSheet("""
                 QPushButton {
                     background-color: #1a73e8;
@@ -289,6 +314,12 @@ class BrowserUI:
         else:
             self.show_notification("History feature not yet implemented")
 
+    def open_history_entry(self, history_model, row, dialog):
+        entry = history_model.row_at(row)
+        if entry:
+            dialog.accept()
+            self.parent.add_new_tab(entry[0])
+
     def show_downloads(self):
         if hasattr(self.parent, 'download_manager'):
             downloads_dialog = QDialog(self.parent)
@@ -402,12 +433,30 @@ class BrowserUI:
         incognito_action = QAction("Incognito Mode", self.settings_menu)
         clear_cookies_action = QAction("Clear Cookies", self.settings_menu)
         clear_history_action = QAction("Clear History", self.settings_menu)
+        import_history_action = QAction("Import History...", self.settings_menu)
+        export_history_action = QAction("Export History...", self.settings_menu)
+        compact_history_action = QAction("Compact History Database", self.settings_menu)
+        update_filters_action = QAction("Update Ad-Block Filters", self.settings_menu)
+        site_blocking_action = QAction("Toggle Ad Blocking on This Site", self.settings_menu)
+        export_adblock_stats_action = QAction("Export Ad-Block Statistics...", self.settings_menu)
         incognito_action.triggered.connect(self.toggle_incognito_mode)
         clear_cookies_action.triggered.connect(self.clear_cookies)
         clear_history_action.triggered.connect(self.clear_history)
+        import_history_action.triggered.connect(self.import_history)
+        export_history_action.triggered.connect(self.export_history)
+        compact_history_action.triggered.connect(self.compact_history)
+        update_filters_action.triggered.connect(self.update_ad_filters)
+        site_blocking_action.triggered.connect(lambda: self.toggle_site_blocking(browser.current_browser()))
+        export_adblock_stats_action.triggered.connect(self.export_adblock_stats)
         privacy_menu.addAction(incognito_action)
         privacy_menu.addAction(clear_cookies_action)
         privacy_menu.addAction(clear_history_action)
+        privacy_menu.addAction(import_history_action)
+        privacy_menu.addAction(export_history_action)
+        privacy_menu.addAction(compact_history_action)
+        privacy_menu.addAction(update_filters_action)
+        privacy_menu.addAction(site_blocking_action)
+        privacy_menu.addAction(export_adblock_stats_action)
 
         self.settings_menu.addMenu(theme_menu)
         self.settings_menu.addMenu(zoom_menu)
@@ -415,11 +464,14 @@ class BrowserUI:
         self.settings_menu.addSeparator()
         downloads_action = QAction("Downloads", self.settings_menu)
         downloads_action.triggered.connect(self.show_downloads)
+        import_bookmarks_action = QAction("Import Bookmarks...", self.settings_menu)
+        import_bookmarks_action.triggered.connect(self.import_bookmarks)
         extensions_action = QAction("Extensions", self.settings_menu)
         extensions_action.triggered.connect(self.show_extensions)
         about_action = QAction("About Apex Browser", self.settings_menu)
         about_action.triggered.connect(self.show_about)
         self.settings_menu.addAction(downloads_action)
+        self.settings_menu.addAction(import_bookmarks_action)
         self.settings_menu.addAction(extensions_action)
         self.settings_menu.addSeparator()
         self.settings_menu.addAction(about_action)
@@ -461,6 +513,94 @@ class BrowserUI:
         else:
             self.show_notification("History management not yet implemented")
 
+    def import_history(self):
+        history_manager = getattr(self.parent, 'history_manager', None)
+        if not history_manager:
+            return
+        path, _ = QFileDialog.getOpenFileName(
+            self.parent, "Import History", "",
+            "History Files (*.jsonl History places.sqlite);;All Files (*)")
+        if path:
+            if history_manager.import_history(path):
+                self.show_notification("Importing history...")
+            else:
+                self.show_notification("Not a supported history file")
+
+    def export_history(self):
+        history_manager = getattr(self.parent, 'history_manager', None)
+        if not history_manager:
+            return
+        path, _ = QFileDialog.getSaveFileName(self.parent, "Export History",
+                                              "history.jsonl", "JSON Lines Files (*.jsonl)")
+        if path:
+            # Streams from its own connection, so a large history does not block the window
+            threading.Thread(target=history_manager.export_history, args=(path,),
+                             name="history-export", daemon=True).start()
+            self.show_notification("Exporting history...")
+
+    def import_bookmarks(self):
+        bookmark_manager = getattr(self.parent, 'bookmark_manager', None)
+        if not bookmark_manager:
+            return
+        path, _ = QFileDialog.getOpenFileName(
+            self.parent, "Import Bookmarks", "",
+            "Bookmark Files (*.html *.htm Bookmarks);;All Files (*)")
+        if not path:
+            return
+        dialog = QProgressDialog("Importing bookmarks...", None, 0, 0, self.parent)
+        dialog.setWindowTitle("Import Bookmarks")
+        dialog.setWindowModality(Qt.WindowModal)
+        dialog.setMinimumDuration(500)
+
+        def progress(processed, added):
+            dialog.setLabelText(f"Read {processed} bookmarks, {added} new")
+            QApplication.processEvents()
+
+        added = bookmark_manager.import_bookmarks(path, progress=progress)
+        dialog.close()
+        if added is None:
+            self.show_notification("Not a supported bookmark file")
+        else:
+            self.show_notification(f"Imported {added} bookmarks")
+
+    def compact_history(self):
+        history_manager = getattr(self.parent, 'history_manager', None)
+        if history_manager:
+            history_manager.compact()
+            self.show_notification("Compacting history database...")
+
+    def update_ad_filters(self):
+        ad_blocker = getattr(self.parent, 'ad_blocker', None)
+        if ad_blocker:
+            if ad_blocker.update_rules():
+                self.show_notification("Updating ad-block filters...")
+            else:
+                self.show_notification("Ad-block filter update already running")
+
+    def toggle_site_blocking(self, browser):
+        ad_blocker = getattr(self.parent, 'ad_blocker', None)
+        host = browser.url().host() if browser else ""
+        if ad_blocker and host:
+            allowlisted = not ad_blocker.is_site_allowlisted(host)
+            ad_blocker.set_site_allowlisted(host, allowlisted)
+            state = "disabled" if allowlisted else "enabled"
+            self.show_notification(f"Ad blocking {state} on {host}")
+            if hasattr(browser.page(), 'cosmetic_host'):
+                browser.page().cosmetic_host = None
+            browser.reload()
+
+    def export_adblock_stats(self):
+        ad_blocker = getattr(self.parent, 'ad_blocker', None)
+        if not ad_blocker:
+            return
+        path, _ = QFileDialog.getSaveFileName(self.parent, "Export Ad-Block Statistics",
+                                              "adblock_stats.json", "JSON Files (*.json)")
+        if path:
+            if ad_blocker.export_stats(path):
+                self.show_notification("Ad-block statistics exported")
+            else:
+                self.show_notification("Failed to export ad-block statistics")
+
     def show_extensions(self):
         if hasattr(self.parent, 'extension_handler'):
             extensions_dialog = QDialog(self.parent)